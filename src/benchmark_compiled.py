@@ -0,0 +1,104 @@
+"""
+Eager vs compiled (--compiled, TorchScript) speed of Combined(autoencoder,
+classifier) for every model in autoencoder_dict. Times a forward pass and an
+attack step (forward and gradient with respect to the input) per batch.
+Weights are random: speed does not depend on them, but the dictionary file of
+the chosen dictionary parameters has to exist.
+
+python -m src.benchmark_compiled --classifier_arch resnetwide --test_batch_size 100
+"""
+
+import time
+
+import torch
+import torch.nn as nn
+
+from .parameters import get_arguments
+from .models.autoencoders import autoencoder_dict
+from .models.combined import Combined
+from .models.compiled import compiled_model
+from .models.resnet import ResNet, ResNetWide
+from .models.preact_resnet import PreActResNet101
+
+
+def time_model(model, images, targets, nb_iters, attack_step):
+    cross_ent = nn.CrossEntropyLoss()
+
+    def step():
+        if attack_step:
+            x = images.clone().requires_grad_(True)
+            loss = cross_ent(model(x), targets)
+            torch.autograd.grad(loss, x)
+        else:
+            with torch.no_grad():
+                model(images)
+
+    # warm up
+    for _ in range(2):
+        step()
+
+    if images.is_cuda:
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(nb_iters):
+        step()
+    if images.is_cuda:
+        torch.cuda.synchronize()
+
+    return (time.perf_counter() - start) / nb_iters
+
+
+def main():
+
+    args = get_arguments()
+
+    use_cuda = not args.no_cuda and torch.cuda.is_available()
+    device = torch.device("cuda" if use_cuda else "cpu")
+
+    classifiers = dict(
+        resnet=lambda: ResNet(num_outputs=args.num_classes),
+        resnetwide=lambda: ResNetWide(num_outputs=args.num_classes),
+        preact_resnet=lambda: PreActResNet101(num_classes=args.num_classes),
+    )
+
+    images = torch.rand(args.test_batch_size, 3, *args.image_shape[:2], device=device)
+    targets = torch.randint(0, args.num_classes, (args.test_batch_size,), device=device)
+
+    print(f"{'autoencoder':<42} {'pass':<8} {'eager ms':>9} {'compiled ms':>12} {'speedup':>8}")
+    for autoencoder_arch in autoencoder_dict:
+        args.autoencoder_arch = autoencoder_arch
+        try:
+            autoencoder = autoencoder_dict[autoencoder_arch](args)
+        except (OSError, ValueError, NotImplementedError) as error:
+            # missing dictionary file or unsupported parameters
+            print(f"{autoencoder_arch:<42} skipped: {error}")
+            continue
+        if hasattr(autoencoder, "set_BPDA_type"):
+            # the BPDA form attacks differentiate through
+            autoencoder.set_BPDA_type("identity")
+        model = Combined(autoencoder, classifiers[args.classifier_arch]()).to(device)
+        model.eval()
+        for p in model.parameters():
+            p.requires_grad = False
+
+        # before compiled_model, which swaps the BPDA functions of model
+        eager = {
+            attack_step: time_model(model, images, targets, args.attack_num_steps, attack_step)
+            for attack_step in (False, True)
+        }
+        compiled = compiled_model(model, images)
+        if compiled is model:
+            print(f"{autoencoder_arch:<42} skipped: not traceable")
+            continue
+
+        for attack_step in (False, True):
+            compiled_time = time_model(
+                compiled, images, targets, args.attack_num_steps, attack_step)
+            print(
+                f"{autoencoder_arch:<42} {'attack' if attack_step else 'forward':<8} "
+                f"{1000 * eager[attack_step]:>9.1f} {1000 * compiled_time:>12.1f} "
+                f"{eager[attack_step] / compiled_time:>7.2f}x"
+            )
+
+if __name__ == "__main__":
+    main()
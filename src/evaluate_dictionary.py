@@ -0,0 +1,152 @@
+"""
+How well a dictionary represents test patches, without training anything:
+every test patch is sparse coded with OMP (exactly --top_T atoms) and with
+the LASSO of --dict_lambda (FISTA), and the reconstruction error, sparsity
+and atom usage are reported for both.
+
+python -m src.evaluate_dictionary --dict_nbatoms 500 --dict_lambda 1.0 --top_T 15
+"""
+
+from time import time
+
+import numpy as np
+import torch
+
+from .parameters import get_arguments
+from .learn_patch_dict import extract_patches, stored_images
+from .utils.get_modules import get_dictionary
+from .utils.namers import dict_params_string
+from .utils.read_datasets import cifar10, tiny_imagenet, imagenette
+from .utils.sparse_coding import fista, omp
+
+
+def test_images(args, test_loader, batch_size=200):
+    """ The first args.defense_nbimgs test images as NHWC batches """
+    dataset = test_loader.dataset
+    take = stored_images(dataset)
+    if take is not None:
+        nb_images = min(args.defense_nbimgs, len(dataset))
+        for start in range(0, nb_images, batch_size):
+            yield torch.from_numpy(take(slice(start, min(start + batch_size, nb_images)))).float() / 255.0
+    else:
+        nb_images = 0
+        for images, _ in test_loader:
+            images = images[: args.defense_nbimgs - nb_images]
+            nb_images += len(images)
+            yield images.permute(0, 2, 3, 1)
+            if nb_images >= args.defense_nbimgs:
+                break
+
+
+def usage_summary(usage):
+    """ Unused atoms and the share of selections of the 10% most used atoms """
+    sorted_usage = np.sort(usage)[::-1]
+    top = max(1, len(usage) // 10)
+    return (
+        int((usage == 0).sum()),
+        sorted_usage[:top].sum() / max(sorted_usage.sum(), 1),
+    )
+
+
+def usage_histogram(usage, nb_bins=10):
+    """ Text histogram of how many atoms were selected how often, log bins """
+    edges = np.unique(np.geomspace(1, max(usage.max(), 1) + 1, nb_bins + 1).astype(int))
+    lines = [f"{'never':>21}: {int((usage == 0).sum())}"]
+    for low, high in zip(edges[:-1], edges[1:]):
+        count = int(((usage >= low) & (usage < high)).sum())
+        lines.append(f"{f'[{low}, {high})':>21}: {count:<5} {'#' * min(count, 60)}")
+    return "\n".join(lines)
+
+
+def main():
+
+    args = get_arguments()
+
+    use_cuda = not args.no_cuda and torch.cuda.is_available()
+    device = torch.device("cuda" if use_cuda else "cpu")
+
+    if args.dataset == "CIFAR10":
+        _, test_loader = cifar10(args)
+    elif args.dataset == "Tiny-ImageNet":
+        _, test_loader = tiny_imagenet(args)
+    elif args.dataset == "Imagenette":
+        _, test_loader = imagenette(args)
+    else:
+        raise NotImplementedError
+
+    # row notation, unit norm atoms for OMP
+    dictionary = get_dictionary(args).t().to(device)
+    dictionary = dictionary / dictionary.norm(dim=1, keepdim=True).clamp(min=1e-12)
+    nb_atoms = dictionary.shape[0]
+
+    coders = dict(
+        OMP=lambda X: omp(X, dictionary, args.top_T),
+        LASSO=lambda X: fista(X, dictionary, args.dict_lambda),
+    )
+    totals = {
+        name: dict(squared_error=0.0, energy=0.0, nonzeros=0.0, seconds=0.0,
+                   usage=torch.zeros(nb_atoms, dtype=torch.long, device=device))
+        for name in coders
+    }
+
+    nb_patches = 0
+    nb_values = 0
+    with torch.no_grad():
+        for images in test_images(args, test_loader):
+            patches = extract_patches(
+                images, args.defense_patchshape, args.defense_stride, in_order="NHWC", out_order="NHWC"
+            )
+            patches = patches.reshape(patches.shape[0], -1).to(device)
+            nb_patches += patches.shape[0]
+            nb_values += patches.numel()
+
+            for name, coder in coders.items():
+                start = time()
+                codes = coder(patches)
+                if use_cuda:
+                    torch.cuda.synchronize()
+                totals[name]["seconds"] += time() - start
+
+                nonzero = codes != 0
+                totals[name]["squared_error"] += ((codes @ dictionary - patches) ** 2).sum().item()
+                totals[name]["energy"] += (patches ** 2).sum().item()
+                totals[name]["nonzeros"] += nonzero.sum().item()
+                totals[name]["usage"] += nonzero.sum(dim=0)
+
+    print(f"Dictionary: {dict_params_string(args)}, {nb_atoms} atoms")
+    print(f"Test patches: {nb_patches}")
+    print(f"{'coder':<7} {'MSE':>10} {'PSNR dB':>8} {'rel. error':>11} {'nonzeros':>9} "
+          f"{'unused':>7} {'top 10% share':>14} {'patches/s':>10}")
+    for name, total in totals.items():
+        mse = total["squared_error"] / nb_values
+        usage = total["usage"].cpu().numpy()
+        unused, top_share = usage_summary(usage)
+        print(
+            f"{name:<7} {mse:>10.6f} {10 * np.log10(1 / max(mse, 1e-12)):>8.2f} "
+            f"{total['squared_error'] / max(total['energy'], 1e-12):>11.4f} "
+            f"{total['nonzeros'] / nb_patches:>9.2f} {unused:>7} {top_share:>14.1%} "
+            f"{nb_patches / max(total['seconds'], 1e-12):>10.0f}"
+        )
+        total["usage"] = usage
+
+    for name, total in totals.items():
+        print(f"\nAtom usage, {name} (number of atoms per selection count):")
+        print(usage_histogram(total["usage"]))
+
+    if args.dict_display:
+        import matplotlib.pyplot as plt
+        from .utils import plot_settings
+
+        plt.figure(figsize=(10, 4))
+        for name, total in totals.items():
+            plt.plot(np.sort(total["usage"])[::-1], label=name)
+        plt.yscale("symlog")
+        plt.xlabel("Atoms, most used first")
+        plt.ylabel("Selections")
+        plt.legend()
+        plt.title(f"Atom usage on {nb_patches} {args.dataset} test patches")
+        plt.savefig(args.directory + "figs/dict_usage_" + dict_params_string(args) + ".pdf")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Test accuracy of a trained autoencoder and classifier under several top_T
+and dropout_p values (--sweep_top_T, --sweep_dropout_p) without rebuilding
+the model: per batch the dictionary conv and the topk run once, at the
+largest T, and every configuration is derived from them (top_T_dropout_grid
+in models/encoders.py) before the quantization, decoder and classifier.
+
+python -m src.evaluate_encoder_sweep --autoencoder_arch top_T_dropout_quant_autoencoder --sweep_top_T 10 15 20 --sweep_dropout_p 0.9 0.95
+"""
+
+import torch
+from tqdm import tqdm
+
+from .parameters import get_arguments
+from .models.encoders import top_T_dropout_grid
+from .utils.get_modules import get_autoencoder, get_classifier
+from .utils.metrics import EpochMetrics
+from .utils.read_datasets import cifar10, tiny_imagenet, imagenette
+
+
+def main():
+
+    args = get_arguments()
+
+    use_cuda = not args.no_cuda and torch.cuda.is_available()
+    device = torch.device("cuda" if use_cuda else "cpu")
+
+    if args.dataset == "CIFAR10":
+        _, test_loader = cifar10(args)
+    elif args.dataset == "Tiny-ImageNet":
+        _, test_loader = tiny_imagenet(args)
+    elif args.dataset == "Imagenette":
+        _, test_loader = imagenette(args)
+    else:
+        raise NotImplementedError
+
+    autoencoder = get_autoencoder(args)
+    classifier = get_classifier(args)
+    autoencoder.eval()
+    classifier.eval()
+
+    encoder = autoencoder.encoder
+    if not hasattr(encoder, "T"):
+        print("The sweep needs a top-T encoder.")
+        exit()
+
+    Ts = sorted(args.sweep_top_T or [encoder.T])
+    ps = sorted(args.sweep_dropout_p or [getattr(encoder, "p", 0.0)])
+    activation = getattr(encoder, "activation", None)
+
+    metrics = EpochMetrics()
+    with torch.no_grad():
+        for data, target in tqdm(metrics.timed(test_loader), leave=False):
+            data, target = data.to(device), target.to(device)
+
+            correct = []
+            for _, codes in top_T_dropout_grid(encoder.conv(data), Ts, ps):
+                if activation is not None:
+                    codes = activation(codes, encoder.l1_norms, encoder.jump)
+                output = classifier(autoencoder.decoder(codes))
+                correct.append(output.argmax(dim=1).eq(target).sum())
+
+            metrics.add(correct=torch.stack(correct))
+            metrics.count(data.shape[0])
+
+    correct = metrics.values()["correct"]
+    configurations = [(T, p) for T in Ts for p in ps]
+
+    print(f"Test images: {metrics.nb_samples}, {len(configurations)} configurations, {metrics.report()}")
+    print(f"{'top_T':>6} {'dropout_p':>10} {'test acc':>9}")
+    for (T, p), nb_correct in zip(configurations, correct):
+        print(f"{T:>6} {p:>10.2f} {nb_correct / max(metrics.nb_samples, 1):>9.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Starts one training process per slot for multi-process data-parallel training.
+
+Single host, 4 processes:
+    python -m src.launch --nproc_per_node 4 src.train_classifier --autoencoder_train_supervised
+
+Two hosts, run on each with its own --node_rank:
+    python -m src.launch --nnodes 2 --node_rank 0 --master_addr 10.0.0.1 --nproc_per_node 8 src.train_classifier ...
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+
+def get_launch_arguments():
+    parser = argparse.ArgumentParser(
+        description="Launch data-parallel training processes")
+
+    parser.add_argument(
+        "--nproc_per_node",
+        type=int,
+        default=1,
+        help="Processes to start on this host (default: 1)",
+    )
+    parser.add_argument(
+        "--nnodes",
+        type=int,
+        default=1,
+        help="Number of hosts taking part (default: 1)",
+    )
+    parser.add_argument(
+        "--node_rank",
+        type=int,
+        default=0,
+        help="Index of this host in [0, nnodes) (default: 0)",
+    )
+    parser.add_argument(
+        "--master_addr",
+        type=str,
+        default="127.0.0.1",
+        help="Address of the host with node_rank 0 (default: 127.0.0.1)",
+    )
+    parser.add_argument(
+        "--master_port",
+        type=int,
+        default=29500,
+        help="Free port on the master host (default: 29500)",
+    )
+    parser.add_argument(
+        "module",
+        type=str,
+        help="Training module to run, e.g. src.train_classifier",
+    )
+    parser.add_argument(
+        "module_args",
+        nargs=argparse.REMAINDER,
+        help="Arguments passed on to the training module",
+    )
+
+    return parser.parse_args()
+
+
+def main():
+    args = get_launch_arguments()
+    world_size = args.nnodes * args.nproc_per_node
+
+    # split the cores of this host between its processes
+    threads_per_process = max(1, (os.cpu_count() or 1) // args.nproc_per_node)
+
+    processes = []
+    for local_rank in range(args.nproc_per_node):
+        env = dict(
+            os.environ,
+            RANK=str(args.node_rank * args.nproc_per_node + local_rank),
+            LOCAL_RANK=str(local_rank),
+            WORLD_SIZE=str(world_size),
+            MASTER_ADDR=args.master_addr,
+            MASTER_PORT=str(args.master_port),
+            OMP_NUM_THREADS=os.environ.get(
+                "OMP_NUM_THREADS", str(threads_per_process)),
+        )
+        processes.append(subprocess.Popen(
+            [sys.executable, "-m", args.module] + args.module_args, env=env))
+
+    # if one process fails the others would wait for it forever
+    return_code = 0
+    while processes:
+        for process in list(processes):
+            code = process.poll()
+            if code is None:
+                continue
+            processes.remove(process)
+            if code != 0 and return_code == 0:
+                return_code = code
+                for other in processes:
+                    other.terminate()
+        time.sleep(1)
+
+    sys.exit(return_code)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,14 +2,27 @@
 
 import numpy as np
 from time import time
+from functools import partial
 from sklearn.decomposition import MiniBatchDictionaryLearning
 from torchvision.datasets import CIFAR10
 from argparse import ArgumentParser
+import os
 from os import path
-from .utils.namers import dict_file_namer, dict_params_string
+from .utils.namers import dict_file_namer, dict_params_string, dict_snapshot_namer
+from .utils.checkpointing import atomic_save
+from .utils.samplers import set_loader_epoch
+from .utils.fast_loaders import TensorImageDataset
 from .utils.get_modules import get_dictionary
 from .parameters import get_arguments
 from .utils.read_datasets import cifar10, tiny_imagenet, imagenette
+from .utils.dictionary_learning import TorchDictionaryLearning
+from .utils.patch_sampling import PatchReservoir, reservoir_capacity
+from .utils.patch_selection import (
+    as_float,
+    deduplicate_patches,
+    kmeans_plus_plus_indices,
+    reconstruction_error,
+)
 import torch
 
 
@@ -97,8 +110,110 @@ def extract_patches(images, patch_shape, stride, in_order="NHWC", out_order="NHW
     # plt.close()
 
 
+def stored_images(dataset):
+    """ Function slicing NHWC arrays out of a dataset that keeps its images
+    in memory (torchvision CIFAR10, tensor backend), None for other datasets.
+    Tensor backend images are sliced from their (possibly sharded) storage
+    instead of the data view, which would materialize all of them """
+    if isinstance(dataset, TensorImageDataset):
+        return lambda batch: dataset.take(batch).permute(0, 2, 3, 1).numpy()
+    if hasattr(dataset, "data"):
+        return lambda batch: np.asarray(dataset.data[batch])
+    return None
+
+
+def image_batches(args, train_loader, batch_size=1000):
+    """
+    Train images without padding or augmentation, as NHWC batches. Arrays
+    kept in memory (CIFAR10, tensor backend) are read in slices, uint8;
+    other datasets go through the loader with an unpadded random crop.
+    """
+    dataset = train_loader.dataset
+    take = stored_images(dataset)
+    if take is not None:
+        for start in range(0, len(dataset), batch_size):
+            yield take(slice(start, start + batch_size))
+    else:
+        from torchvision import transforms
+        dataset.transform = transforms.Compose(
+            [
+                transforms.RandomCrop(args.image_shape[:2]),
+                transforms.RandomHorizontalFlip(),
+                transforms.ToTensor(),
+            ]
+        )
+        for x_train, _ in train_loader:
+            yield x_train.permute(0, 2, 3, 1)
+
+
+def learner_device(args):
+    use_cuda = not args.no_cuda and torch.cuda.is_available()
+    return "cuda" if use_cuda else "cpu"
+
+
+def dictionary_learner(args):
+    if args.dict_learner == "torch":
+        return TorchDictionaryLearning(
+            n_components=args.dict_nbatoms,
+            alpha=args.dict_lambda,
+            n_iter=args.dict_iter,
+            batch_size=args.dict_batchsize,
+            random_state=args.seed,
+            device=learner_device(args),
+        )
+    elif args.dict_learner == "sklearn":
+        return MiniBatchDictionaryLearning(
+            n_components=args.dict_nbatoms,
+            alpha=args.dict_lambda,
+            n_iter=args.dict_iter,
+            batch_size=args.dict_batchsize,
+            n_jobs=20,
+        )
+    else:
+        raise NotImplementedError
+
+
+def resume_dictionary(args, dico):
+    """ Loads the snapshot of the same run with --resume, returns the pass and
+    loader batch the patch stream of --dict_online is at """
+    snapshot_filepath = dict_snapshot_namer(args)
+    if not args.resume or not path.exists(snapshot_filepath):
+        return 0, 0
+    if args.dict_learner != "torch":
+        print("Only the torch learner resumes from snapshots.")
+        return 0, 0
+
+    state = torch.load(snapshot_filepath)
+    dico.load_state_dict(state)
+    print("Resuming from iteration {}.".format(dico.n_iter_))
+    return state["stream_epoch"], state["stream_position"]
+
+
+def dictionary_snapshots(args, dico):
+    """ Returns save(stream_epoch=0, stream_position=0), which writes a
+    snapshot of dico when it did --dict_snapshot_interval iterations since
+    the last one """
+    snapshot_filepath = dict_snapshot_namer(args)
+    interval = args.dict_snapshot_interval
+    last_snapshot = [getattr(dico, "n_iter_", 0)]
+
+    def save(stream_epoch=0, stream_position=0):
+        if args.dict_learner != "torch" or interval <= 0:
+            return
+        if dico.n_iter_ - last_snapshot[0] < interval:
+            return
+        state = dico.state_dict()
+        state["stream_epoch"] = stream_epoch
+        state["stream_position"] = stream_position
+        atomic_save(state, snapshot_filepath)
+        last_snapshot[0] = dico.n_iter_
+
+    return save
+
+
 def main():
     args = get_arguments()
+    torch.manual_seed(args.seed)
 
     data_dir = args.directory + "data/"
 
@@ -107,84 +222,120 @@ def main():
     elif args.dataset == "Tiny-ImageNet":
         train_loader, _ = tiny_imagenet(args)
     elif args.dataset == "Imagenette":
-        if not args.dict_online:
-            args.train_batch_size = 9469
         train_loader, _ = imagenette(args)
     else:
         raise NotImplementedError
 
     dict_filepath = dict_file_namer(args)
-    if path.exists(dict_filepath):
+    if args.dict_type == "dct":
+        print("The DCT dictionary is analytic, nothing to learn.")
+        dictionary_transpose = get_dictionary(args).t().numpy()
+    elif path.exists(dict_filepath):
         print("Dictionary already learnt and saved.")
         dictionary_transpose = get_dictionary(args).t().numpy()
     else:
-        if args.dict_online:  # this takes forever
-
-            dico = MiniBatchDictionaryLearning(
-                n_components=args.dict_nbatoms,
-                alpha=args.dict_lambda,
-                n_iter=args.dict_iter,
-                batch_size=args.dict_batchsize,
-                n_jobs=20,
-            )
+        if args.dict_online:  # this takes forever with sklearn
 
-            t0 = time()
-            for x_train, _ in train_loader:
-                train_patches = extract_patches(
-                    x_train, args.defense_patchshape, args.defense_stride, in_order="NCHW", out_order="NHWC"
-                )
-                train_patches = train_patches.reshape(
-                    train_patches.shape[0], -1)
+            dico = dictionary_learner(args)
+            stream_epoch, stream_position = resume_dictionary(args, dico)
+            save_snapshot = dictionary_snapshots(args, dico)
 
-                dico.partial_fit(train_patches)
+            t0 = time()
+            # the torch learner does dict_iter iterations over the stream,
+            # sklearn's does one pass
+            learning = True
+            while learning:
+                first_batch = set_loader_epoch(
+                    train_loader, stream_epoch, stream_position)
+                for batch_idx, (x_train, _) in enumerate(train_loader, first_batch):
+                    # only streamed loaders, which cannot seek, replay batches
+                    if batch_idx < stream_position:
+                        continue
+                    train_patches = extract_patches(
+                        x_train, args.defense_patchshape, args.defense_stride, in_order="NCHW", out_order="NHWC"
+                    )
+                    train_patches = train_patches.reshape(
+                        train_patches.shape[0], -1)
+
+                    # a snapshot in the middle of the batch resumes within it
+                    if args.dict_learner == "torch":
+                        dico.partial_fit(train_patches, callback=partial(
+                            save_snapshot, stream_epoch, batch_idx))
+                    else:
+                        dico.partial_fit(train_patches)
+                    if getattr(dico, "n_iter_", 0) >= args.dict_iter:
+                        break
+                stream_epoch, stream_position = stream_epoch + 1, 0
+                learning = getattr(dico, "n_iter_", args.dict_iter) < args.dict_iter
             dt = time() - t0
             print("done in %.2fs." % dt)
 
         else:
-            if args.dataset == "CIFAR10":
-                x_train = train_loader.dataset.data
-                x_train = x_train / 255.0
-            elif args.dataset == "Imagenette":
-
-                from torchvision import transforms
-                transform_train = transforms.Compose(
-                    [
-                        transforms.RandomCrop((160)),
-                        transforms.RandomHorizontalFlip(),
-                        transforms.ToTensor(),
-                    ]
-                )
-                train_loader.dataset.transform = transform_train
-                x_train = next(iter(train_loader))[0]
-                x_train = x_train.permute(0, 2, 3, 1)
-            # Extract all patches
-            print("Extracting reference patches...")
+            # Sample patches with a bounded memory budget
+            print("Sampling reference patches...")
             t0 = time()
 
-            print("Images shape: {}".format(x_train.shape))
-            train_patches = extract_patches(
-                x_train, args.defense_patchshape, args.defense_stride, in_order="NHWC", out_order="NHWC"
+            nb_features = int(np.prod(args.defense_patchshape))
+            reservoir = PatchReservoir(
+                reservoir_capacity(args.dict_memory_mb,
+                                   nb_features, args.dict_patch_dtype),
+                nb_features,
+                dtype=args.dict_patch_dtype,
+                seed=args.seed,
             )
-            print("Patches shape: {}".format(train_patches.shape))
-
-            train_patches = train_patches.reshape(train_patches.shape[0], -1)
+            for x_train in image_batches(args, train_loader):
+                train_patches = extract_patches(
+                    x_train, args.defense_patchshape, args.defense_stride, in_order="NHWC", out_order="NHWC"
+                )
+                reservoir.add(train_patches.reshape(
+                    train_patches.shape[0], -1))
 
+            print("Patches seen: {}, kept: {}".format(
+                reservoir.nb_seen, len(reservoir)))
             print("done in %.2fs." % (time() - t0))
 
+            train_patches = reservoir.patches(raw=True)
+            # the error of the learned dictionary is measured on patches kept
+            # out of training, taken before deduplication and coreset selection
+            rng = np.random.RandomState(args.seed)
+            held_out = np.zeros(len(train_patches), dtype=bool)
+            held_out[rng.choice(len(train_patches), min(
+                10000, len(train_patches) // 10), replace=False)] = True
+            held_out_patches = train_patches[held_out]
+            train_patches = train_patches[~held_out]
+            if args.dict_dedup_step > 0 or args.dict_coreset_size > 0:
+                print("Selecting patches...")
+                t0 = time()
+                if args.dict_dedup_step > 0:
+                    train_patches = train_patches[deduplicate_patches(
+                        train_patches, args.dict_dedup_step)]
+                    print("Without near-duplicates: {}".format(
+                        len(train_patches)))
+                if args.dict_coreset_size > 0:
+                    train_patches = train_patches[kmeans_plus_plus_indices(
+                        train_patches, args.dict_coreset_size, seed=args.seed, device=learner_device(args))]
+                    print("Coreset: {}".format(len(train_patches)))
+                print("done in %.2fs." % (time() - t0))
+
             print("Learning the dictionary...")
             t0 = time()
-            dico = MiniBatchDictionaryLearning(
-                n_components=args.dict_nbatoms,
-                alpha=args.dict_lambda,
-                n_iter=args.dict_iter,
-                batch_size=args.dict_batchsize,
-                n_jobs=20,
-            )
+            dico = dictionary_learner(args)
+            resume_dictionary(args, dico)
             # we employ column notation i.e. each column is an atom.
             # but sklearn uses row notation i.e. each row is an atom.
             # so what we call dictionary is their components_.transpose()
 
-            dico.fit(train_patches)
+            # the torch learner scales uint8 patches one minibatch at a time
+            if args.dict_learner == "torch":
+                dico.fit(train_patches,
+                         callback=dictionary_snapshots(args, dico))
+            else:
+                dico.fit(as_float(train_patches))
+
+            error, nonzeros = reconstruction_error(
+                held_out_patches, dico.components_, args.dict_lambda, device=learner_device(args))
+            print("Patches kept: {} of {} ({:.1%}), held-out reconstruction MSE: {:.6f}, nonzero codes per patch: {:.1f}".format(
+                len(train_patches), len(reservoir), len(train_patches) / max(len(reservoir), 1), error, nonzeros))
 
         dictionary_transpose = dico.components_
         dt = time() - t0
@@ -192,6 +343,8 @@ def main():
 
         np.savez(dict_filepath, dict=dico.components_,
                  params=dico.get_params())
+        if path.exists(dict_snapshot_namer(args)):
+            os.remove(dict_snapshot_namer(args))
 
     if args.dict_display:
         import matplotlib.pyplot as plt
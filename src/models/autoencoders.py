@@ -41,6 +41,58 @@ class autoencoder_base_class(nn.Module):
             p.requires_grad = False
 
 
+class code_cache_autoencoder(nn.Module):
+    """ Runs an autoencoder on top-T codes read from utils/code_cache.py:
+    only what its encoder does after take_top_T, then the decoder """
+
+    def __init__(self, autoencoder):
+        super(code_cache_autoencoder, self).__init__()
+        self.autoencoder = autoencoder
+
+    def forward(self, codes):
+        return self.autoencoder.decoder(encoder_tail(self.autoencoder.encoder, codes))
+
+
+def prune_autoencoder(autoencoder, atoms):
+    """
+    Keeps only the dictionary atoms at indices atoms: slices the encoder conv
+    and l1_norms along their output channels and the decoder's first
+    transposed conv along its input channels, in place. The result is the
+    same network as the original with the removed atoms never selected.
+    """
+
+    encoder, decoder = autoencoder.encoder, autoencoder.decoder
+    if not isinstance(encoder, encoder_base_class) or not isinstance(encoder.conv, nn.Conv2d):
+        raise NotImplementedError(
+            "Only learned dictionary encoders can be pruned")
+    if len(atoms) < getattr(encoder, "T", 0):
+        raise ValueError(
+            f"Cannot keep {len(atoms)} atoms with top_T {encoder.T}")
+
+    atoms = torch.as_tensor(atoms, dtype=torch.long, device=encoder.conv.weight.device)
+
+    encoder.conv.weight = nn.Parameter(
+        encoder.conv.weight.data[atoms].clone(), requires_grad=False)
+    encoder.conv.out_channels = len(atoms)
+    encoder.l1_norms = nn.Parameter(
+        encoder.l1_norms.data[atoms].clone(), requires_grad=False)
+
+    # ConvTranspose2d weights are (in_channels, out_channels, kH, kW)
+    decoder.conv1.weight = nn.Parameter(
+        decoder.conv1.weight.data[atoms].clone(),
+        requires_grad=decoder.conv1.weight.requires_grad)
+    decoder.conv1.in_channels = len(atoms)
+
+    return autoencoder
+
+
+def atom_usage(encoder, images):
+    """ How often take_top_T selects each atom over the patches of images """
+    codes = encoder.conv(images)
+    _, indices = torch.topk(codes.abs(), encoder.T, dim=1)
+    return torch.bincount(indices.reshape(-1), minlength=codes.shape[1])
+
+
 class quant_autoencoder(autoencoder_base_class):
     def __init__(self, args):
         super(quant_autoencoder, self).__init__(args, "quant_encoder")
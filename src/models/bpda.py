@@ -139,3 +139,102 @@ class activation_quantization_BPDA_identity(torch.autograd.Function):
     @staticmethod
     def backward(ctx, grad_output):
         return grad_output, None, None
+
+
+def compact_indices(indices, nb_channels):
+    """ topk indices in the smallest integer type that holds nb_channels """
+    if nb_channels <= torch.iinfo(torch.int16).max:
+        return indices.to(torch.int16)
+    return indices.to(torch.int32)
+
+
+class take_top_T_lean(torch.autograd.Function):
+    """
+    take_top_T with its exact gradient, saving only int16 indices and int8
+    signs of the T selected values instead of the int64 topk/scatter indices
+    and the dense input autograd keeps for abs
+    """
+
+    @staticmethod
+    def forward(ctx, x, T):
+        values, indices = torch.topk(x.abs(), T, dim=1)
+        signs = torch.sign(x.gather(1, indices)).to(torch.int8)
+        ctx.save_for_backward(compact_indices(indices, x.shape[1]), signs)
+        return torch.zeros_like(x).scatter(1, indices, values)
+
+    @staticmethod
+    def backward(ctx, grad_output):
+        indices, signs = ctx.saved_tensors
+        indices = indices.long()
+        grad_input = torch.zeros_like(grad_output).scatter(
+            1, indices, grad_output.gather(1, indices) * signs.to(grad_output.dtype))
+        return grad_input, None
+
+
+class take_top_T_dropout_lean(torch.autograd.Function):
+    """
+    take_top_T_dropout with its exact gradient. The dropout mask is drawn
+    densely as in take_top_T_dropout, so the same seed drops the same codes,
+    but only its T selected entries are kept and folded into the saved int8
+    signs, so nothing dense is saved.
+    """
+
+    @staticmethod
+    def forward(ctx, x, T, p, seed=None):
+        if seed:
+            torch.manual_seed(seed)
+
+        values, indices = torch.topk(x.abs(), T, dim=1)
+        # 0 or 1 / (1 - p), the same draw as dropout on the top T map
+        scales = dropout(torch.ones_like(x), p=p, training=True).gather(1, indices)
+        signs = (torch.sign(x.gather(1, indices)) * (scales != 0).to(x.dtype)).to(torch.int8)
+        ctx.save_for_backward(compact_indices(indices, x.shape[1]), signs)
+        return torch.zeros_like(x).scatter(1, indices, values * scales * (1 - p))
+
+    @staticmethod
+    def backward(ctx, grad_output):
+        indices, signs = ctx.saved_tensors
+        indices = indices.long()
+        grad_input = torch.zeros_like(grad_output).scatter(
+            1, indices, grad_output.gather(1, indices) * signs.to(grad_output.dtype))
+        # called with or without seed
+        return (grad_input,) + (None,) * (len(ctx.needs_input_grad) - 1)
+
+
+class activation_quantization_BPDA_smooth_step_lean(torch.autograd.Function):
+    """ activation_quantization_BPDA_smooth_step saving the normalized input
+    in half precision, which is enough for the surrogate derivative """
+
+    steepness = 0.0
+
+    def __init__(self, steepness):
+        super(activation_quantization_BPDA_smooth_step_lean, self).__init__()
+        activation_quantization_BPDA_smooth_step_lean.steepness = steepness
+
+    @staticmethod
+    def forward(ctx, x, l1_norms, jump):
+        x = x / l1_norms.view(1, -1, 1, 1)
+
+        ctx.save_for_backward(x.half(), jump)
+
+        x = 0.5 * (torch.sign(x - jump) + torch.sign(x + jump))
+
+        x = x * l1_norms.view(1, -1, 1, 1)
+
+        return x
+
+    @staticmethod
+    def backward(ctx, grad_output):
+        x, jump = ctx.saved_tensors
+        x = x.to(grad_output.dtype)
+        steepness = activation_quantization_BPDA_smooth_step_lean.steepness
+
+        def sech(x):
+            return 1 / torch.cosh(x)
+
+        del_out_over_del_in = 0.5 * steepness * (
+            sech(steepness * (x - jump)) ** 2
+            + sech(steepness * (x + jump)) ** 2
+        )
+
+        return del_out_over_del_in * grad_output, None, None
@@ -0,0 +1,195 @@
+"""
+TorchScript execution of Combined(autoencoder, classifier). Custom autograd
+Functions cannot be traced, so the BPDA functions of bpda.py are first
+replaced with straight-through expressions that have the same forward values
+and the same gradients: surrogate + (exact - surrogate).detach() evaluates to
+exact and differentiates like surrogate.
+"""
+
+import hashlib
+import json
+import os
+from os import path
+
+import torch
+
+from .encoders import take_top_T, take_top_T_dropout
+
+
+def straight_through(exact, surrogate):
+    return surrogate + (exact - surrogate).detach()
+
+
+def take_top_T_straight_through(x, T):
+    """ take_top_T_BPDA_identity """
+    return straight_through(take_top_T(x, T), x)
+
+
+def take_top_T_dropout_straight_through(x, T, p, seed=None):
+    """ take_top_T_dropout_BPDA_identity """
+    return straight_through(take_top_T_dropout(x, T, p, seed), x)
+
+
+def one_module_straight_through(x, module):
+    """ one_module_BPDA_identity """
+    return straight_through(module(x), x)
+
+
+def activation_quantization(x, l1_norms, jump):
+    x = x / l1_norms.view(1, -1, 1, 1)
+    x = 0.5 * (torch.sign(x - jump) + torch.sign(x + jump))
+    return x * l1_norms.view(1, -1, 1, 1)
+
+
+class activation_quantization_straight_through(object):
+    """ activation_quantization_BPDA_identity for steepness 0, otherwise
+    activation_quantization_BPDA_smooth_step: the surrogate is
+    l1_norms * 0.5 * (tanh(s * (x / l1_norms - jump)) + tanh(s * (x / l1_norms + jump))),
+    whose derivative is 0.5 * s * (sech^2(s * (n - jump)) + sech^2(s * (n + jump)))
+    with n = x / l1_norms, the derivative returned by the BPDA backward """
+
+    def __init__(self, steepness=0.0):
+        self.steepness = steepness
+
+    def __call__(self, x, l1_norms, jump):
+        if self.steepness == 0.0:
+            surrogate = x
+        else:
+            normalized = x / l1_norms.view(1, -1, 1, 1)
+            surrogate = 0.5 * (
+                torch.tanh(self.steepness * (normalized - jump))
+                + torch.tanh(self.steepness * (normalized + jump))
+            ) * l1_norms.view(1, -1, 1, 1)
+        return straight_through(activation_quantization(x, l1_norms, jump), surrogate)
+
+
+def use_straight_through_bpda(model):
+    """ Swaps every BPDA autograd Function used by the modules of model for its
+    straight-through equivalent, in place """
+
+    from .bpda import (
+        take_top_T_BPDA_identity,
+        take_top_T_dropout_BPDA_identity,
+        take_top_T_lean,
+        take_top_T_dropout_lean,
+        activation_quantization_BPDA_identity,
+        activation_quantization_BPDA_smooth_step,
+        activation_quantization_BPDA_smooth_step_lean,
+        one_module_BPDA_identity,
+    )
+
+    for module in model.modules():
+        if getattr(module, "fixed_seed", False):
+            raise NotImplementedError(
+                "Reseeding dropout inside forward cannot be traced")
+
+        # Function.apply is bound to the Function class
+        for attribute, replacements in (
+            ("take_top_T", {take_top_T_BPDA_identity: take_top_T_straight_through,
+                            take_top_T_lean: take_top_T}),
+            ("take_top_T_dropout", {
+             take_top_T_dropout_BPDA_identity: take_top_T_dropout_straight_through,
+             take_top_T_dropout_lean: take_top_T_dropout}),
+            ("frontend", {one_module_BPDA_identity: one_module_straight_through}),
+        ):
+            function_class = getattr(
+                module.__dict__.get(attribute), "__self__", None)
+            if function_class in replacements:
+                setattr(module, attribute, replacements[function_class])
+
+        function_class = getattr(
+            module.__dict__.get("activation"), "__self__", None)
+        if function_class is activation_quantization_BPDA_identity:
+            module.activation = activation_quantization_straight_through()
+        elif function_class is activation_quantization_BPDA_smooth_step:
+            module.activation = activation_quantization_straight_through(
+                activation_quantization_BPDA_smooth_step.steepness)
+        elif function_class is activation_quantization_BPDA_smooth_step_lean:
+            module.activation = activation_quantization_straight_through(
+                activation_quantization_BPDA_smooth_step_lean.steepness)
+
+        for attribute, value in module.__dict__.items():
+            function_class = getattr(value, "__self__", None)
+            if isinstance(function_class, type) and issubclass(function_class, torch.autograd.Function):
+                raise NotImplementedError(
+                    f"{function_class.__name__} has no straight-through form")
+
+    return model
+
+
+def compiled_cache_key(model, example_input):
+    """ Identifies a trace: module structure, parameter values, input shape,
+    training mode and torch version """
+
+    checksum = hashlib.sha1()
+    for name, tensor in model.state_dict().items():
+        checksum.update(name.encode())
+        checksum.update(tensor.detach().cpu().numpy().tobytes())
+
+    # which BPDA form each module uses is not visible in repr
+    functions = []
+    for module_name, module in model.named_modules():
+        for attribute, value in sorted(module.__dict__.items()):
+            if attribute.startswith("_") or not callable(value):
+                continue
+            function_name = getattr(value, "__qualname__", type(value).__name__)
+            functions.append(
+                f"{module_name}.{attribute}={function_name}{getattr(value, 'steepness', '')}")
+
+    description = {
+        "model": repr(model),
+        "functions": functions,
+        "parameters": checksum.hexdigest(),
+        "input": list(example_input.shape),
+        "training": model.training,
+        "device": str(example_input.device),
+        "torch": torch.__version__,
+    }
+    return hashlib.sha1(json.dumps(description, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def compiled_model(model, example_input, cache_dir=None, nb_warmup=2):
+    """
+    Traces model in its current training mode. The traced module shares its
+    parameters with model, so it can be trained through. With cache_dir the
+    trace is saved and reused by later runs with the same parameters; only
+    use it for frozen models, loaded traces do not share parameters.
+    Falls back to model if it contains something that cannot be traced.
+    """
+
+    try:
+        use_straight_through_bpda(model)
+    except NotImplementedError as error:
+        print(f"Running eagerly: {error}")
+        return model
+
+    cache_filepath = None
+    if cache_dir is not None:
+        cache_filepath = path.join(
+            cache_dir, compiled_cache_key(model, example_input) + ".pt")
+        if path.exists(cache_filepath):
+            print(f"Compiled model: {cache_filepath}")
+            traced = torch.jit.load(cache_filepath, map_location=example_input.device)
+            if not model.training:
+                traced.eval()
+            return traced
+
+    # dropout makes outputs differ between runs, the trace check would fail
+    traced = torch.jit.trace(model, example_input, check_trace=False)
+
+    # the first calls let the executor specialize and optimize the graph. In
+    # training mode they would update batch norm statistics, there the first
+    # batches warm it up instead
+    if not model.training:
+        with torch.no_grad():
+            for _ in range(nb_warmup):
+                traced(example_input)
+
+    if cache_filepath is not None:
+        if not path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        torch.jit.save(traced, cache_filepath + ".tmp")
+        os.replace(cache_filepath + ".tmp", cache_filepath)
+        print(f"Compiled model saved to {cache_filepath}")
+
+    return traced
@@ -1,3 +1,5 @@
+import math
+
 import torch
 from torch import nn
 import torch.nn.functional as F
@@ -20,6 +22,116 @@ def take_top_T_dropout(x, T, p, seed=None):
     return x
 
 
+def top_T_dropout_grid(x, Ts, ps):
+    """
+    Yields ((T, p), take_top_T_dropout(x, T, p)) for every T in Ts and p in
+    ps from one topk at max(Ts) and one uniform draw: the top T of the sorted
+    top max(Ts) are its first T, and a value is dropped at p when its draw is
+    below p, so larger p drop a superset. Configurations share the draw, as
+    if the same dropout seed was used for all of them.
+    """
+    values, indices = torch.topk(x.abs(), max(Ts), dim=1)
+    draws = torch.rand_like(values)
+    ranks = torch.arange(values.shape[1], device=x.device).reshape(
+        1, -1, *([1] * (x.dim() - 2)))
+
+    for T in Ts:
+        top_values = values * (ranks < T).to(values.dtype)
+        for p in ps:
+            kept = top_values * (draws >= p).to(values.dtype) if p else top_values
+            yield (T, p), torch.zeros_like(x).scatter(1, indices, kept)
+
+
+def encoder_tail(encoder, x):
+    """ What a top_T encoder applies after take_top_T: dropout for dropout
+    encoders and activation quantization for quant encoders """
+
+    p = getattr(encoder, "p", None)
+    if p:
+        x = dropout(x, p=p, training=True)
+        x *= 1 - p
+
+    activation = getattr(encoder, "activation", None)
+    if activation is not None:
+        x = activation(x, encoder.l1_norms, encoder.jump)
+
+    return x
+
+
+def dct_matrix(n):
+    """ Orthonormal DCT-II matrix, row k is the k-th basis vector """
+    positions = torch.arange(n, dtype=torch.float64)
+    frequencies = positions.unsqueeze(1)
+    matrix = torch.cos(math.pi * (2 * positions + 1) * frequencies / (2 * n))
+    matrix[0] *= 1 / math.sqrt(2)
+    return (matrix * math.sqrt(2 / n)).float()
+
+
+def dct_dictionary(patch_size, channels=3):
+    """
+    Separable DCT basis of patch_size x patch_size x channels patches, over
+    rows, columns and channels. Same layout as learned dictionaries: one
+    atom per column, flattened in HWC order, atom (u, v, k) at column
+    (u * patch_size + v) * channels + k.
+    """
+    rows = dct_matrix(patch_size)
+    channel_basis = dct_matrix(channels)
+    atoms = torch.einsum("ui,vj,kc->uvkijc", rows, rows, channel_basis)
+    return atoms.reshape(patch_size * patch_size * channels, -1).t()
+
+
+class separable_dct_conv(nn.Module):
+    """
+    Conv2d with the DCT dictionary computed as a separable transform: a 1D
+    DCT over channels, then rows, then columns of every patch, ~(3 + 2p)
+    multiplies per output instead of 3p^2. weight is the equivalent dense
+    kernel, and in_channels, out_channels, kernel_size, stride and padding
+    are those of the equivalent nn.Conv2d, so callers reading them are
+    unchanged.
+    """
+
+    def __init__(self, patch_size, stride, channels=3):
+        super(separable_dct_conv, self).__init__()
+        self.patch_size = patch_size
+        self.channels = channels
+        self.in_channels = channels
+        self.out_channels = patch_size * patch_size * channels
+        self.kernel_size = (patch_size, patch_size)
+        self.stride = (stride, stride)
+        self.padding = (0, 0)
+        self.weight = nn.Parameter(
+            dct_dictionary(patch_size, channels).t()
+            .reshape(-1, patch_size, patch_size, channels)
+            .permute(0, 3, 1, 2), requires_grad=False)
+        self.factors = {}
+
+    def bases(self, x):
+        key = (x.device, x.dtype)
+        if key not in self.factors:
+            self.factors[key] = (
+                dct_matrix(self.channels).to(x.device, x.dtype),
+                dct_matrix(self.patch_size).to(x.device, x.dtype),
+            )
+        return self.factors[key]
+
+    def forward(self, x):
+        channel_basis, rows = self.bases(x)
+        p, s = self.patch_size, self.stride[0]
+        N, C, H, W = x.shape
+
+        x = torch.einsum("kc,nchw->nkhw", channel_basis, x)
+        x = F.conv2d(x.reshape(N * C, 1, H, W),
+                     rows[:, None, :, None], stride=(s, 1))
+        H_out = x.shape[2]
+        x = F.conv2d(x.reshape(N * C * p, 1, H_out, W),
+                     rows[:, None, None, :], stride=(1, s))
+        W_out = x.shape[3]
+
+        # (n, k, u, v) -> atom (u, v, k)
+        x = x.reshape(N, C, p, p, H_out, W_out).permute(0, 2, 3, 1, 4, 5)
+        return x.reshape(N, p * p * C, H_out, W_out)
+
+
 class encoder_base_class(nn.Module):
     def __init__(self, args):
         super(encoder_base_class, self).__init__()
@@ -29,6 +141,13 @@ class encoder_base_class(nn.Module):
         dictionary = get_dictionary(args)
         self.set_l1_norms(dictionary)
         self.set_jump(args.activation_beta * args.defense_epsilon)
+        # BPDA forms that save less for backward, see bpda.py
+        self.lean_bpda = args.attack_lean_bpda
+        if args.dict_type == "dct":
+            self.conv = separable_dct_conv(
+                args.defense_patchsize, args.defense_stride)
+            return
+
         self.conv = nn.Conv2d(
             3,
             args.dict_nbatoms,
@@ -84,9 +203,16 @@ class quant_encoder(encoder_base_class):
             from .bpda import activation_quantization_BPDA_identity
             self.activation = activation_quantization_BPDA_identity().apply
         else:
-            from .bpda import activation_quantization_BPDA_smooth_step
-            self.activation = activation_quantization_BPDA_smooth_step(
-                args.attack_quantization_BPDA_steepness).apply
+            from .bpda import (
+                activation_quantization_BPDA_smooth_step,
+                activation_quantization_BPDA_smooth_step_lean,
+            )
+            if args.attack_lean_bpda:
+                self.activation = activation_quantization_BPDA_smooth_step_lean(
+                    args.attack_quantization_BPDA_steepness).apply
+            else:
+                self.activation = activation_quantization_BPDA_smooth_step(
+                    args.attack_quantization_BPDA_steepness).apply
 
     def forward(self, x):
         super(quant_encoder, self).forward(x)
@@ -103,15 +229,18 @@ class top_T_encoder(encoder_base_class):
 
     def set_BPDA_type(self, BPDA_type):
         self.BPDA_type = BPDA_type
-        from .bpda import take_top_T_BPDA_identity
+        from .bpda import take_top_T_BPDA_identity, take_top_T_lean
 
         if self.BPDA_type == "maxpool_like":
-            self.take_top_T = take_top_T
+            self.take_top_T = take_top_T_lean.apply if self.lean_bpda else take_top_T
         elif self.BPDA_type == "identity":
             self.take_top_T = take_top_T_BPDA_identity().apply
 
     def forward(self, x):
-        x = super(top_T_encoder, self).forward(x)
+        return self.from_conv(super(top_T_encoder, self).forward(x))
+
+    def from_conv(self, x):
+        """ Rest of forward after self.conv, for callers sharing the conv """
         x = self.take_top_T(x, self.T)
         return x
 
@@ -125,23 +254,32 @@ class top_T_quant_encoder(encoder_base_class):
             from .bpda import activation_quantization_BPDA_identity
             self.activation = activation_quantization_BPDA_identity().apply
         else:
-            from .bpda import activation_quantization_BPDA_smooth_step
-            self.activation = activation_quantization_BPDA_smooth_step(
-                args.attack_quantization_BPDA_steepness).apply
+            from .bpda import (
+                activation_quantization_BPDA_smooth_step,
+                activation_quantization_BPDA_smooth_step_lean,
+            )
+            if args.attack_lean_bpda:
+                self.activation = activation_quantization_BPDA_smooth_step_lean(
+                    args.attack_quantization_BPDA_steepness).apply
+            else:
+                self.activation = activation_quantization_BPDA_smooth_step(
+                    args.attack_quantization_BPDA_steepness).apply
 
         self.set_BPDA_type(BPDA_type)
 
     def set_BPDA_type(self, BPDA_type):
         self.BPDA_type = BPDA_type
-        from .bpda import take_top_T_BPDA_identity
+        from .bpda import take_top_T_BPDA_identity, take_top_T_lean
 
         if self.BPDA_type == "maxpool_like":
-            self.take_top_T = take_top_T
+            self.take_top_T = take_top_T_lean.apply if self.lean_bpda else take_top_T
         elif self.BPDA_type == "identity":
             self.take_top_T = take_top_T_BPDA_identity().apply
 
     def forward(self, x):
-        x = super(top_T_quant_encoder, self).forward(x)
+        return self.from_conv(super(top_T_quant_encoder, self).forward(x))
+
+    def from_conv(self, x):
         x = self.take_top_T(x, self.T)
         x = self.activation(x, self.l1_norms, self.jump)
         return x
@@ -157,10 +295,11 @@ class top_T_dropout_encoder(encoder_base_class):
 
     def set_BPDA_type(self, BPDA_type):
         self.BPDA_type = BPDA_type
-        from .bpda import take_top_T_dropout_BPDA_identity
+        from .bpda import take_top_T_dropout_BPDA_identity, take_top_T_dropout_lean
 
         if self.BPDA_type == "maxpool_like":
-            self.take_top_T_dropout = take_top_T_dropout
+            self.take_top_T_dropout = (
+                take_top_T_dropout_lean.apply if self.lean_bpda else take_top_T_dropout)
         elif self.BPDA_type == "identity":
             self.take_top_T_dropout = take_top_T_dropout_BPDA_identity().apply
 
@@ -168,7 +307,9 @@ class top_T_dropout_encoder(encoder_base_class):
         self.fixed_seed = True
 
     def forward(self, x):
-        x = super(top_T_dropout_encoder, self).forward(x)
+        return self.from_conv(super(top_T_dropout_encoder, self).forward(x))
+
+    def from_conv(self, x):
         if self.fixed_seed:
             x = self.take_top_T_dropout(x, self.T, self.p, 20200605)
         else:
@@ -186,19 +327,27 @@ class top_T_dropout_quant_encoder(encoder_base_class):
             from .bpda import activation_quantization_BPDA_identity
             self.activation = activation_quantization_BPDA_identity().apply
         else:
-            from .bpda import activation_quantization_BPDA_smooth_step
-            self.activation = activation_quantization_BPDA_smooth_step(
-                args.attack_quantization_BPDA_steepness).apply
+            from .bpda import (
+                activation_quantization_BPDA_smooth_step,
+                activation_quantization_BPDA_smooth_step_lean,
+            )
+            if args.attack_lean_bpda:
+                self.activation = activation_quantization_BPDA_smooth_step_lean(
+                    args.attack_quantization_BPDA_steepness).apply
+            else:
+                self.activation = activation_quantization_BPDA_smooth_step(
+                    args.attack_quantization_BPDA_steepness).apply
 
         self.set_BPDA_type(BPDA_type)
         self.fixed_seed = False
 
     def set_BPDA_type(self, BPDA_type):
         self.BPDA_type = BPDA_type
-        from .bpda import take_top_T_dropout_BPDA_identity
+        from .bpda import take_top_T_dropout_BPDA_identity, take_top_T_dropout_lean
 
         if self.BPDA_type == "maxpool_like":
-            self.take_top_T_dropout = take_top_T_dropout
+            self.take_top_T_dropout = (
+                take_top_T_dropout_lean.apply if self.lean_bpda else take_top_T_dropout)
         elif self.BPDA_type == "identity":
             self.take_top_T_dropout = take_top_T_dropout_BPDA_identity().apply
 
@@ -206,7 +355,9 @@ class top_T_dropout_quant_encoder(encoder_base_class):
         self.fixed_seed = True
 
     def forward(self, x):
-        x = super(top_T_dropout_quant_encoder, self).forward(x)
+        return self.from_conv(super(top_T_dropout_quant_encoder, self).forward(x))
+
+    def from_conv(self, x):
         if self.fixed_seed:
             x = self.take_top_T_dropout(x, self.T, self.p, 20200605)
         else:
@@ -0,0 +1,120 @@
+"""
+Tiled execution of an autoencoder: the output image is computed tile by tile,
+each from the smallest input region (tile plus halo) it depends on, so the
+(B, nb_atoms, H', W') codes and decoder activations only ever exist for one
+tile. Works for decoders that are chains of ConvTranspose2d + ReLU followed by
+take_middle_of_img (default_decoder, small_decoder).
+
+The result equals the untiled forward pass, except for dropout: a code in the
+halo of two tiles gets a different dropout draw in each, which is still a
+valid dropout sample. When gradients are needed (attacks, training) every
+tile is checkpointed and recomputed in backward, so the activations kept for
+backward are also those of one tile.
+"""
+
+from functools import partial
+
+import torch
+from torch import nn
+import torch.nn.functional as F
+from torch.utils.checkpoint import checkpoint
+
+from .decoders import default_decoder, small_decoder
+
+
+def decoder_layers(decoder):
+    """ The ConvTranspose2d chain of a decoder, in order """
+    if not isinstance(decoder, (default_decoder, small_decoder)):
+        raise NotImplementedError(
+            f"{type(decoder).__name__} resizes with interpolate, its output cannot be tiled exactly")
+    return [decoder.conv1, decoder.conv2, decoder.conv3]
+
+
+def transposed_output_size(size, layers):
+    for layer in layers:
+        size = (size - 1) * layer.stride[0] + layer.kernel_size[0] - 2 * layer.padding[0]
+    return size
+
+
+def code_dependencies(first, last, layers):
+    """ Range of code positions [low, high] that decoder positions
+    [first, last] depend on, along one axis """
+    for layer in reversed(layers):
+        kernel, stride = layer.kernel_size[0], layer.stride[0]
+        # output o of a transposed conv gets inputs i with i * s <= o <= i * s + k - 1
+        first = -(-(first - kernel + 1) // stride)
+        last = last // stride
+    return first, last
+
+
+class tiled_autoencoder(nn.Module):
+    """ Runs autoencoder tile_size x tile_size output pixels at a time """
+
+    def __init__(self, autoencoder, tile_size):
+        super(tiled_autoencoder, self).__init__()
+        self.autoencoder = autoencoder
+        self.tile_size = tile_size
+
+        conv = autoencoder.encoder.conv
+        self.patch_size = conv.kernel_size[0]
+        self.stride = conv.stride[0]
+        self.layers = decoder_layers(autoencoder.decoder)
+        if any(layer.padding[0] != 0 for layer in self.layers):
+            raise NotImplementedError("Decoder layers with padding")
+        self.code_stride = 1
+        for layer in self.layers:
+            self.code_stride *= layer.stride[0]
+
+    def __getattr__(self, key):
+        try:
+            return super(tiled_autoencoder, self).__getattr__(key)
+        except AttributeError:
+            return getattr(self.autoencoder, key)
+
+    def axis_tiles(self, size):
+        """ For each output tile along one axis: output range, code range and
+        where the tile starts in the decoded code range """
+        nb_codes = (size - self.patch_size) // self.stride + 1
+        decoded_size = transposed_output_size(nb_codes, self.layers)
+        crop = (decoded_size - self.autoencoder.decoder.image_size) // 2
+
+        tiles = []
+        for start in range(0, self.autoencoder.decoder.image_size, self.tile_size):
+            end = min(start + self.tile_size, self.autoencoder.decoder.image_size)
+            first, last = code_dependencies(
+                start + crop, end - 1 + crop, self.layers)
+            first, last = max(first, 0), min(last, nb_codes - 1)
+            offset = start + crop - first * self.code_stride
+            tiles.append((end - start, first, last, offset))
+        return tiles
+
+    def tile(self, crop, image_tile):
+        """ Output tile of an input tile, crop is (offset_y, height,
+        offset_x, width) """
+        offset_y, height, offset_x, width = crop
+        out = self.autoencoder.encoder(image_tile)
+        for layer in self.layers:
+            out = F.relu(layer(out))
+        return out[:, :, offset_y: offset_y + height, offset_x: offset_x + width]
+
+    def forward(self, x):
+        rows = []
+        for height, first_y, last_y, offset_y in self.axis_tiles(x.shape[2]):
+            row = []
+            for width, first_x, last_x, offset_x in self.axis_tiles(x.shape[3]):
+                image_tile = x[
+                    :, :,
+                    first_y * self.stride: last_y * self.stride + self.patch_size,
+                    first_x * self.stride: last_x * self.stride + self.patch_size,
+                ]
+                tile = partial(self.tile, (offset_y, height, offset_x, width))
+                if torch.is_grad_enabled():
+                    # checkpoint only backpropagates to parameters when an
+                    # input requires grad
+                    if not image_tile.requires_grad:
+                        image_tile = image_tile.detach().requires_grad_()
+                    row.append(checkpoint(tile, image_tile))
+                else:
+                    row.append(tile(image_tile))
+            rows.append(torch.cat(row, dim=3))
+        return torch.cat(rows, dim=2).clamp(0.0, 1.0)
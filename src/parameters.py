@@ -131,6 +131,36 @@ def get_arguments():
         help="For Saving the current Model, default = False ",
     )
 
+    neural_net.add_argument(
+        "--checkpoint_interval",
+        type=int,
+        default=1,
+        metavar="N",
+        help="Save the full training state (model, optimizer, scheduler, RNG) every N epochs, 0 disables (default: 1)",
+    )
+
+    neural_net.add_argument(
+        "--resume",
+        action="store_true",
+        default=False,
+        help="Continue from the saved training state of the same run if there is one",
+    )
+
+    neural_net.add_argument(
+        "--tile_size",
+        type=int,
+        default=0,
+        metavar="pixels",
+        help="Run the autoencoder on tiles of this many output pixels per side to bound memory, 0 disables (default: 0)",
+    )
+
+    neural_net.add_argument(
+        "--compiled",
+        action="store_true",
+        default=False,
+        help="Run the model as a TorchScript trace, BPDA functions become straight-through expressions. Traces of frozen models are cached under checkpoints/compiled/",
+    )
+
     neural_net.add_argument(
         "--no_autoencoder", action="store_true", default=False, help="",
     )
@@ -155,9 +185,12 @@ def get_arguments():
             "CWlinf_EOT",
             "CWlinf_EOT_normalized",
             "CWlinf",
+            "FGSM_RS",
+            "free",
+            "PGD_curriculum",
         ],
         metavar="fgsm/pgd",
-        help="Attack method",
+        help="Attack method. FGSM_RS (FGSM from a random start), free (minibatch replay) and PGD_curriculum (growing number of PGD steps) run in the training loop without deepillusion",
     )
     adv_training.add_argument(
         "--adv_training_norm",
@@ -221,6 +254,14 @@ def get_arguments():
         metavar="",
         help="number of parallel models for EOT PGD",
     )
+    adv_training.add_argument(
+        "-tr_m",
+        "--adv_training_free_replays",
+        type=int,
+        default=8,
+        metavar="",
+        help="number of replays of each minibatch for free adversarial training",
+    )
 
     # Adversarial testing parameters
     adv_testing = parser.add_argument_group(
@@ -364,6 +405,105 @@ def get_arguments():
         help="Steepness of backward pass approximation to activation&quantization function. 0.0 means identity. (default: 0.0)",
     )
 
+    adv_testing.add_argument(
+        "--attack_lean_bpda",
+        action="store_true",
+        default=False,
+        help="Use the BPDA forms of models/bpda.py that save compact tensors for backward (int16 top-T indices, half precision smooth step input)",
+    )
+
+    # Sweeps
+    sweep = parser.add_argument_group(
+        "sweep", "Variants trained together by train_autoencoder_sweep.py or evaluated together by evaluate_encoder_sweep.py")
+
+    sweep.add_argument(
+        "--sweep_autoencoder_arch",
+        type=str,
+        nargs="+",
+        default=None,
+        help="Autoencoder architectures to sweep (default: --autoencoder_arch)",
+    )
+
+    sweep.add_argument(
+        "--sweep_top_T",
+        type=int,
+        nargs="+",
+        default=None,
+        help="Values of top_T to sweep (default: --top_T)",
+    )
+
+    sweep.add_argument(
+        "--sweep_dropout_p",
+        type=float,
+        nargs="+",
+        default=None,
+        help="Values of dropout_p to sweep (default: --dropout_p)",
+    )
+
+    sweep.add_argument(
+        "--sweep_activation_beta",
+        type=float,
+        nargs="+",
+        default=None,
+        help="Values of activation_beta to sweep (default: --activation_beta)",
+    )
+
+    # Data
+    data = parser.add_argument_group("data", "Data loading arguments")
+
+    data.add_argument(
+        "--data_backend",
+        type=str,
+        default="torchvision",
+        choices=["torchvision", "tensor", "tar"],
+        help="torchvision: per-sample transforms in DataLoader workers, tensor: in-memory uint8 dataset with batched augmentation, tar: stream ImageFolder datasets from tar shards (default: torchvision)",
+    )
+
+    data.add_argument(
+        "--data_autotune",
+        action="store_true",
+        default=False,
+        help="Measure DataLoader settings (workers, pinning, prefetching) on this machine and cache the fastest per dataset and host",
+    )
+
+    data.add_argument(
+        "--num_shards",
+        type=int,
+        default=1,
+        metavar="N",
+        help="Split every epoch into N disjoint shards, one per process (default: 1)",
+    )
+
+    data.add_argument(
+        "--shard_index",
+        type=int,
+        default=0,
+        metavar="k",
+        help="Which shard this process reads, in [0, num_shards) (default: 0)",
+    )
+
+    data.add_argument(
+        "--code_cache",
+        action="store_true",
+        default=False,
+        help="Train the decoder/classifier of a frozen top_T autoencoder on top-T codes cached on disk instead of running the dictionary stage every epoch",
+    )
+
+    data.add_argument(
+        "--code_cache_augment",
+        type=lambda x: (str(x).lower() == "true"),
+        default=True,
+        help="Cache training codes for every crop offset and flip (2 * stride^2 maps per image) instead of only the unaugmented image (default: True)",
+    )
+
+    data.add_argument(
+        "--dist_backend",
+        type=str,
+        default="gloo",
+        choices=["gloo", "nccl"],
+        help="torch.distributed backend when started by src/launch.py, gloo also runs on CPU-only hosts (default: gloo)",
+    )
+
     # Others
     others = parser.add_argument_group("others", "Other arguments")
 
@@ -536,6 +676,62 @@ def get_arguments():
         help="Whether to learn the dictionary online",
     )
 
+    dictionary.add_argument(
+        "--dict_memory_mb",
+        type=int,
+        default=256,
+        metavar="MB",
+        help="Memory budget of the patches sampled for offline dictionary learning (default: 256)",
+    )
+
+    dictionary.add_argument(
+        "--dict_patch_dtype",
+        type=str,
+        default="uint8",
+        choices=["uint8", "float32"],
+        help="Storage type of the sampled patches (default: uint8)",
+    )
+
+    dictionary.add_argument(
+        "--dict_dedup_step",
+        type=float,
+        default=0.0,
+        metavar="step",
+        help="Drop sampled patches with the same mean, contrast and normalized shape up to step before offline learning, 0 disables (default: 0)",
+    )
+
+    dictionary.add_argument(
+        "--dict_coreset_size",
+        type=int,
+        default=0,
+        metavar="N",
+        help="Learn offline from N sampled patches picked by batched k-means++ seeding, 0 disables (default: 0)",
+    )
+
+    dictionary.add_argument(
+        "--dict_snapshot_interval",
+        type=int,
+        default=500,
+        metavar="N",
+        help="Snapshot the dictionary learner every N iterations for --resume, 0 disables (default: 500)",
+    )
+
+    dictionary.add_argument(
+        "--dict_prune_nbatoms",
+        type=int,
+        default=0,
+        metavar="nb_atoms",
+        help="Use the autoencoder pruned to its nb_atoms most selected atoms by prune_dictionary.py, 0 for the full dictionary (default: 0)",
+    )
+
+    dictionary.add_argument(
+        "--dict_learner",
+        type=str,
+        default="torch",
+        choices=["torch", "sklearn"],
+        help="Dictionary learning implementation, torch runs batched FISTA on all cores or the GPU (default: torch)",
+    )
+
     args = parser.parse_args()
 
     if args.dataset == "CIFAR10":
@@ -0,0 +1,112 @@
+"""
+Profiles how often take_top_T selects each dictionary atom over the train
+set and prunes the rarely selected ones. The pruned autoencoder (encoder conv,
+l1_norms and decoder.conv1 input channels sliced) and a copy of the
+classifier checkpoint are saved under the names of --dict_prune_nbatoms, so
+run_attack.py and train_classifier.py load them with the same flag. Test
+accuracy and throughput are reported for several atom counts.
+
+python -m src.prune_dictionary --autoencoder_arch top_T_dropout_quant_autoencoder --dict_prune_nbatoms 250
+"""
+
+import os
+from copy import copy, deepcopy
+
+import numpy as np
+import torch
+from tqdm import tqdm
+
+from .parameters import get_arguments
+from .models.autoencoders import atom_usage, prune_autoencoder
+from .models.combined import Combined
+from .train_test_functions import test
+from .utils.get_modules import get_autoencoder, get_classifier
+from .utils.metrics import EpochMetrics
+from .utils.namers import autoencoder_ckpt_namer, classifier_ckpt_namer
+from .utils.read_datasets import cifar10, tiny_imagenet, imagenette
+
+
+def profile_atom_usage(encoder, loader, nb_images, device):
+    usage = None
+    nb_seen = 0
+    with torch.no_grad():
+        for images, _ in tqdm(loader, leave=False):
+            images = images[: nb_images - nb_seen].to(device)
+            counts = atom_usage(encoder, images)
+            usage = counts if usage is None else usage + counts
+            nb_seen += images.shape[0]
+            if nb_seen >= nb_images:
+                break
+    return usage.cpu().numpy()
+
+
+def main():
+
+    args = get_arguments()
+    if not args.dict_prune_nbatoms:
+        print("Give the number of atoms to keep with --dict_prune_nbatoms.")
+        exit()
+
+    use_cuda = not args.no_cuda and torch.cuda.is_available()
+    device = torch.device("cuda" if use_cuda else "cpu")
+
+    if args.dataset == "CIFAR10":
+        train_loader, test_loader = cifar10(args)
+    elif args.dataset == "Tiny-ImageNet":
+        train_loader, test_loader = tiny_imagenet(args)
+    elif args.dataset == "Imagenette":
+        train_loader, test_loader = imagenette(args)
+    else:
+        raise NotImplementedError
+
+    # the full models
+    full_args = copy(args)
+    full_args.dict_prune_nbatoms = 0
+    autoencoder = get_autoencoder(full_args)
+    classifier = get_classifier(full_args)
+    autoencoder.eval()
+    classifier.eval()
+    if not hasattr(autoencoder.encoder, "T"):
+        print("Atom usage is profiled for top-T encoders only.")
+        exit()
+
+    usage = profile_atom_usage(
+        autoencoder.encoder, train_loader, args.defense_nbimgs, device)
+    order = np.argsort(-usage, kind="stable")
+    nb_atoms = len(usage)
+    print(f"Atom selections over {args.defense_nbimgs} train images: "
+          f"{int((usage == 0).sum())} atoms never selected")
+
+    atom_counts = sorted(
+        {nb_atoms, args.dict_prune_nbatoms}
+        | {nb_atoms * fraction // 4 for fraction in (1, 2, 3)},
+        reverse=True)
+    atom_counts = [count for count in atom_counts if count >= autoencoder.T]
+
+    print(f"{'atoms':>6} {'selections kept':>16} {'test acc':>9} {'img/s':>8}")
+    for count in atom_counts:
+        kept = np.sort(order[:count])
+        pruned = prune_autoencoder(deepcopy(autoencoder), kept)
+        model = Combined(pruned, classifier)
+
+        metrics = EpochMetrics()
+        _, test_acc = test(model, test_loader, metrics=metrics)
+        print(
+            f"{count:>6} {usage[kept].sum() / max(usage.sum(), 1):>16.1%} "
+            f"{test_acc:>9.4f} {metrics.telemetry()['images_per_sec']:>8.0f}")
+
+        if count == args.dict_prune_nbatoms and args.save_checkpoint:
+            autoencoder_filepath = autoencoder_ckpt_namer(args)
+            torch.save(pruned.state_dict(), autoencoder_filepath)
+            print(f"Saved to {autoencoder_filepath}")
+
+            # the classifier sees the decoder output, its weights do not change
+            classifier_filepath = classifier_ckpt_namer(args)
+            if not os.path.exists(os.path.dirname(classifier_filepath)):
+                os.makedirs(os.path.dirname(classifier_filepath))
+            torch.save(classifier.state_dict(), classifier_filepath)
+            print(f"Saved to {classifier_filepath}")
+
+
+if __name__ == "__main__":
+    main()
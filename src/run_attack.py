@@ -4,7 +4,11 @@ from os import path
 from .utils.namers import (
     attack_log_namer,
     attack_file_namer,
+    compiled_dir_namer,
 )
+from .utils.loader_tuning import TimedLoader
+from .utils.samplers import loader_indices
+from .utils.attack_files import AttackArtifactWriter, attack_artifact_metadata
 from .utils.get_modules import (
     get_classifier,
     get_autoencoder,
@@ -14,6 +18,7 @@ import numpy as np
 import torch
 import torch.nn.functional as F
 from .models.combined import Combined, Combined_inner_BPDA_identity
+from .models.compiled import compiled_model
 from deepillusion.torchattacks import (
     PGD,
     PGD_EOT,
@@ -156,6 +161,19 @@ def main():
         model = model.to(device)
         model.eval()
 
+    if args.compiled:
+        if args.attack_box_type == "white" and args.attack_whitebox_type == "SW":
+            # the attack differentiates module_outer on its own
+            logger.info("SW attacks run eagerly")
+        else:
+            model.eval()
+            for p in model.parameters():
+                p.requires_grad = False
+            example_input = torch.rand(
+                args.test_batch_size, 3, *args.image_shape[:2], device=device)
+            model = compiled_model(
+                model, example_input, cache_dir=compiled_dir_namer(args))
+
     if (
         "dropout" in args.autoencoder_arch
         and not args.no_autoencoder
@@ -173,17 +191,16 @@ def main():
     for p in model.parameters():
         p.requires_grad = False
 
-    # this is just for the adversarial test below
-    if args.dataset == "CIFAR10":
-        _, test_loader = cifar10(args)
-    elif args.dataset == "Tiny-ImageNet":
-        _, test_loader = tiny_imagenet(args)
-    elif args.dataset == "Imagenette":
-        _, test_loader = imagenette(args)
-    else:
-        raise NotImplementedError
-
     if not args.attack_skip_clean:
+        if args.dataset == "CIFAR10":
+            _, test_loader = cifar10(args)
+        elif args.dataset == "Tiny-ImageNet":
+            _, test_loader = tiny_imagenet(args)
+        elif args.dataset == "Imagenette":
+            _, test_loader = imagenette(args)
+        else:
+            raise NotImplementedError
+
         test_loss, test_acc = adversarial_test(ensemble_model, test_loader)
         logger.info(f"Clean \t loss: {test_loss:.4f} \t acc: {test_acc:.4f}")
 
@@ -228,16 +245,6 @@ def main():
         ),
     )
 
-    test_loss = 0
-    correct = 0
-
-    if args.save_attack:
-        attacked_images = torch.zeros(len(
-            test_loader.dataset.targets), args.image_shape[2], args.image_shape[0], args.image_shape[1])
-
-    attack_output = torch.zeros(
-        len(test_loader.dataset.targets), args.num_classes)
-
     if read_from_file:
         if args.dataset == "CIFAR10":
             test_loader = cifar10_from_file(args)
@@ -257,16 +264,27 @@ def main():
         else:
             raise NotImplementedError
 
-    loaders = test_loader
+    if args.save_attack:
+        attack_writer = AttackArtifactWriter(
+            attack_file_namer(args), attack_artifact_metadata(args))
+
+    attack_output = torch.zeros(
+        len(test_loader.dataset.targets), args.num_classes)
+
+    loaders = TimedLoader(test_loader)
+    # global indices of the images this shard evaluates, in loader order
+    shard_indices = loader_indices(test_loader)
+    nb_evaluated = 0
 
     start = time.time()
     for batch_idx, items in enumerate(
         tqdm(loaders, desc="Attack progress", leave=False)
     ):
-        if args.defense_nbimgs < (batch_idx + 1) * args.test_batch_size:
+        data, target = items
+        batch_indices = shard_indices[nb_evaluated: nb_evaluated + data.shape[0]]
+        if args.defense_nbimgs <= batch_indices.max().item():
             break
 
-        data, target = items
         data = data.to(device)
         target = target.to(device)
 
@@ -275,46 +293,39 @@ def main():
                 args, model, data, target, adversarial_args)
             data += attack_batch
             data = data.clamp(0.0, 1.0)
-            if args.save_attack:
-                attacked_images[
-                    batch_idx
-                    * args.test_batch_size: (batch_idx + 1)
-                    * args.test_batch_size,
-                ] = data.detach().cpu()
 
         with torch.no_grad():
-            attack_output[
-                batch_idx
-                * args.test_batch_size: (batch_idx + 1)
-                * args.test_batch_size,
-            ] = (ensemble_model(data).detach().cpu())
+            attack_output[batch_indices] = ensemble_model(data).detach().cpu()
+
+        if args.save_attack:
+            attack_writer.append(
+                data.detach().cpu().numpy(),
+                target.cpu().numpy(),
+                attack_output[batch_indices].numpy(),
+                batch_indices.numpy(),
+            )
+
+        nb_evaluated += data.shape[0]
 
     end = time.time()
     logger.info(f"Attack computation time: {(end-start):.2f} seconds")
+    logger.info(f"Data wait: {loaders.data_time:.2f} seconds")
 
-    if args.dataset == "CIFAR10":
-        _, test_loader = cifar10(args)
-    elif args.dataset == "Tiny-ImageNet":
-        _, test_loader = tiny_imagenet(args)
-    elif args.dataset == "Imagenette":
-        _, test_loader = imagenette(args)
-    else:
-        raise NotImplementedError
-
-    target = torch.tensor(test_loader.dataset.targets)[: args.defense_nbimgs]
-    pred_attack = attack_output.argmax(dim=1, keepdim=True)[
-        : args.defense_nbimgs]
+    evaluated = shard_indices[:nb_evaluated]
+    target = torch.tensor(test_loader.dataset.targets)[evaluated]
+    pred_attack = attack_output.argmax(dim=1, keepdim=True)[evaluated]
 
     correct_attack = pred_attack.eq(target.view_as(pred_attack)).sum().item()
-    accuracy_attack = correct_attack / args.defense_nbimgs
+    accuracy_attack = correct_attack / max(nb_evaluated, 1)
 
+    if args.num_shards > 1:
+        logger.info(
+            f"Shard {args.shard_index}/{args.num_shards}: {correct_attack} of {nb_evaluated} correct")
     logger.info(f"Attack accuracy: {(100*accuracy_attack):.2f}%")
 
     if args.save_attack:
-        attack_filepath = attack_file_namer(args)
-        np.save(attack_filepath, attacked_images.detach().cpu().numpy())
-
-        logger.info(f"Saved to {attack_filepath}")
+        attack_writer.close()
+        logger.info(f"Saved to {attack_file_namer(args)}")
 
 
 if __name__ == "__main__":
@@ -16,6 +16,6 @@ COMMAND="python -m neuro-inspired-defense.src.run_attack --autoencoder_train_sup
 echo $COMMAND
 eval $COMMAND
 
-COMMAND="python -m neuro-inspired-defense.src.run_attack --autoencoder_train_supervised --attack_box_type=other --attack_otherbox_type=transfer --attack_transfer_file=white_W-AIGA_PGD_EOT_normalized_eps_8_Ne_40_Ns_20_ss_1_Nr_1_resnet_sgd_cyc_0.0500_ep_70_ps_4_st_2_l_1.0_n_500_it_1000_top_T_dropout_autoencoder_sgd_cyc_0.0500_T_50_p_0.95_US_ep_50.npy"
+COMMAND="python -m neuro-inspired-defense.src.run_attack --autoencoder_train_supervised --attack_box_type=other --attack_otherbox_type=transfer --attack_transfer_file=white_W-AIGA_PGD_EOT_normalized_eps_8_Ne_40_Ns_20_ss_1_Nr_1_resnet_sgd_cyc_0.0500_ep_70_ps_4_st_2_l_1.0_n_500_it_1000_top_T_dropout_autoencoder_sgd_cyc_0.0500_T_50_p_0.95_US_ep_50.attack"
 echo $COMMAND
 eval $COMMAND
@@ -1,22 +1,41 @@
 import torch
-import torch.optim as optim
 import torch.backends.cudnn as cudnn
 
 import os
+import time
 import numpy as np
 import logging
 
 from .train_test_functions import (
     train_autoencoder_unsupervised,
     test_autoencoder_unsupervised,
+    train_decoder_from_codes,
+    test_decoder_from_codes,
 )
 from .parameters import get_arguments
 from .utils.read_datasets import cifar10, tiny_imagenet, imagenette
+from .utils.loader_tuning import TimedLoader
+from .utils.samplers import set_loader_epoch, loader_size
+from .utils.metrics import EpochMetrics
+from .utils.code_cache import code_cache_loaders
+from .utils.optimizers import get_optimizer, get_scheduler
+from .utils.checkpointing import resume_epoch, save_training_state, should_save_state
+from .utils.distributed import (
+    init_distributed,
+    is_main_process,
+    main_process_first,
+    distributed_device,
+    distributed_model,
+    all_reduce_metrics,
+    log_handlers,
+    log_level,
+)
 from .models.autoencoders import *
 from tqdm import tqdm
 from .utils.namers import (
     autoencoder_ckpt_namer,
     autoencoder_log_namer,
+    autoencoder_state_namer,
 )
 from torchvision import datasets, transforms
 import sys
@@ -30,118 +49,114 @@ def main():
         print("Use train_classifier.py for supervised training of autoencoder.")
         exit()
 
+    # started by src/launch.py: one process per shard, gradients all-reduced
+    distributed = init_distributed(args)
+
     logging.basicConfig(
         format="[%(asctime)s] - %(message)s",
         datefmt="%Y/%m/%d %H:%M:%S",
-        level=logging.INFO,
-        handlers=[
-            logging.FileHandler(autoencoder_log_namer(args)),
-            logging.StreamHandler(sys.stdout),
-        ],
+        level=log_level(args),
+        handlers=log_handlers(args, autoencoder_log_namer(args)),
     )
     logger.info(args)
     logger.info("\n")
 
     # Get same results for each training with same parameters
-    torch.manual_seed(args.seed)
+    torch.manual_seed(args.seed + args.rank)
 
     use_cuda = not args.no_cuda and torch.cuda.is_available()
-    device = torch.device("cuda" if use_cuda else "cpu")
+    if distributed:
+        device = distributed_device(args, use_cuda)
+    else:
+        device = torch.device("cuda" if use_cuda else "cpu")
 
     x_min = 0.0
     x_max = 1.0
 
-    if args.dataset == "CIFAR10":
-        train_loader, test_loader = cifar10(args)
-    elif args.dataset == "Tiny-ImageNet":
-        train_loader, test_loader = tiny_imagenet(args)
-    elif args.dataset == "Imagenette":
-        train_loader, test_loader = imagenette(args)
-    else:
-        raise NotImplementedError
-
     autoencoder = autoencoder_dict[args.autoencoder_arch](args).to(device)
     autoencoder.train()
 
-    if device == "cuda":
-        autoencoder = torch.nn.DataParallel(autoencoder)
-        cudnn.benchmark = True
-
-    if args.optimizer == "sgd":
-        optimizer = optim.SGD(
-            autoencoder.parameters(),
-            lr=args.lr,
-            momentum=args.momentum,
-            weight_decay=args.weight_decay,
-        )
-    elif args.optimizer == "rms":
-        optimizer = optim.RMSprop(
-            autoencoder.parameters(),
-            lr=args.lr,
-            weight_decay=args.weight_decay,
-            momentum=args.momentum)
-
-    elif args.optimizer == "adam":
-        optimizer = optim.Adam(
-            autoencoder.parameters(),
-            lr=args.lr,
-            weight_decay=args.weight_decay,
-        )
+    if args.code_cache:
+        # the encoder is frozen, so its top-T codes are computed once
+        with main_process_first(args):
+            train_loader, test_loader = code_cache_loaders(
+                args, autoencoder.encoder, yield_images=True)
+        model = code_cache_autoencoder(autoencoder)
+        train_epoch, test_epoch = train_decoder_from_codes, test_decoder_from_codes
     else:
-        raise NotImplementedError
-
-    if args.lr_scheduler == "cyc":
-        lr_steps = args.classifier_epochs * len(train_loader)
-        scheduler = torch.optim.lr_scheduler.CyclicLR(
-            optimizer,
-            base_lr=args.lr_min,
-            max_lr=args.lr_max,
-            step_size_up=lr_steps / 2,
-            step_size_down=lr_steps / 2,
-        )
-    elif args.lr_scheduler == "step":
-        scheduler = torch.optim.lr_scheduler.MultiStepLR(
-            optimizer,
-            milestones=[35],
-            gamma=0.1)
-
-    elif args.lr_scheduler == "mult":
-        def lr_fun(epoch):
-            if epoch % 3 == 0:
-                return 0.962
+        with main_process_first(args):
+            if args.dataset == "CIFAR10":
+                train_loader, test_loader = cifar10(args)
+            elif args.dataset == "Tiny-ImageNet":
+                train_loader, test_loader = tiny_imagenet(args)
+            elif args.dataset == "Imagenette":
+                train_loader, test_loader = imagenette(args)
             else:
-                return 1.0
+                raise NotImplementedError
+        model = autoencoder
+        train_epoch, test_epoch = train_autoencoder_unsupervised, test_autoencoder_unsupervised
+
+    train_loader = TimedLoader(train_loader)
+    test_loader = TimedLoader(test_loader)
+
+    if distributed:
+        model = distributed_model(model, device)
+    elif device.type == "cuda":
+        # autoencoder stays unwrapped, it is what the checkpoints save
+        model = torch.nn.DataParallel(model)
+        cudnn.benchmark = True
 
-        scheduler = MultiplicativeLR(optimizer, lr_fun)
-    else:
-        raise NotImplementedError
+    optimizer = get_optimizer(args, autoencoder.parameters())
+    scheduler = get_scheduler(args, optimizer, len(train_loader))
+
+    state_filepath = autoencoder_state_namer(args)
+    start_epoch = resume_epoch(
+        args, state_filepath, autoencoder, optimizer, scheduler, train_loader.sampler)
+    if start_epoch:
+        logger.info(f"Resumed from {state_filepath} after epoch {start_epoch}")
 
     with tqdm(
         total=args.autoencoder_epochs,
-        initial=0,
+        initial=start_epoch,
         unit="ep",
         unit_scale=True,
         unit_divisor=1000,
         leave=True,
+        disable=not is_main_process(args),
         bar_format="{percentage:3.0f}%|{bar}| {n_fmt}/{total_fmt} [{elapsed}<{remaining}{postfix}]",
     ) as pbar:
-        for epoch in range(args.autoencoder_epochs):
-
-            train_loss = train_autoencoder_unsupervised(
-                autoencoder, train_loader, optimizer, scheduler
+        for epoch in range(start_epoch, args.autoencoder_epochs):
+            start_time = time.time()
+            train_loader.reset()
+            test_loader.reset()
+            set_loader_epoch(train_loader, epoch)
+
+            train_metrics = EpochMetrics()
+            train_loss = train_epoch(
+                model, train_loader, optimizer, scheduler, metrics=train_metrics
             )
-            validation_loss = test_autoencoder_unsupervised(
-                autoencoder, test_loader)
+            validation_loss = test_epoch(model, test_loader)
+
+            train_loss, = all_reduce_metrics([train_loss])
+            validation_loss, = all_reduce_metrics(
+                [validation_loss], loader_size(test_loader))
 
             logger.info(f"Epoch: {epoch}, Train Loss: {train_loss}")
             logger.info(f"Epoch: {epoch}, Validation Loss: {validation_loss}")
+            logger.info(
+                f"Epoch: {epoch}, Data wait: {train_loader.data_time + test_loader.data_time:.0f}s of {time.time() - start_time:.0f}s")
+            logger.info(f"Epoch: {epoch}, Train: {train_metrics.report()}")
 
             pbar.set_postfix(
                 Val_Loss=f"{validation_loss:.4f}", refresh=True,
             )
             pbar.update(1)
 
-    if args.save_checkpoint:
+            if should_save_state(args, epoch + 1):
+                save_training_state(
+                    args, state_filepath, epoch + 1, autoencoder, optimizer, scheduler, train_loader.sampler)
+
+    if args.save_checkpoint and is_main_process(args):
 
         if not os.path.exists(args.directory + "checkpoints/"):
             os.makedirs(args.directory + "checkpoints/")
@@ -0,0 +1,201 @@
+"""
+Unsupervised training of several autoencoder variants in one pass over the
+data. Variants differ in --sweep_autoencoder_arch, --sweep_top_T,
+--sweep_dropout_p and --sweep_activation_beta (all combinations), and share
+the dictionary, so every batch is loaded, augmented and convolved with the
+frozen dictionary once for all of them. Each variant has its own optimizer,
+scheduler and checkpoint, named as if it was trained by train_autoencoder.py.
+
+python -m src.train_autoencoder_sweep --sweep_top_T 20 50 --sweep_dropout_p 0.9 0.95
+"""
+
+import itertools
+import logging
+import os
+import sys
+import time
+from copy import copy
+
+import torch
+import torch.nn as nn
+from tqdm import tqdm
+
+from .parameters import get_arguments
+from .models.autoencoders import autoencoder_dict
+from .utils.read_datasets import cifar10, tiny_imagenet, imagenette
+from .utils.loader_tuning import TimedLoader
+from .utils.samplers import set_loader_epoch
+from .utils.metrics import EpochMetrics
+from .utils.optimizers import get_optimizer, get_scheduler
+from .utils.namers import (
+    autoencoder_ckpt_namer,
+    autoencoder_params_string,
+    autoencoder_sweep_log_namer,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def sweep_variant_args(args):
+    """ One copy of args per combination of the swept values, without
+    combinations that name the same checkpoint (e.g. dropout_p of an
+    autoencoder without dropout) """
+
+    swept = dict(
+        autoencoder_arch=args.sweep_autoencoder_arch or [args.autoencoder_arch],
+        top_T=args.sweep_top_T or [args.top_T],
+        dropout_p=args.sweep_dropout_p or [args.dropout_p],
+        activation_beta=args.sweep_activation_beta or [args.activation_beta],
+    )
+
+    variants = {}
+    for values in itertools.product(*swept.values()):
+        variant_args = copy(args)
+        for key, value in zip(swept, values):
+            setattr(variant_args, key, value)
+        variants.setdefault(autoencoder_ckpt_namer(variant_args), variant_args)
+
+    return list(variants.values())
+
+
+def main():
+    args = get_arguments()
+    if args.autoencoder_train_supervised:
+        print("Sweeps train autoencoders unsupervised.")
+        exit()
+
+    variants_args = sweep_variant_args(args)
+
+    logging.basicConfig(
+        format="[%(asctime)s] - %(message)s",
+        datefmt="%Y/%m/%d %H:%M:%S",
+        level=logging.INFO,
+        handlers=[
+            logging.FileHandler(autoencoder_sweep_log_namer(
+                args, len(variants_args))),
+            logging.StreamHandler(sys.stdout),
+        ],
+    )
+    logger.info(args)
+    logger.info("\n")
+
+    torch.manual_seed(args.seed)
+
+    use_cuda = not args.no_cuda and torch.cuda.is_available()
+    device = torch.device("cuda" if use_cuda else "cpu")
+
+    if args.dataset == "CIFAR10":
+        train_loader, test_loader = cifar10(args)
+    elif args.dataset == "Tiny-ImageNet":
+        train_loader, test_loader = tiny_imagenet(args)
+    elif args.dataset == "Imagenette":
+        train_loader, test_loader = imagenette(args)
+    else:
+        raise NotImplementedError
+
+    train_loader = TimedLoader(train_loader)
+    test_loader = TimedLoader(test_loader)
+
+    autoencoders = []
+    optimizers = []
+    schedulers = []
+    for variant_args in variants_args:
+        autoencoder = autoencoder_dict[variant_args.autoencoder_arch](
+            variant_args).to(device)
+        if not hasattr(autoencoder.encoder, "from_conv"):
+            raise ValueError(
+                f"{variant_args.autoencoder_arch} has no top-T encoder to share the dictionary conv with")
+        autoencoder.train()
+        optimizer = get_optimizer(variant_args, autoencoder.parameters())
+
+        autoencoders.append(autoencoder)
+        optimizers.append(optimizer)
+        schedulers.append(get_scheduler(
+            variant_args, optimizer, len(train_loader)))
+        logger.info(f"Variant {len(autoencoders) - 1}: {autoencoder_params_string(variant_args)}")
+
+    # every variant has a copy of the same frozen dictionary conv
+    shared_conv = autoencoders[0].encoder.conv
+    criterion = nn.MSELoss()
+
+    for epoch in tqdm(range(args.autoencoder_epochs)):
+        start_time = time.time()
+        train_loader.reset()
+        test_loader.reset()
+        set_loader_epoch(train_loader, epoch)
+
+        for autoencoder in autoencoders:
+            autoencoder.train()
+
+        train_metrics = EpochMetrics()
+        for images, _ in train_metrics.timed(train_loader):
+            images = images.to(device)
+            with torch.no_grad():
+                conv_output = shared_conv(images)
+
+            losses = []
+            for autoencoder, optimizer in zip(autoencoders, optimizers):
+                optimizer.zero_grad()
+                output = autoencoder.decoder(
+                    autoencoder.encoder.from_conv(conv_output))
+                losses.append(criterion(output, images))
+
+            losses = torch.stack(losses)
+            # the variants share no trainable parameter, one backward serves all
+            losses.sum().backward()
+
+            for optimizer, scheduler in zip(optimizers, schedulers):
+                optimizer.step()
+                if isinstance(scheduler, torch.optim.lr_scheduler.CyclicLR):
+                    scheduler.step()
+
+            train_metrics.add(loss=losses * images.shape[0])
+            train_metrics.count(images.shape[0])
+
+        for scheduler in schedulers:
+            if not isinstance(scheduler, torch.optim.lr_scheduler.CyclicLR):
+                scheduler.step()
+
+        for autoencoder in autoencoders:
+            autoencoder.eval()
+
+        test_metrics = EpochMetrics()
+        with torch.no_grad():
+            for images, _ in test_metrics.timed(test_loader):
+                images = images.to(device)
+                conv_output = shared_conv(images)
+                losses = torch.stack([
+                    criterion(autoencoder.decoder(
+                        autoencoder.encoder.from_conv(conv_output)), images)
+                    for autoencoder in autoencoders
+                ])
+                test_metrics.add(loss=losses * images.shape[0])
+                test_metrics.count(images.shape[0])
+
+        train_losses = train_metrics.values()["loss"]
+        test_losses = test_metrics.values()["loss"]
+        for variant_idx in range(len(autoencoders)):
+            logger.info(
+                f"Epoch: {epoch}, Variant {variant_idx}, "
+                f"Train Loss: {train_losses[variant_idx] / train_metrics.nb_samples}, "
+                f"Validation Loss: {test_losses[variant_idx] / test_metrics.nb_samples}")
+        logger.info(
+            f"Epoch: {epoch}, Data wait: {train_loader.data_time + test_loader.data_time:.0f}s of {time.time() - start_time:.0f}s")
+        logger.info(f"Epoch: {epoch}, Train: {train_metrics.report()}")
+
+    if args.save_checkpoint:
+
+        if not os.path.exists(args.directory + f"checkpoints/autoencoders/{args.dataset}/"):
+            os.makedirs(args.directory + f"checkpoints/autoencoders/{args.dataset}/")
+
+        for variant_args, autoencoder in zip(variants_args, autoencoders):
+            autoencoder_filepath = autoencoder_ckpt_namer(variant_args)
+            torch.save(
+                autoencoder.state_dict(), autoencoder_filepath,
+            )
+
+            logger.info(f"Saved to {autoencoder_filepath}")
+
+
+if __name__ == "__main__":
+    main()
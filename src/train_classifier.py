@@ -17,19 +17,39 @@ from .models.ablation.dropout_resnet import dropout_ResNet
 from .train_test_functions import (
     train,
     test,
+    fast_adversarial_epoch,
+    curriculum_num_steps,
+    FAST_ADV_TRAINING,
 )
 
 from .parameters import get_arguments
 from .utils.read_datasets import cifar10, tiny_imagenet, imagenette
+from .utils.loader_tuning import TimedLoader
+from .utils.samplers import set_loader_epoch, loader_size
+from .utils.metrics import EpochMetrics
+from .utils.code_cache import code_cache_loaders
+from .utils.checkpointing import resume_epoch, save_training_state, should_save_state
+from .utils.distributed import (
+    init_distributed,
+    is_main_process,
+    main_process_first,
+    distributed_device,
+    distributed_model,
+    all_reduce_metrics,
+    log_handlers,
+    log_level,
+)
 
 from .utils.namers import (
     autoencoder_ckpt_namer,
     autoencoder_log_namer,
     classifier_ckpt_namer,
     classifier_log_namer,
+    classifier_state_namer,
 )
 
 from .models.combined import Combined
+from .models.compiled import compiled_model
 from .utils.get_modules import get_autoencoder
 from deepillusion.torchattacks import (
     PGD,
@@ -53,41 +73,52 @@ def main():
     """ main function to run the experiments """
 
     args = get_arguments()
+    # started by src/launch.py: one process per shard, gradients all-reduced
+    distributed = init_distributed(args)
     if not os.path.exists(args.directory + "logs"):
         os.mkdir(args.directory + "logs")
 
     logging.basicConfig(
         format="[%(asctime)s] - %(message)s",
         datefmt="%Y/%m/%d %H:%M:%S",
-        level=logging.INFO,
-        handlers=[
-            logging.FileHandler(classifier_log_namer(args)),
-            logging.StreamHandler(sys.stdout),
-        ],
+        level=log_level(args),
+        handlers=log_handlers(args, classifier_log_namer(args)),
     )
 
     logger.info(args)
     logger.info("\n")
 
-    np.random.seed(args.seed)
-    torch.manual_seed(args.seed)
-    torch.cuda.manual_seed(args.seed)
+    # rank 0 draws the same random numbers as a single process run
+    np.random.seed(args.seed + args.rank)
+    torch.manual_seed(args.seed + args.rank)
+    torch.cuda.manual_seed(args.seed + args.rank)
 
     use_cuda = not args.no_cuda and torch.cuda.is_available()
-    device = torch.device("cuda" if use_cuda else "cpu")
+    if distributed:
+        device = distributed_device(args, use_cuda)
+    else:
+        device = torch.device("cuda" if use_cuda else "cpu")
 
     x_min = 0.0
     x_max = 1.0
     # L = round((32 - args.defense_patchsize) / args.defense_stride + 1)
 
-    if args.dataset == "CIFAR10":
-        train_loader, test_loader = cifar10(args)
-    elif args.dataset == "Tiny-ImageNet":
-        train_loader, test_loader = tiny_imagenet(args)
-    elif args.dataset == "Imagenette":
-        train_loader, test_loader = imagenette(args)
-    else:
-        raise NotImplementedError
+    use_code_cache = args.code_cache and not args.no_autoencoder \
+        and not args.autoencoder_train_supervised
+    if use_code_cache and args.adv_training_attack:
+        print("Adversarial training perturbs images, it cannot use the code cache.")
+        exit()
+
+    if not use_code_cache:
+        with main_process_first(args):
+            if args.dataset == "CIFAR10":
+                train_loader, test_loader = cifar10(args)
+            elif args.dataset == "Tiny-ImageNet":
+                train_loader, test_loader = tiny_imagenet(args)
+            elif args.dataset == "Imagenette":
+                train_loader, test_loader = imagenette(args)
+            else:
+                raise NotImplementedError
 
     if args.classifier_arch == "resnet":
         classifier = ResNet(num_outputs=args.num_classes).to(device)
@@ -122,14 +153,26 @@ def main():
             for p in autoencoder.parameters():
                 p.requires_grad = False
 
-        model = Combined(autoencoder, classifier)
+        if use_code_cache:
+            # the frozen encoder's top-T codes are computed once, on disk
+            with main_process_first(args):
+                train_loader, test_loader = code_cache_loaders(
+                    args, autoencoder.encoder)
+            model = Combined(code_cache_autoencoder(autoencoder), classifier)
+        else:
+            model = Combined(autoencoder, classifier)
 
     else:
         model = classifier
 
+    train_loader = TimedLoader(train_loader)
+    test_loader = TimedLoader(test_loader)
+
     model.train()
 
-    if device == "cuda":
+    if distributed:
+        model = distributed_model(model, device)
+    elif device == "cuda":
         model = torch.nn.DataParallel(model)
         cudnn.benchmark = True
 
@@ -163,6 +206,9 @@ def main():
 
     if args.lr_scheduler == "cyc":
         lr_steps = args.classifier_epochs * len(train_loader)
+        if args.adv_training_attack == "free":
+            # free training steps the optimizer once per replay
+            lr_steps *= args.adv_training_free_replays
         scheduler = torch.optim.lr_scheduler.CyclicLR(
             optimizer,
             base_lr=args.lr_min,
@@ -188,7 +234,25 @@ def main():
     else:
         raise NotImplementedError
 
-    if args.adv_training_attack:
+    # the trace shares its parameters with model, evaluation stays eager
+    train_model = model
+    if args.compiled:
+        if distributed:
+            logger.info("Distributed training runs eagerly")
+        elif use_code_cache:
+            logger.info("Training on cached codes runs eagerly")
+        else:
+            example_input = torch.rand(
+                args.train_batch_size, 3, *args.image_shape[:2], device=device)
+            train_model = compiled_model(model, example_input)
+
+    state_filepath = classifier_state_namer(args)
+    start_epoch = resume_epoch(
+        args, state_filepath, model, optimizer, scheduler, train_loader.sampler)
+    if start_epoch:
+        logger.info(f"Resumed from {state_filepath} after epoch {start_epoch}")
+
+    if args.adv_training_attack and args.adv_training_attack not in FAST_ADV_TRAINING:
 
         attacks = dict(
             PGD=PGD,
@@ -225,7 +289,7 @@ def main():
         adversarial_args = dict(
             attack=attacks[adv_training_attack],
             attack_args=dict(
-                net=model, data_params=data_params, attack_params=attack_params
+                net=train_model, data_params=data_params, attack_params=attack_params
             ),
             loss_function=loss_function,
         )
@@ -233,11 +297,14 @@ def main():
         logger.info(args.adv_training_attack + " training")
         logger.info("Epoch \t Seconds \t LR \t \t Train Loss \t Train Acc")
 
-        for epoch in tqdm(range(1, args.classifier_epochs + 1)):
+        for epoch in tqdm(range(start_epoch + 1, args.classifier_epochs + 1), disable=not is_main_process(args)):
             start_time = time.time()
+            train_loader.reset()
+            test_loader.reset()
+            set_loader_epoch(train_loader, epoch)
 
             train_args = dict(
-                model=model,
+                model=train_model,
                 train_loader=train_loader,
                 optimizer=optimizer,
                 scheduler=scheduler,
@@ -248,6 +315,10 @@ def main():
             test_args = dict(model=model, test_loader=test_loader)
             test_loss, test_acc = adversarial_test(**test_args)
 
+            train_loss, train_acc = all_reduce_metrics([train_loss, train_acc])
+            test_loss, test_acc = all_reduce_metrics(
+                [test_loss, test_acc], loader_size(test_loader))
+
             end_time = time.time()
             lr = scheduler.get_lr()[0]
             logger.info(
@@ -255,19 +326,52 @@ def main():
             )
             logger.info(
                 f"Test  \t loss: {test_loss:.4f} \t acc: {test_acc:.4f}")
+            logger.info(
+                f"Data wait: {train_loader.data_time + test_loader.data_time:.0f}s of {end_time - start_time:.0f}s")
+
+            if should_save_state(args, epoch):
+                save_training_state(
+                    args, state_filepath, epoch, model, optimizer, scheduler, train_loader.sampler)
 
     else:
 
         logger.info("Epoch \t Seconds \t LR \t \t Train Loss \t Train Acc")
 
-        logger.info("Standard training")
-        for epoch in tqdm(range(1, args.classifier_epochs + 1)):
+        if args.adv_training_attack:
+            logger.info(args.adv_training_attack + " training")
+        else:
+            logger.info("Standard training")
+        for epoch in tqdm(range(start_epoch + 1, args.classifier_epochs + 1), disable=not is_main_process(args)):
             start_time = time.time()
-
-            train_loss, train_acc = train(
-                model, train_loader, optimizer, scheduler)
+            train_loader.reset()
+            test_loader.reset()
+            set_loader_epoch(train_loader, epoch)
+            train_metrics = EpochMetrics()
+
+            if args.adv_training_attack:
+                train_loss, train_acc = fast_adversarial_epoch(
+                    train_model,
+                    train_loader,
+                    optimizer,
+                    scheduler,
+                    method=args.adv_training_attack,
+                    epsilon=args.adv_training_epsilon,
+                    alpha=args.adv_training_alpha,
+                    step_size=args.adv_training_step_size,
+                    num_steps=curriculum_num_steps(
+                        epoch, args.classifier_epochs, args.adv_training_num_steps),
+                    replays=args.adv_training_free_replays,
+                    metrics=train_metrics,
+                )
+            else:
+                train_loss, train_acc = train(
+                    train_model, train_loader, optimizer, scheduler, metrics=train_metrics)
             test_loss, test_acc = test(model, test_loader)
 
+            train_loss, train_acc = all_reduce_metrics([train_loss, train_acc])
+            test_loss, test_acc = all_reduce_metrics(
+                [test_loss, test_acc], loader_size(test_loader))
+
             end_time = time.time()
             # lr = scheduler.get_lr()[0]
             lr = scheduler.get_last_lr()[0]
@@ -276,9 +380,16 @@ def main():
             )
             logger.info(
                 f"Test  \t loss: {test_loss:.4f} \t acc: {test_acc:.4f}")
+            logger.info(
+                f"Data wait: {train_loader.data_time + test_loader.data_time:.0f}s of {end_time - start_time:.0f}s")
+            logger.info(f"Train \t {train_metrics.report()}")
+
+            if should_save_state(args, epoch):
+                save_training_state(
+                    args, state_filepath, epoch, model, optimizer, scheduler, train_loader.sampler)
 
     # Save model parameters
-    if args.save_checkpoint:
+    if args.save_checkpoint and is_main_process(args):
         if not os.path.exists(args.directory + "checkpoints/classifiers/"):
             os.makedirs(args.directory + "checkpoints/classifiers/")
 
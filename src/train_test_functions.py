@@ -3,16 +3,20 @@ from tqdm import tqdm
 import torch
 import torch.nn as nn
 
+from .utils.samplers import loader_size
+from .utils.metrics import EpochMetrics
 
-def train(model, train_loader, optimizer, scheduler=None):
-    """ Train given model with train_loader and optimizer """
+
+def train(model, train_loader, optimizer, scheduler=None, metrics=None):
+    """ Train given model with train_loader and optimizer. Pass an
+    EpochMetrics as metrics to get the epoch's throughput telemetry """
 
     model.train()
     device = model.parameters().__next__().device
+    metrics = metrics if metrics is not None else EpochMetrics()
+    cross_ent = nn.CrossEntropyLoss()
 
-    train_loss = 0
-    train_correct = 0
-    for data, target, in train_loader:
+    for data, target, in metrics.timed(train_loader):
         if isinstance(data, list):
             data = data[0]
             target = target[0]
@@ -22,7 +26,6 @@ def train(model, train_loader, optimizer, scheduler=None):
         optimizer.zero_grad()
         output = model(data)
 
-        cross_ent = nn.CrossEntropyLoss()
         loss = cross_ent(output, target)
         loss.backward()
         optimizer.step()
@@ -30,26 +33,27 @@ def train(model, train_loader, optimizer, scheduler=None):
         if scheduler and isinstance(scheduler, torch.optim.lr_scheduler.CyclicLR):
             scheduler.step()
 
-        train_loss += loss.item()
         pred = output.argmax(dim=1, keepdim=True)
-        train_correct += pred.eq(target.view_as(pred)).sum().item()
+        metrics.add(loss=loss, correct=pred.eq(target.view_as(pred)).sum())
+        metrics.count(data.shape[0])
 
     if scheduler and not isinstance(scheduler, torch.optim.lr_scheduler.CyclicLR):
         scheduler.step()
 
-    train_size = len(train_loader.dataset)
+    train_size = max(loader_size(train_loader), 1)
+    values = metrics.values()
 
-    return train_loss / train_size, train_correct / train_size
+    return values["loss"] / train_size, values["correct"] / train_size
 
 
-def train_autoencoder_unsupervised(model, train_loader, optimizer, scheduler=None):
+def train_autoencoder_unsupervised(model, train_loader, optimizer, scheduler=None, metrics=None):
     """ Train given autoencoder with train_loader and optimizer """
 
     model.train()
 
-    train_loss = 0
-
     device = model.parameters().__next__().device
+    metrics = metrics if metrics is not None else EpochMetrics()
+    criterion = nn.MSELoss()
     with tqdm(
             total=len(train_loader),
             unit="Bt",
@@ -59,7 +63,7 @@ def train_autoencoder_unsupervised(model, train_loader, optimizer, scheduler=Non
             bar_format="{percentage:3.0f}%|{bar}| {n_fmt}/{total_fmt} [{elapsed}<{remaining}{postfix}]",
     ) as pbar:
 
-        for batch_idx, (images, _) in enumerate(train_loader):
+        for images, _ in metrics.timed(train_loader):
 
             if isinstance(images, list):
                 images = images[0]
@@ -68,7 +72,6 @@ def train_autoencoder_unsupervised(model, train_loader, optimizer, scheduler=Non
 
             optimizer.zero_grad()
             output = model(images)
-            criterion = nn.MSELoss()
 
             loss = criterion(output, images)
 
@@ -77,32 +80,188 @@ def train_autoencoder_unsupervised(model, train_loader, optimizer, scheduler=Non
             if scheduler and isinstance(scheduler, torch.optim.lr_scheduler.CyclicLR):
                 scheduler.step()
 
-            train_loss += loss.item() * train_loader.batch_size
-            nb_img_so_far = (batch_idx + 1) * train_loader.batch_size
-
-            pbar.set_postfix(
-                Train_Loss=train_loss / nb_img_so_far, refresh=True,
-            )
+            metrics.add(loss=loss * images.shape[0])
+            metrics.count(images.shape[0])
             pbar.update(1)
 
+        train_loss = metrics.values()["loss"] / max(metrics.nb_samples, 1)
+        pbar.set_postfix(Train_Loss=train_loss, refresh=True)
+
+    if scheduler and not isinstance(scheduler, torch.optim.lr_scheduler.CyclicLR):
+        scheduler.step()
+
+    return train_loss
+
+
+def train_decoder_from_codes(model, train_loader, optimizer, scheduler=None, metrics=None):
+    """ train_autoencoder_unsupervised for a loader of (codes, images) from
+    utils/code_cache.py, model maps codes to images """
+
+    model.train()
+
+    device = model.parameters().__next__().device
+    metrics = metrics if metrics is not None else EpochMetrics()
+    criterion = nn.MSELoss()
+    for codes, images in metrics.timed(train_loader):
+
+        codes, images = codes.to(device), images.to(device)
+
+        optimizer.zero_grad()
+        output = model(codes)
+
+        loss = criterion(output, images)
+
+        loss.backward()
+        optimizer.step()
+        if scheduler and isinstance(scheduler, torch.optim.lr_scheduler.CyclicLR):
+            scheduler.step()
+
+        metrics.add(loss=loss * images.shape[0])
+        metrics.count(images.shape[0])
+
     if scheduler and not isinstance(scheduler, torch.optim.lr_scheduler.CyclicLR):
         scheduler.step()
 
-    train_size = len(train_loader) * train_loader.batch_size
+    return metrics.values()["loss"] / max(loader_size(train_loader), 1)
+
+
+FAST_ADV_TRAINING = ["FGSM_RS", "free", "PGD_curriculum"]
+
+
+def clamp_perturbation(delta, images, epsilon):
+    """ Projects delta onto the L_inf ball and keeps images + delta in [0, 1] """
+    delta = delta.clamp(-epsilon, epsilon)
+    return torch.min(torch.max(delta, -images), 1 - images)
 
-    return train_loss / train_size
 
+def pgd_perturbation(model, images, target, epsilon, step_size, num_steps, random_start=True):
+    """ L_inf PGD on the cross entropy. With one step, random start and
+    step_size 1.25 * epsilon this is the FGSM with random init of fast AT """
 
-def test(model, test_loader):
+    cross_ent = nn.CrossEntropyLoss()
+
+    if random_start:
+        delta = torch.empty_like(images).uniform_(-epsilon, epsilon)
+    else:
+        delta = torch.zeros_like(images)
+    delta = clamp_perturbation(delta, images, epsilon)
+
+    for _ in range(num_steps):
+        delta.requires_grad_(True)
+        loss = cross_ent(model(images + delta), target)
+        grad, = torch.autograd.grad(loss, delta)
+        delta = clamp_perturbation(
+            delta.detach() + step_size * grad.sign(), images, epsilon)
+
+    return delta.detach()
+
+
+def curriculum_num_steps(epoch, nb_epochs, max_num_steps):
+    """ PGD steps of epoch (1 based), growing linearly to max_num_steps """
+    return max(1, -(-max_num_steps * epoch // nb_epochs))
+
+
+def fast_adversarial_epoch(
+    model,
+    train_loader,
+    optimizer,
+    scheduler=None,
+    method="FGSM_RS",
+    epsilon=8.0 / 255,
+    alpha=10.0 / 255,
+    step_size=1.0 / 255,
+    num_steps=1,
+    replays=8,
+    metrics=None,
+):
+    """
+    One epoch of adversarial training without deepillusion:
+
+    FGSM_RS: FGSM from a uniform random start with step alpha ("fast" AT).
+    free: every minibatch is replayed replays times, and the gradient of each
+        replay updates both the parameters and the perturbation, which carries
+        over to the next minibatch ("free" AT). The scheduler steps per replay.
+    PGD_curriculum: PGD with num_steps steps, callers raise num_steps over
+        the epochs (curriculum_num_steps). The step size is at least
+        2.5 * epsilon / num_steps so that few steps still reach the boundary.
+    """
+
+    model.train()
+    device = model.parameters().__next__().device
+    metrics = metrics if metrics is not None else EpochMetrics()
+    cross_ent = nn.CrossEntropyLoss()
+    cyclic = scheduler and isinstance(
+        scheduler, torch.optim.lr_scheduler.CyclicLR)
+
+    delta = None
+    for data, target in metrics.timed(train_loader):
+        if isinstance(data, list):
+            data = data[0]
+            target = target[0]
+
+        data, target = data.to(device), target.to(device)
+
+        if method == "free":
+            if delta is None or delta.shape != data.shape:
+                delta = torch.zeros_like(data)
+
+            for _ in range(replays):
+                delta = clamp_perturbation(delta, data, epsilon)
+                delta.requires_grad_(True)
+                output = model(data + delta)
+                loss = cross_ent(output, target)
+
+                optimizer.zero_grad()
+                loss.backward()
+                optimizer.step()
+                if cyclic:
+                    scheduler.step()
+
+                delta = delta.detach() + epsilon * delta.grad.sign()
+
+        else:
+            if method == "FGSM_RS":
+                delta = pgd_perturbation(
+                    model, data, target, epsilon, alpha, num_steps=1)
+            elif method == "PGD_curriculum":
+                delta = pgd_perturbation(
+                    model, data, target, epsilon,
+                    max(step_size, 2.5 * epsilon / num_steps), num_steps)
+            else:
+                raise NotImplementedError
+
+            output = model(data + delta)
+            loss = cross_ent(output, target)
+
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            if cyclic:
+                scheduler.step()
+
+        pred = output.argmax(dim=1, keepdim=True)
+        metrics.add(loss=loss, correct=pred.eq(target.view_as(pred)).sum())
+        metrics.count(data.shape[0])
+
+    if scheduler and not cyclic:
+        scheduler.step()
+
+    train_size = max(loader_size(train_loader), 1)
+    values = metrics.values()
+
+    return values["loss"] / train_size, values["correct"] / train_size
+
+
+def test(model, test_loader, metrics=None):
 
     model.eval()
 
     device = model.parameters().__next__().device
+    metrics = metrics if metrics is not None else EpochMetrics()
+    cross_ent = nn.CrossEntropyLoss()
 
-    test_loss = 0
-    test_correct = 0
     with torch.no_grad():
-        for data, target in test_loader:
+        for data, target in metrics.timed(test_loader):
             if isinstance(data, list):
                 data = data[0]
                 target = target[0]
@@ -110,37 +269,57 @@ def test(model, test_loader):
             data, target = data.to(device), target.to(device)
 
             output = model(data)
-            cross_ent = nn.CrossEntropyLoss()
-            test_loss += cross_ent(output, target).item()
             pred = output.argmax(dim=1, keepdim=True)
-            test_correct += pred.eq(target.view_as(pred)).sum().item()
-    test_size = len(test_loader.dataset)
+            metrics.add(
+                loss=cross_ent(output, target),
+                correct=pred.eq(target.view_as(pred)).sum(),
+            )
+            metrics.count(data.shape[0])
 
-    return test_loss / test_size, test_correct / test_size
+    test_size = max(loader_size(test_loader), 1)
+    values = metrics.values()
 
+    return values["loss"] / test_size, values["correct"] / test_size
 
-def test_autoencoder_unsupervised(model, test_loader):
 
-    model.eval()
+def test_autoencoder_unsupervised(model, test_loader, metrics=None):
 
-    test_loss = 0
+    model.eval()
 
     device = model.parameters().__next__().device
+    metrics = metrics if metrics is not None else EpochMetrics()
+    criterion = nn.MSELoss()
 
-    for batch_idx, (images, _) in enumerate(test_loader):
+    with torch.no_grad():
+        for images, _ in metrics.timed(test_loader):
 
-        if isinstance(images, list):
-            images = images[0]
+            if isinstance(images, list):
+                images = images[0]
 
-        images = images.to(device)
+            images = images.to(device)
 
-        output = model(images)
-        criterion = nn.MSELoss()
-        loss = criterion(output, images)
+            output = model(images)
+            metrics.add(loss=criterion(output, images) * images.shape[0])
+            metrics.count(images.shape[0])
+
+    return metrics.values()["loss"] / max(metrics.nb_samples, 1)
+
+
+def test_decoder_from_codes(model, test_loader, metrics=None):
+
+    model.eval()
+
+    device = model.parameters().__next__().device
+    metrics = metrics if metrics is not None else EpochMetrics()
+    criterion = nn.MSELoss()
+
+    with torch.no_grad():
+        for codes, images in metrics.timed(test_loader):
 
-        test_loss += loss.item() * test_loader.batch_size
-        nb_img_so_far = (batch_idx + 1) * test_loader.batch_size
+            codes, images = codes.to(device), images.to(device)
 
-    test_size = len(test_loader) * test_loader.batch_size
+            output = model(codes)
+            metrics.add(loss=criterion(output, images) * images.shape[0])
+            metrics.count(images.shape[0])
 
-    return test_loss / test_size
+    return metrics.values()["loss"] / max(loader_size(test_loader), 1)
@@ -0,0 +1,221 @@
+"""
+Reading and writing attacked datasets without loading them fully into memory
+"""
+
+import hashlib
+import json
+import os
+import shutil
+from os import path
+
+import numpy as np
+
+from .namers import attack_file_namer
+from .fast_loaders import TensorImageDataset, TensorBatchLoader
+from .image_cache import ShardedArray
+from .samplers import test_sampler
+
+ARTIFACT_VERSION = 1
+
+
+def attack_filepath(args):
+    """ File holding the attacked test set that run_attack should read """
+
+    if args.attack_box_type == "other" and args.attack_otherbox_type == "transfer":
+        filepath = args.directory + "data/attacked_dataset/" + \
+            args.dataset + "/" + args.attack_transfer_file
+
+    elif args.attack_box_type == "white":
+        filepath = attack_file_namer(args)
+    else:
+        raise AssertionError
+
+    return filepath
+
+
+def attack_initialization_filepath(args):
+    return args.directory + "data/attacked_dataset/" + \
+        args.dataset + "/" + args.attack_initialization_file
+
+
+def file_checksum(filepath, block_size=1 << 20):
+    checksum = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            checksum.update(block)
+    return checksum.hexdigest()
+
+
+def attack_artifact_metadata(args):
+    """ Everything needed to interpret an attack artifact without its filename """
+
+    from .namers import (
+        attack_params_string,
+        classifier_params_string,
+        classifier_ckpt_namer,
+        autoencoder_ckpt_namer,
+    )
+
+    checkpoints = {"classifier": classifier_ckpt_namer(args)}
+    if not args.no_autoencoder and args.autoencoder_arch != "gaussian_blur":
+        checkpoints["autoencoder"] = autoencoder_ckpt_namer(args)
+
+    checksums = {}
+    for module_name, filepath in checkpoints.items():
+        if path.exists(filepath):
+            checksums[module_name] = {
+                "file": path.basename(filepath),
+                "sha256": file_checksum(filepath),
+            }
+
+    return {
+        "dataset": args.dataset,
+        "attack": attack_params_string(args),
+        "model": classifier_params_string(args),
+        "attack_args": {
+            key: value for key, value in vars(args).items()
+            if key.startswith("attack_") and isinstance(value, (int, float, str, bool, type(None)))
+        },
+        "checksums": checksums,
+    }
+
+
+class AttackArtifactWriter(object):
+    """
+    Writes an attack artifact: a directory with a manifest.json and numbered
+    .npy chunks of images, labels, model outputs and the test set indices of
+    the images (needed when a run only covers one shard). Chunks are appended as
+    batches are attacked, and the manifest is replaced atomically after each
+    append so a reader never sees a partial chunk.
+    """
+
+    def __init__(self, dirpath, metadata, scale=1.0):
+        if path.exists(dirpath):
+            shutil.rmtree(dirpath)
+        os.makedirs(dirpath)
+
+        self.dirpath = dirpath
+        self.manifest = dict(
+            version=ARTIFACT_VERSION,
+            complete=False,
+            scale=float(scale),
+            dtype=None,
+            image_shape=None,
+            chunks=[],
+            **metadata,
+        )
+        self.write_manifest()
+
+    def write_manifest(self):
+        manifest_path = path.join(self.dirpath, "manifest.json")
+        with open(manifest_path + ".tmp", "w") as f:
+            json.dump(self.manifest, f, indent=1)
+        os.replace(manifest_path + ".tmp", manifest_path)
+
+    def append(self, images, labels, outputs=None, indices=None):
+        chunk_idx = len(self.manifest["chunks"])
+        chunk = {"count": len(images)}
+
+        for name, array in (
+            ("images", images),
+            ("labels", labels),
+            ("outputs", outputs),
+            ("indices", indices),
+        ):
+            if array is None:
+                continue
+            filename = f"{name}_{chunk_idx:05d}.npy"
+            np.save(path.join(self.dirpath, filename), array)
+            chunk[name] = filename
+
+        self.manifest["dtype"] = str(images.dtype)
+        self.manifest["image_shape"] = list(images.shape[1:])
+        self.manifest["chunks"].append(chunk)
+        self.write_manifest()
+
+    def close(self):
+        self.manifest["complete"] = True
+        self.write_manifest()
+
+
+class AttackArtifact(object):
+    """ Read side of AttackArtifactWriter, images stay memory-mapped """
+
+    def __init__(self, dirpath):
+        with open(path.join(dirpath, "manifest.json")) as f:
+            self.manifest = json.load(f)
+
+        chunks = self.manifest["chunks"]
+        self.images = ShardedArray([
+            np.load(path.join(dirpath, chunk["images"]), mmap_mode="r")
+            for chunk in chunks
+        ])
+        self.labels = np.concatenate([
+            np.load(path.join(dirpath, chunk["labels"])) for chunk in chunks
+        ])
+        if all("outputs" in chunk for chunk in chunks):
+            self.outputs = np.concatenate([
+                np.load(path.join(dirpath, chunk["outputs"])) for chunk in chunks
+            ])
+        else:
+            self.outputs = None
+
+        self.scale = self.manifest["scale"]
+
+    def __len__(self):
+        return len(self.images)
+
+
+def reference_targets(args):
+    """ Test labels for attack files written without metadata """
+
+    from torchvision import datasets
+
+    if args.dataset == "CIFAR10":
+        from .dataset_session import cifar10_arrays
+        return cifar10_arrays(args, train=False)[1]
+
+    elif args.dataset == "Tiny-ImageNet":
+        test_dir = path.join(args.directory, "data", "original_dataset",
+                             "tiny-imagenet-200", "val")
+    elif args.dataset == "Imagenette":
+        test_dir = path.join(args.directory, "data", "original_dataset",
+                             "imagenette2-160", "val")
+    else:
+        raise NotImplementedError
+
+    # only lists the files, nothing is decoded
+    return datasets.ImageFolder(test_dir).targets
+
+
+def chunked_max(images, chunk_size=1000):
+    maximum = -np.inf
+    for start in range(0, len(images), chunk_size):
+        maximum = max(maximum, float(np.max(images[start: start + chunk_size])))
+    return maximum
+
+
+def attack_file_loader(args, filepath):
+    """
+    Loader over a memory-mapped attack artifact. Each batch is copied out of
+    the page cache once and wrapped without further copies, so peak memory is
+    one batch and no dataset has to be built for the labels. Bare .npy files
+    from older runs are normalised by their maximum as before.
+    """
+
+    if path.isdir(filepath):
+        artifact = AttackArtifact(filepath)
+        images = artifact.images
+        scale = artifact.scale
+        targets = artifact.labels.tolist()
+
+    else:
+        images = np.load(filepath, mmap_mode="r")
+        scale = chunked_max(images)
+        targets = reference_targets(args)
+
+    return TensorBatchLoader(
+        TensorImageDataset(images, targets[: len(images)], scale=scale),
+        batch_size=args.test_batch_size,
+        sampler=test_sampler(args, len(images)),
+    )
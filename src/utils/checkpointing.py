@@ -0,0 +1,122 @@
+"""
+Full training state (model, optimizer, scheduler, RNG states, epoch) saved
+atomically every few epochs, so that a preempted run can continue with
+--resume exactly where it stopped. With several processes rank 0 writes the
+state and every rank writes its own RNG states next to it
+"""
+
+import os
+import random
+from os import path
+
+import numpy as np
+import torch
+
+from .distributed import unwrap_model
+
+
+def rng_state():
+    state = {
+        "torch": torch.get_rng_state(),
+        "numpy": np.random.get_state(),
+        "random": random.getstate(),
+    }
+    if torch.cuda.is_available():
+        state["cuda"] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def set_rng_state(state):
+    torch.set_rng_state(state["torch"])
+    np.random.set_state(state["numpy"])
+    random.setstate(state["random"])
+    if "cuda" in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state["cuda"])
+
+
+def atomic_save(obj, filepath):
+    """ torch.save into a temporary file renamed over filepath, so an
+    interrupted write leaves the previous file intact """
+
+    if not path.exists(path.dirname(filepath)):
+        os.makedirs(path.dirname(filepath))
+    torch.save(obj, filepath + ".tmp")
+    os.replace(filepath + ".tmp", filepath)
+
+
+def rng_state_namer(filepath, rank):
+    return filepath[: -len(".pt")] + f"_rng_rank_{rank}.pt"
+
+
+def load_rng_state(filepath):
+    # generator states are CPU tensors whatever the model device
+    rng = torch.load(filepath, map_location="cpu")
+    set_rng_state(rng)
+
+
+def save_training_state(args, filepath, epoch, model, optimizer, scheduler=None, sampler=None):
+    """ Everything needed to continue as if training never stopped, epoch is
+    the number of finished epochs. Must be called by every process at the end
+    of an epoch, after the test pass """
+
+    rank = getattr(args, "rank", 0)
+    if rank != 0:
+        atomic_save(rng_state(), rng_state_namer(filepath, rank))
+        return
+
+    state = {
+        "epoch": epoch,
+        "model": unwrap_model(model).state_dict(),
+        "optimizer": optimizer.state_dict(),
+        "scheduler": scheduler.state_dict() if scheduler is not None else None,
+        "sampler": sampler.state_dict() if hasattr(sampler, "state_dict") else None,
+        "rng": rng_state(),
+    }
+    atomic_save(state, filepath)
+
+
+def load_training_state(filepath, model, optimizer, scheduler=None, sampler=None, rank=0):
+    """ Restores a state written by save_training_state, with the RNG states
+    of process rank, and returns the number of finished epochs """
+
+    device = model.parameters().__next__().device
+    state = torch.load(filepath, map_location=device)
+
+    unwrap_model(model).load_state_dict(state["model"])
+    optimizer.load_state_dict(state["optimizer"])
+    if scheduler is not None and state["scheduler"] is not None:
+        scheduler.load_state_dict(state["scheduler"])
+    if hasattr(sampler, "load_state_dict") and state["sampler"] is not None:
+        sampler.load_state_dict(state["sampler"])
+
+    rank_filepath = rng_state_namer(filepath, rank)
+    if rank != 0 and path.exists(rank_filepath):
+        load_rng_state(rank_filepath)
+    else:
+        # torch.load moved the CPU generator states to device
+        rng = state["rng"]
+        rng["torch"] = rng["torch"].cpu()
+        if "cuda" in rng:
+            rng["cuda"] = [generator_state.cpu() for generator_state in rng["cuda"]]
+        set_rng_state(rng)
+
+    return state["epoch"]
+
+
+def resume_epoch(args, filepath, model, optimizer, scheduler=None, sampler=None):
+    """ Number of epochs already done: the saved one with --resume and an
+    existing training state, 0 otherwise """
+
+    if not args.resume or not path.exists(filepath):
+        return 0
+    return load_training_state(
+        filepath, model, optimizer, scheduler, sampler, getattr(args, "rank", 0))
+
+
+def should_save_state(args, epoch):
+    # true on every process, save_training_state decides what each one writes
+    return (
+        args.save_checkpoint
+        and args.checkpoint_interval > 0
+        and epoch % args.checkpoint_interval == 0
+    )
@@ -0,0 +1,287 @@
+"""
+On-disk cache of the top-T codes of a frozen encoder. With zero padding p and
+stride s, a crop at offset d of the padded image sees the patches of the
+padded image that start at d, d + s, ..., so the codes of every crop are a
+window of one of s * s (row, column) parity maps computed on the whole padded
+image. With flips that makes 2 * s * s maps per image: the cache stores those
+once, as int16 atom indices and float16 absolute values, and an epoch only
+reads windows back instead of running the dictionary convolution and topk.
+"""
+
+import json
+import os
+import shutil
+from os import path
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from .fast_loaders import TensorBatchLoader, sample_crop_flip, crop_flip
+
+CODE_CACHE_VERSION = 1
+
+
+def code_map_keys(stride, padding, augment):
+    """ (row parity, column parity, flip) of every stored map """
+    if not augment:
+        return [(padding % stride, padding % stride, False)]
+    return [
+        (row_parity, col_parity, flip)
+        for row_parity in range(stride)
+        for col_parity in range(stride)
+        for flip in (False, True)
+    ]
+
+
+def build_code_cache(encoder, dataset, cache_dir, T, padding=4, augment=True, batch_size=250):
+    """ Encodes every image of a TensorImageDataset into cache_dir. Written
+    into a temporary directory first so an interrupted build is never read """
+
+    conv = encoder.conv
+    device = conv.weight.device
+    stride = conv.stride[0]
+    patch_size = conv.kernel_size[0]
+    nb_images, _, height, width = dataset.images.shape
+    keys = code_map_keys(stride, padding, augment)
+
+    # the map with parity 0 is the largest one, smaller ones are zero filled
+    map_size = (height + 2 * padding - patch_size) // stride + 1
+    code_size = (height - patch_size) // stride + 1
+
+    tmp_dir = cache_dir + ".tmp"
+    if path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+
+    shape = (nb_images, len(keys), T, map_size, map_size)
+    # int16 indices and float16 values
+    nb_bytes = 4 * int(np.prod(shape))
+    free_bytes = shutil.disk_usage(tmp_dir).free
+    print(f"Code cache size: {nb_bytes / 2 ** 30:.2f} GiB, {free_bytes / 2 ** 30:.2f} GiB free")
+    if nb_bytes > free_bytes:
+        shutil.rmtree(tmp_dir)
+        raise OSError(
+            f"Not enough disk space for the code cache in {cache_dir}: "
+            f"{nb_bytes / 2 ** 30:.2f} GiB needed, {free_bytes / 2 ** 30:.2f} GiB free")
+    indices_map = np.lib.format.open_memmap(
+        path.join(tmp_dir, "indices.npy"), mode="w+", dtype=np.int16, shape=shape)
+    values_map = np.lib.format.open_memmap(
+        path.join(tmp_dir, "values.npy"), mode="w+", dtype=np.float16, shape=shape)
+
+    with torch.no_grad():
+        for start in range(0, nb_images, batch_size):
+            batch = slice(start, min(start + batch_size, nb_images))
+            images = dataset.take(batch).to(device).float().div_(dataset.scale)
+            padded = F.pad(images, [padding] * 4)
+
+            for map_idx, (row_parity, col_parity, flip) in enumerate(keys):
+                x = padded.flip(3) if flip else padded
+                codes = conv(x[:, :, row_parity:, col_parity:])
+                values, indices = torch.topk(codes.abs(), T, dim=1)
+                rows, cols = codes.shape[2:]
+                indices_map[batch, map_idx, :, :rows, :cols] = \
+                    indices.short().cpu().numpy()
+                values_map[batch, map_idx, :, :rows, :cols] = \
+                    values.half().cpu().numpy()
+
+    indices_map.flush()
+    values_map.flush()
+    del indices_map, values_map
+
+    manifest = {
+        "version": CODE_CACHE_VERSION,
+        "nb_images": nb_images,
+        "nb_atoms": conv.out_channels,
+        "T": T,
+        "stride": stride,
+        "padding": padding,
+        "augment": augment,
+        "map_size": map_size,
+        "code_size": code_size,
+        "keys": keys,
+    }
+    with open(path.join(tmp_dir, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=1)
+
+    if path.exists(cache_dir):
+        shutil.rmtree(cache_dir)
+    os.replace(tmp_dir, cache_dir)
+
+
+class CodeCache(object):
+    """ Read side of build_code_cache, codes stay memory-mapped """
+
+    def __init__(self, cache_dir):
+        with open(path.join(cache_dir, "manifest.json")) as f:
+            self.manifest = json.load(f)
+
+        self.indices = np.load(path.join(cache_dir, "indices.npy"), mmap_mode="r")
+        self.values = np.load(path.join(cache_dir, "values.npy"), mmap_mode="r")
+        self.nb_atoms = self.manifest["nb_atoms"]
+        self.T = self.manifest["T"]
+        self.stride = self.manifest["stride"]
+        self.padding = self.manifest["padding"]
+        self.augment = self.manifest["augment"]
+        self.code_size = self.manifest["code_size"]
+
+    def __len__(self):
+        return self.manifest["nb_images"]
+
+    def map_positions(self, offsets_y, offsets_x, flips):
+        """ Stored map and window start of each crop. Flipping after the crop
+        equals cropping the flipped padded image at the mirrored offset """
+        offsets_x = torch.where(flips, 2 * self.padding - offsets_x, offsets_x)
+
+        if self.augment:
+            map_ids = ((offsets_y % self.stride) * self.stride
+                       + offsets_x % self.stride) * 2 + flips.long()
+        else:
+            map_ids = torch.zeros_like(offsets_y)
+
+        return map_ids, offsets_y // self.stride, offsets_x // self.stride
+
+    def codes(self, indices, offsets_y, offsets_x, flips):
+        """ Dense (B, nb_atoms, L, L) codes of the crops, what take_top_T
+        returns on the cropped (and flipped) images """
+
+        map_ids, starts_y, starts_x = self.map_positions(
+            offsets_y, offsets_x, flips)
+        image_ids = np.asarray(indices)
+        stored_ids = map_ids.numpy()
+
+        atom_ids = torch.from_numpy(
+            self.indices[image_ids, stored_ids].astype(np.int64))
+        values = torch.from_numpy(
+            self.values[image_ids, stored_ids].astype(np.float32))
+
+        batch_size = len(image_ids)
+        window = torch.arange(self.code_size)
+        rows = (starts_y.view(-1, 1) + window).view(batch_size, 1, -1, 1)
+        cols = (starts_x.view(-1, 1) + window).view(batch_size, 1, 1, -1)
+        batch_ids = torch.arange(batch_size).view(-1, 1, 1, 1)
+        topk_ids = torch.arange(self.T).view(1, -1, 1, 1)
+
+        codes = torch.zeros(
+            batch_size, self.nb_atoms, self.code_size, self.code_size)
+        return codes.scatter_(
+            1,
+            atom_ids[batch_ids, topk_ids, rows, cols],
+            values[batch_ids, topk_ids, rows, cols],
+        )
+
+
+def load_code_cache(encoder, dataset, cache_dir, T, padding=4, augment=True):
+    """ CodeCache of dataset under cache_dir, built on first use """
+
+    manifest_path = path.join(cache_dir, "manifest.json")
+    if path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        if (
+            manifest["version"] == CODE_CACHE_VERSION
+            and manifest["nb_images"] == len(dataset)
+            and manifest["nb_atoms"] == encoder.conv.out_channels
+            and manifest["T"] == T
+            and manifest["padding"] == padding
+            and manifest["augment"] == augment
+        ):
+            return CodeCache(cache_dir)
+
+    print(f"Caching top-{T} codes into {cache_dir}")
+    build_code_cache(encoder, dataset, cache_dir, T, padding, augment)
+    return CodeCache(cache_dir)
+
+
+class CodeCacheLoader(TensorBatchLoader):
+    """
+    Yields (codes, targets) like a TensorBatchLoader yields (images, targets).
+    With yield_images the second element is the augmented image batch
+    instead, the reconstruction target of the decoder. Codes and images of a
+    batch share the same crop offsets and flips.
+    """
+
+    def __init__(self, cache, dataset, batch_size, sampler=None, augment=False, padding=4, yield_images=False):
+        super(CodeCacheLoader, self).__init__(
+            dataset,
+            batch_size,
+            augment=augment,
+            padding=padding,
+            sampler=sampler,
+        )
+        self.cache = cache
+        self.yield_images = yield_images
+
+    def __iter__(self):
+        for indices in self.index_batches():
+            if isinstance(indices, slice):
+                indices = torch.arange(indices.start, indices.stop)
+            batch_size = len(indices)
+
+            if self.augment:
+                offsets_y, offsets_x, flips = sample_crop_flip(
+                    batch_size, self.padding)
+            else:
+                offsets_y = torch.full((batch_size,), self.padding, dtype=torch.long)
+                offsets_x = torch.full((batch_size,), self.padding, dtype=torch.long)
+                flips = torch.zeros(batch_size, dtype=torch.bool)
+
+            codes = self.cache.codes(indices, offsets_y, offsets_x, flips)
+
+            if self.yield_images:
+                images = self.dataset.take(indices)
+                if self.augment:
+                    images = crop_flip(
+                        images, self.padding, offsets_y, offsets_x, flips)
+                yield codes, images.float().div_(self.dataset.scale)
+            else:
+                yield codes, self.dataset.targets_tensor[indices]
+
+
+def code_cache_loaders(args, encoder, yield_images=False):
+    """
+    Train/test loaders of top-T codes of the frozen encoder, on top of the
+    tensor backend. Training codes cover every RandomCrop(padding=4) + flip
+    augmentation, test codes only the unaugmented image.
+    """
+
+    from copy import copy
+    from .namers import code_cache_namer
+    from .read_datasets import cifar10, tiny_imagenet, imagenette
+
+    if not hasattr(encoder, "T"):
+        raise ValueError("The code cache needs a top_T encoder")
+
+    tensor_args = copy(args)
+    tensor_args.data_backend = "tensor"
+    if args.dataset == "CIFAR10":
+        train_loader, test_loader = cifar10(tensor_args)
+    elif args.dataset == "Tiny-ImageNet":
+        train_loader, test_loader = tiny_imagenet(tensor_args)
+    elif args.dataset == "Imagenette":
+        train_loader, test_loader = imagenette(tensor_args)
+    else:
+        raise NotImplementedError
+
+    loaders = []
+    for loader, train in ((train_loader, True), (test_loader, False)):
+        augment = train and args.code_cache_augment
+        cache = load_code_cache(
+            encoder,
+            loader.dataset,
+            code_cache_namer(args, train),
+            encoder.T,
+            padding=loader.padding,
+            augment=augment,
+        )
+        loaders.append(CodeCacheLoader(
+            cache,
+            loader.dataset,
+            loader.batch_size,
+            sampler=loader.sampler,
+            augment=augment,
+            padding=loader.padding,
+            yield_images=yield_images,
+        ))
+
+    return loaders[0], loaders[1]
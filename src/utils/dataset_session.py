@@ -0,0 +1,146 @@
+"""
+Process-wide access to decoded CIFAR10 arrays. The batch files are checksummed
+once, after which a small stamp file and a decoded .npy copy let later runs skip
+both the md5 verification and the unpickling.
+"""
+
+import json
+import pickle
+from os import path
+
+import numpy as np
+import torch
+from PIL import Image
+
+CIFAR10_FOLDER = "cifar-10-batches-py"
+
+_cifar10_arrays = {}
+_cifar10_tensors = {}
+
+
+def cifar10_root(args):
+    return args.directory + "data/original_dataset"
+
+
+def file_stats(filepaths):
+    """ Size and modification time of each file, None if any is missing """
+    stats = {}
+    for filepath in filepaths:
+        if not path.exists(filepath):
+            return None
+        stat = path.getsize(filepath), int(path.getmtime(filepath) * 1e9)
+        stats[path.basename(filepath)] = list(stat)
+    return stats
+
+
+def cifar10_batch_files(root, train):
+    from torchvision.datasets import CIFAR10
+
+    file_list = CIFAR10.train_list if train else CIFAR10.test_list
+    return [path.join(root, CIFAR10_FOLDER, file_name) for file_name, _ in file_list]
+
+
+def decoded_filepaths(root, train):
+    split = "train" if train else "test"
+    return (
+        path.join(root, CIFAR10_FOLDER, f"decoded_{split}_data.npy"),
+        path.join(root, CIFAR10_FOLDER, f"decoded_{split}_targets.npy"),
+    )
+
+
+def decode_cifar10(root, train):
+    """ Same decoding as torchvision's CIFAR10, data is NHWC uint8 """
+
+    data = []
+    targets = []
+    for filepath in cifar10_batch_files(root, train):
+        with open(filepath, "rb") as f:
+            entry = pickle.load(f, encoding="latin1")
+        data.append(entry["data"])
+        targets.extend(entry["labels"] if "labels" in entry else entry["fine_labels"])
+
+    data = np.vstack(data).reshape(-1, 3, 32, 32).transpose(0, 2, 3, 1)
+    return np.ascontiguousarray(data), np.array(targets, dtype=np.int64)
+
+
+def prepare_cifar10(root, train):
+    """ Downloads/verifies CIFAR10 if the stamp does not match the files on
+    disk, and (re)writes the decoded copy and the stamp """
+
+    stamp_path = path.join(
+        root, CIFAR10_FOLDER, f".verified_{'train' if train else 'test'}.json")
+    all_files = cifar10_batch_files(root, train) + \
+        list(decoded_filepaths(root, train))
+
+    current_stats = file_stats(all_files)
+    if current_stats is not None and path.exists(stamp_path):
+        with open(stamp_path) as f:
+            if json.load(f) == current_stats:
+                return
+
+    from torchvision.datasets import CIFAR10
+
+    # downloads if needed and runs the md5 checks
+    CIFAR10(root=root, train=train, download=True)
+
+    data, targets = decode_cifar10(root, train)
+    data_path, targets_path = decoded_filepaths(root, train)
+    np.save(data_path, data)
+    np.save(targets_path, targets)
+
+    with open(stamp_path, "w") as f:
+        json.dump(file_stats(all_files), f)
+
+
+def cifar10_arrays(args, train):
+    """ (data, targets) of a CIFAR10 split, decoded once per process.
+    data is a read-only NHWC uint8 memory map, targets a list of ints """
+
+    root = cifar10_root(args)
+    key = (root, train)
+    if key not in _cifar10_arrays:
+        prepare_cifar10(root, train)
+        data_path, targets_path = decoded_filepaths(root, train)
+        _cifar10_arrays[key] = (
+            np.load(data_path, mmap_mode="r"),
+            np.load(targets_path).tolist(),
+        )
+
+    return _cifar10_arrays[key]
+
+
+def cifar10_tensor_images(args, train):
+    """ NCHW uint8 tensor copy of the split, also made once per process """
+
+    key = (cifar10_root(args), train)
+    if key not in _cifar10_tensors:
+        data, _ = cifar10_arrays(args, train)
+        _cifar10_tensors[key] = torch.from_numpy(
+            np.array(data.transpose(0, 3, 1, 2), order="C"))
+
+    return _cifar10_tensors[key]
+
+
+class CIFAR10Arrays(torch.utils.data.Dataset):
+    """ Behaves like torchvision's CIFAR10 but is built on cifar10_arrays """
+
+    def __init__(self, args, train=True, transform=None, target_transform=None):
+        super(CIFAR10Arrays, self).__init__()
+        self.train = train
+        self.data, self.targets = cifar10_arrays(args, train)
+        self.transform = transform
+        self.target_transform = target_transform
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, index):
+        img, target = Image.fromarray(np.array(self.data[index])), self.targets[index]
+
+        if self.transform is not None:
+            img = self.transform(img)
+
+        if self.target_transform is not None:
+            target = self.target_transform(target)
+
+        return img, target
@@ -0,0 +1,212 @@
+"""
+Online dictionary learning (Mairal et al. 2009) in torch, a drop-in for
+sklearn's MiniBatchDictionaryLearning in learn_patch_dict.py: same alpha,
+n_iter and batch_size semantics, same fit/partial_fit/components_/get_params.
+
+Each iteration sparse codes a minibatch with batched FISTA
+(utils/sparse_coding.py), accumulates the sufficient statistics A = sum z z^T
+and B = sum x z^T with sklearn's forgetting factor, and updates the atoms by
+one pass of block coordinate descent. Everything is a matrix product, so it
+uses all cores through torch's intra-op threads, or the GPU.
+"""
+
+import numpy as np
+import torch
+
+from .sparse_coding import fista
+
+
+class TorchDictionaryLearning(object):
+    """
+    Rows are atoms as in sklearn, components_ is (n_components, n_features).
+    partial_fit does one update per batch_size rows of the given patches, so
+    streaming patches from a loader visits them in order without storing them.
+    """
+
+    def __init__(
+        self,
+        n_components,
+        alpha=1.0,
+        n_iter=1000,
+        batch_size=5,
+        fista_iter=100,
+        random_state=None,
+        device=None,
+        n_threads=None,
+    ):
+        self.n_components = n_components
+        self.alpha = alpha
+        self.n_iter = n_iter
+        self.batch_size = batch_size
+        self.fista_iter = fista_iter
+        self.random_state = random_state
+        self.device = torch.device(device or "cpu")
+        self.n_threads = n_threads
+
+        self.dictionary = None  # (n_features, n_components), column notation
+        self.A = None
+        self.B = None
+        self.n_iter_ = 0
+        # fit's pass over shuffled X
+        self.permutation = None
+        self.position = 0
+        # rows of partial_fit's X already used
+        self.partial_position = 0
+        self.generator = torch.Generator()
+        if random_state is not None:
+            self.generator.manual_seed(random_state)
+
+        if n_threads:
+            torch.set_num_threads(n_threads)
+
+    @property
+    def components_(self):
+        return self.dictionary.t().cpu().numpy()
+
+    def get_params(self):
+        return dict(
+            n_components=self.n_components,
+            alpha=self.alpha,
+            n_iter=self.n_iter,
+            batch_size=self.batch_size,
+            fista_iter=self.fista_iter,
+            random_state=self.random_state,
+            learner="torch",
+        )
+
+    def state_dict(self):
+        """ Everything fit and partial_fit need to continue where they
+        stopped, given the same X """
+        return {
+            "params": self.get_params(),
+            "dictionary": self.dictionary.cpu(),
+            "A": self.A.cpu(),
+            "B": self.B.cpu(),
+            "n_iter": self.n_iter_,
+            "permutation": self.permutation,
+            "position": self.position,
+            "partial_position": self.partial_position,
+            "generator": self.generator.get_state(),
+        }
+
+    def load_state_dict(self, state):
+        if state["params"]["n_components"] != self.n_components:
+            raise ValueError(
+                "The snapshot has {} atoms, not {}".format(
+                    state["params"]["n_components"], self.n_components))
+        self.dictionary = state["dictionary"].to(self.device)
+        self.A = state["A"].to(self.device)
+        self.B = state["B"].to(self.device)
+        self.n_iter_ = state["n_iter"]
+        self.permutation = state["permutation"]
+        self.position = state["position"]
+        self.partial_position = state.get("partial_position", 0)
+        self.generator.set_state(state["generator"])
+
+    def _as_tensor(self, X):
+        """ uint8 patches (values in [0, 255]) stay uint8 and are scaled to
+        [0, 1] one minibatch at a time """
+        if isinstance(X, np.ndarray):
+            X = torch.from_numpy(X)
+        X = X.reshape(X.shape[0], -1)
+        if X.dtype == torch.uint8:
+            return X.to(self.device)
+        return X.to(self.device, torch.float32)
+
+    @staticmethod
+    def _minibatch(X, indices):
+        batch = X[indices]
+        if batch.dtype == torch.uint8:
+            return batch.float().div_(255.0)
+        return batch
+
+    def _initialize(self, X):
+        """ Atoms are random patches of the first batch, normalized """
+        n_features = X.shape[1]
+        indices = torch.randint(
+            X.shape[0], (self.n_components,), generator=self.generator)
+        dictionary = self._minibatch(X, indices.to(X.device)).t().clone()
+        dictionary += 1e-3 * torch.randn(
+            dictionary.shape, generator=self.generator).to(self.device)
+        self.dictionary = dictionary / dictionary.norm(dim=0, keepdim=True)
+        self.A = torch.zeros(
+            self.n_components, self.n_components, device=self.device)
+        self.B = torch.zeros(n_features, self.n_components, device=self.device)
+
+    def _update_dictionary(self):
+        """ One pass of block coordinate descent over the atoms, with the
+        atoms projected on the unit ball. Unused atoms (A[j, j] ~ 0) are
+        kept as they are, masked on the device instead of tested on the host """
+        for j in range(self.n_components):
+            usage = self.A[j, j]
+            atom = self.dictionary[:, j] + (
+                self.B[:, j] - self.dictionary @ self.A[:, j]) / usage.clamp(min=1e-10)
+            atom = atom / atom.norm().clamp(min=1.0)
+            self.dictionary[:, j] = torch.where(
+                usage >= 1e-10, atom, self.dictionary[:, j])
+
+    def _step(self, X):
+        codes = fista(X, self.dictionary.t(), self.alpha, self.fista_iter)
+
+        # forgetting factor of sklearn's dict_learning_online
+        it = self.n_iter_
+        if it < self.batch_size - 1:
+            theta = float((it + 1) * self.batch_size)
+        else:
+            theta = float(self.batch_size ** 2 + it + 1 - self.batch_size)
+        beta = (theta + 1 - self.batch_size) / (theta + 1)
+
+        self.A.mul_(beta).add_(codes.t() @ codes)
+        self.B.mul_(beta).add_(X.t() @ codes)
+        self._update_dictionary()
+        self.n_iter_ += 1
+
+    def partial_fit(self, X, callback=None):
+        """ One iteration per batch_size rows of X, none once n_iter
+        iterations are done. callback() is called after every iteration; a
+        state_dict taken in it records the rows of X already used, and the
+        same X given after load_state_dict continues from there """
+        X = self._as_tensor(X)
+        if self.dictionary is None:
+            self._initialize(X)
+        with torch.no_grad():
+            for start in range(self.partial_position, X.shape[0], self.batch_size):
+                if self.n_iter_ >= self.n_iter:
+                    break
+                self._step(self._minibatch(
+                    X, slice(start, start + self.batch_size)))
+                self.partial_position = start + self.batch_size
+                if callback is not None:
+                    callback()
+        self.partial_position = 0
+        return self
+
+    def fit(self, X, callback=None):
+        """ n_iter iterations over minibatches drawn from shuffled X,
+        callback() is called after every iteration """
+        X = self._as_tensor(X)
+        if self.dictionary is None:
+            self._initialize(X)
+        if self.permutation is None or len(self.permutation) != X.shape[0]:
+            self.permutation = torch.randperm(
+                X.shape[0], generator=self.generator)
+            self.position = 0
+        with torch.no_grad():
+            while self.n_iter_ < self.n_iter:
+                if self.position + self.batch_size > X.shape[0]:
+                    self.permutation = torch.randperm(
+                        X.shape[0], generator=self.generator)
+                    self.position = 0
+                batch = self.permutation[
+                    self.position: self.position + self.batch_size]
+                self.position += self.batch_size
+                self._step(self._minibatch(X, batch.to(X.device)))
+                if callback is not None:
+                    callback()
+        return self
+
+    def transform(self, X):
+        with torch.no_grad():
+            X = self._minibatch(self._as_tensor(X), slice(None))
+            return fista(X, self.dictionary.t(),
+                         self.alpha, self.fista_iter).cpu().numpy()
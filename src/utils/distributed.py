@@ -0,0 +1,115 @@
+"""
+Multi-process data-parallel training. Processes are started by src/launch.py
+(or any launcher that sets RANK, WORLD_SIZE, MASTER_ADDR and MASTER_PORT),
+each one reads its own shard of every epoch and gradients are all-reduced by
+DistributedDataParallel. gloo works on CPU-only hosts and across hosts.
+"""
+
+import logging
+import os
+from contextlib import contextmanager
+
+import torch
+import torch.distributed as dist
+
+
+def init_distributed(args):
+    """ Joins the process group if the environment describes one, and makes
+    this process read shard RANK of WORLD_SIZE. Sets args.rank,
+    args.world_size and args.local_rank in any case """
+
+    args.world_size = int(os.environ.get("WORLD_SIZE", 1))
+    args.rank = int(os.environ.get("RANK", 0))
+    args.local_rank = int(os.environ.get("LOCAL_RANK", 0))
+
+    if args.world_size <= 1:
+        return False
+
+    if args.data_backend == "tar":
+        # streamed shards can differ in length, processes would fall out of step
+        raise ValueError(
+            "Distributed training needs a sampled backend, not --data_backend=tar")
+
+    dist.init_process_group(
+        backend=args.dist_backend,
+        init_method="env://",
+        world_size=args.world_size,
+        rank=args.rank,
+    )
+    args.num_shards = args.world_size
+    args.shard_index = args.rank
+
+    if "OMP_NUM_THREADS" in os.environ:
+        torch.set_num_threads(int(os.environ["OMP_NUM_THREADS"]))
+
+    return True
+
+
+def is_distributed():
+    return dist.is_available() and dist.is_initialized()
+
+
+def is_main_process(args):
+    return getattr(args, "rank", 0) == 0
+
+
+@contextmanager
+def main_process_first(args):
+    """ Lets rank 0 build shared caches (decoded datasets, tar shards, code
+    caches) before the other processes read them """
+
+    if is_distributed() and not is_main_process(args):
+        dist.barrier()
+    yield
+    if is_distributed() and is_main_process(args):
+        dist.barrier()
+
+
+def distributed_device(args, use_cuda):
+    if use_cuda:
+        torch.cuda.set_device(args.local_rank)
+        return torch.device("cuda", args.local_rank)
+    return torch.device("cpu")
+
+
+def distributed_model(model, device):
+    """ DistributedDataParallel wrapper, parameters are broadcast from rank 0 """
+    if device.type == "cuda":
+        return torch.nn.parallel.DistributedDataParallel(
+            model, device_ids=[device.index], output_device=device.index)
+    return torch.nn.parallel.DistributedDataParallel(model)
+
+
+def unwrap_model(model):
+    """ Module whose state_dict has the same keys as in single-process runs """
+    if isinstance(model, (torch.nn.parallel.DistributedDataParallel, torch.nn.DataParallel)):
+        return model.module
+    return model
+
+
+def all_reduce_metrics(values, weight=1.0):
+    """ Averages per-process metrics over all processes, weighting each
+    process by weight (e.g. its number of samples). Identity without a
+    process group """
+
+    if not is_distributed():
+        return values
+
+    totals = torch.tensor([value * weight for value in values] + [weight],
+                          dtype=torch.float64)
+    dist.all_reduce(totals)
+    return [total / totals[-1].item() for total in totals[:-1].tolist()]
+
+
+def log_handlers(args, log_filepath):
+    """ Only rank 0 writes the log file """
+
+    import sys
+
+    if is_main_process(args):
+        return [logging.FileHandler(log_filepath), logging.StreamHandler(sys.stdout)]
+    return [logging.StreamHandler(sys.stdout)]
+
+
+def log_level(args):
+    return logging.INFO if is_main_process(args) else logging.WARNING
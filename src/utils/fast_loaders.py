@@ -0,0 +1,210 @@
+"""
+Batched data pipelines that keep whole datasets as uint8 tensors in memory and
+augment entire batches with tensor indexing instead of per-sample PIL ops.
+"""
+
+import math
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from .samplers import train_sampler, test_sampler
+
+
+def sample_crop_flip(batch_size, padding=4, flip=True):
+    """ Samples crop offsets and flip decisions with the same distribution as
+    RandomCrop(padding=padding) followed by RandomHorizontalFlip() """
+
+    offsets_y = torch.randint(0, 2 * padding + 1, (batch_size,))
+    offsets_x = torch.randint(0, 2 * padding + 1, (batch_size,))
+    if flip:
+        flips = torch.rand(batch_size) < 0.5
+    else:
+        flips = torch.zeros(batch_size, dtype=torch.bool)
+
+    return offsets_y, offsets_x, flips
+
+
+def crop_flip(images, padding, offsets_y, offsets_x, flips):
+    """ Zero pads a (B, C, H, W) batch, crops each image at its own offset and
+    flips the selected ones horizontally, all in a single gather """
+
+    batch_size, nb_channels, height, width = images.shape
+    padded = F.pad(images, [padding] * 4)
+
+    rows = offsets_y.view(-1, 1) + torch.arange(height).view(1, -1)
+    cols = offsets_x.view(-1, 1) + torch.arange(width).view(1, -1)
+    # flipping after the crop is the same as reading the crop backwards
+    cols = torch.where(flips.view(-1, 1), cols.flip(1), cols)
+
+    return padded[
+        torch.arange(batch_size).view(-1, 1, 1, 1),
+        torch.arange(nb_channels).view(1, -1, 1, 1),
+        rows.view(batch_size, 1, height, 1),
+        cols.view(batch_size, 1, 1, width),
+    ]
+
+
+def random_crop_flip(images, padding=4, flip=True):
+    offsets_y, offsets_x, flips = sample_crop_flip(
+        images.shape[0], padding, flip)
+    return crop_flip(images, padding, offsets_y, offsets_x, flips)
+
+
+class TensorImageDataset(torch.utils.data.Dataset):
+    """
+    Images stored as one (N, C, H, W) array, uint8 unless stated otherwise.
+    Anything that supports len() and indexing with an index array works as
+    images (tensor, numpy array, memory map).
+    """
+
+    def __init__(self, images, targets, scale=255.0):
+        super(TensorImageDataset, self).__init__()
+        self.images = images
+        self.targets = list(targets)
+        self.targets_tensor = torch.tensor(self.targets, dtype=torch.long)
+        self.scale = scale
+
+    def __len__(self):
+        return len(self.targets)
+
+    def __getitem__(self, index):
+        image = self.take(torch.tensor([index]))[0]
+        return image.float().div_(self.scale), self.targets[index]
+
+    @property
+    def data(self):
+        """ NHWC numpy view, same layout as torchvision's CIFAR10.data """
+        images = self.images
+        if isinstance(images, torch.Tensor):
+            images = images.numpy()
+        return np.asarray(images).transpose(0, 2, 3, 1)
+
+    def take(self, indices):
+        """ Returns the images at indices as a tensor of the stored dtype """
+        if isinstance(self.images, torch.Tensor):
+            return self.images[indices]
+
+        if isinstance(indices, slice):
+            batch = self.images[indices]
+        else:
+            batch = self.images[np.asarray(indices)]
+        if not batch.flags.writeable or not batch.flags.c_contiguous:
+            # slices of read-only memory maps still point into the file
+            batch = np.array(batch)
+        return torch.from_numpy(batch)
+
+
+class TensorBatchLoader(object):
+    """
+    Drop-in replacement for DataLoader over a TensorImageDataset. Every batch
+    is built with one index operation, augmented as a whole and converted to
+    float in one go, so there are no workers and no collation.
+    """
+
+    def __init__(
+        self,
+        dataset,
+        batch_size,
+        shuffle=False,
+        augment=False,
+        padding=4,
+        drop_last=False,
+        sampler=None,
+    ):
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.augment = augment
+        self.padding = padding
+        self.drop_last = drop_last
+        self.sampler = sampler
+
+    def __len__(self):
+        nb_samples = len(self.sampler) if self.sampler is not None else len(
+            self.dataset)
+        if self.drop_last:
+            return nb_samples // self.batch_size
+        return math.ceil(nb_samples / self.batch_size)
+
+    def index_batches(self):
+        if self.sampler is not None:
+            order = torch.as_tensor(list(iter(self.sampler)), dtype=torch.long)
+        elif self.shuffle:
+            order = torch.randperm(len(self.dataset))
+        else:
+            order = None
+
+        for batch_idx in range(len(self)):
+            start = batch_idx * self.batch_size
+            if order is None:
+                yield slice(start, min(start + self.batch_size, len(self.dataset)))
+            else:
+                yield order[start: start + self.batch_size]
+
+    def __iter__(self):
+        for indices in self.index_batches():
+            images = self.dataset.take(indices)
+            if self.augment:
+                images = random_crop_flip(images, self.padding)
+
+            yield images.float().div_(self.dataset.scale), self.dataset.targets_tensor[indices]
+
+
+def cifar10_tensor(args):
+    """ CIFAR10 train and test loaders on top of in-memory uint8 tensors """
+
+    from .dataset_session import cifar10_arrays, cifar10_tensor_images
+
+    train_targets = cifar10_arrays(args, train=True)[1]
+    test_targets = cifar10_arrays(args, train=False)[1]
+    train_images = cifar10_tensor_images(args, train=True)
+    test_images = cifar10_tensor_images(args, train=False)
+
+    train_loader = TensorBatchLoader(
+        TensorImageDataset(train_images, train_targets),
+        batch_size=args.train_batch_size,
+        sampler=train_sampler(args, len(train_targets)),
+        augment=True,
+        padding=4,
+    )
+    test_loader = TensorBatchLoader(
+        TensorImageDataset(test_images, test_targets),
+        batch_size=args.test_batch_size,
+        sampler=test_sampler(args, len(test_targets)),
+    )
+
+    return train_loader, test_loader
+
+
+def image_folder_tensor(args, train_dir, test_dir):
+    """ Train and test loaders over the memory-mapped uint8 cache of an
+    ImageFolder dataset. Images are center cropped to args.image_shape once,
+    then train batches get RandomCrop(padding=4) + flip as tensor ops """
+
+    from os import path
+    from .image_cache import load_image_cache
+
+    image_size = args.image_shape[0]
+    cache_dir = path.join(args.directory, "data", "cached_dataset", args.dataset)
+
+    train_images, train_targets = load_image_cache(
+        train_dir, path.join(cache_dir, f"train_{image_size}"), image_size)
+    test_images, test_targets = load_image_cache(
+        test_dir, path.join(cache_dir, f"val_{image_size}"), image_size)
+
+    train_loader = TensorBatchLoader(
+        TensorImageDataset(train_images, train_targets),
+        batch_size=args.train_batch_size,
+        sampler=train_sampler(args, len(train_targets)),
+        augment=True,
+        padding=4,
+    )
+    test_loader = TensorBatchLoader(
+        TensorImageDataset(test_images, test_targets),
+        batch_size=args.test_batch_size,
+        sampler=test_sampler(args, len(test_targets)),
+    )
+
+    return train_loader, test_loader
@@ -57,6 +57,9 @@ def get_autoencoder(args):
     device = torch.device("cuda" if use_cuda else "cpu")
 
     autoencoder = autoencoder_dict[args.autoencoder_arch](args).to(device)
+    if args.dict_prune_nbatoms:
+        # the checkpoint holds the kept atoms, see prune_dictionary.py
+        prune_autoencoder(autoencoder, range(args.dict_prune_nbatoms))
 
     if args.autoencoder_arch != "gaussian_blur":
         try:
@@ -74,10 +77,19 @@ def get_autoencoder(args):
 
         print(f"Autoencoder: {autoencoder_ckpt_namer(args)}")
 
+    if args.tile_size:
+        from ..models.tiling import tiled_autoencoder
+        autoencoder = tiled_autoencoder(autoencoder, args.tile_size)
+
     return autoencoder
 
 
 def get_dictionary(args):
+    if args.dict_type == "dct":
+        from ..models.encoders import dct_dictionary
+        print(f"Dictionary: analytic DCT, patch size {args.defense_patchsize}")
+        return dct_dictionary(args.defense_patchsize)
+
     dict_filepath = dict_file_namer(args)
     if not path.exists(dict_filepath):
         print(
@@ -0,0 +1,127 @@
+"""
+One-time decoding of ImageFolder datasets into memory-mappable uint8 .npy shards
+"""
+
+import hashlib
+import json
+import os
+import shutil
+from os import path
+
+import numpy as np
+
+
+def folder_fingerprint(folder):
+    """ Hash of relative paths, sizes and modification times of every file in folder """
+
+    fingerprint = hashlib.sha1()
+    for root, dirs, files in os.walk(folder):
+        dirs.sort()
+        for filename in sorted(files):
+            filepath = path.join(root, filename)
+            stat = os.stat(filepath)
+            fingerprint.update(
+                f"{path.relpath(filepath, folder)}:{stat.st_size}:{stat.st_mtime_ns};".encode()
+            )
+    return fingerprint.hexdigest()
+
+
+class ShardedArray(object):
+    """ Read-only view of several memory-mapped arrays as if concatenated along axis 0 """
+
+    def __init__(self, shards):
+        self.shards = shards
+        counts = [len(shard) for shard in shards]
+        self.starts = np.concatenate([[0], np.cumsum(counts)[:-1]]).astype(np.int64)
+        self.shape = (int(sum(counts)),) + tuple(shards[0].shape[1:])
+        self.dtype = shards[0].dtype
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, indices):
+        if isinstance(indices, slice):
+            indices = np.arange(*indices.indices(len(self)))
+        indices = np.asarray(indices, dtype=np.int64)
+
+        shard_ids = np.searchsorted(self.starts, indices, side="right") - 1
+        out = np.empty((len(indices),) + self.shape[1:], dtype=self.dtype)
+        for shard_id in np.unique(shard_ids):
+            mask = shard_ids == shard_id
+            out[mask] = self.shards[shard_id][indices[mask] -
+                                              self.starts[shard_id]]
+        return out
+
+
+def build_image_cache(folder, cache_dir, image_size, shard_size=4096):
+    """ Decodes every image in folder, resizes the shorter side to image_size,
+    center crops to image_size x image_size and writes (N, 3, H, W) uint8 shards """
+
+    from torchvision import datasets, transforms
+
+    if path.exists(cache_dir):
+        shutil.rmtree(cache_dir)
+    os.makedirs(cache_dir)
+
+    fingerprint = folder_fingerprint(folder)
+    dataset = datasets.ImageFolder(folder)
+    resize = transforms.Compose(
+        [transforms.Resize(image_size), transforms.CenterCrop(image_size)]
+    )
+
+    shards = []
+    for shard_start in range(0, len(dataset), shard_size):
+        samples = dataset.samples[shard_start: shard_start + shard_size]
+        images = np.empty((len(samples), 3, image_size,
+                           image_size), dtype=np.uint8)
+        for i, (filepath, _) in enumerate(samples):
+            image = resize(dataset.loader(filepath))
+            images[i] = np.asarray(image, dtype=np.uint8).transpose(2, 0, 1)
+
+        shard_file = f"shard_{len(shards):05d}.npy"
+        np.save(path.join(cache_dir, shard_file), images)
+        shards.append({"file": shard_file, "count": len(samples)})
+
+    np.save(path.join(cache_dir, "labels.npy"),
+            np.array(dataset.targets, dtype=np.int64))
+
+    manifest = {
+        "source": path.abspath(folder),
+        "fingerprint": fingerprint,
+        "image_size": image_size,
+        "classes": dataset.classes,
+        "shards": shards,
+    }
+    # manifest is written last so that an interrupted build is never loaded
+    with open(path.join(cache_dir, "manifest.json"), "w") as f:
+        json.dump(manifest, f)
+
+    return manifest
+
+
+def load_image_cache(folder, cache_dir, image_size):
+    """ Returns (images, targets) with images a ShardedArray of memory maps.
+    The cache is (re)built if missing, made for another size or stale """
+
+    manifest_path = path.join(cache_dir, "manifest.json")
+    manifest = None
+    if path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        if (
+            manifest["image_size"] != image_size
+            or manifest["fingerprint"] != folder_fingerprint(folder)
+        ):
+            manifest = None
+
+    if manifest is None:
+        print(f"Building image cache for {folder} in {cache_dir}")
+        manifest = build_image_cache(folder, cache_dir, image_size)
+
+    shards = [
+        np.load(path.join(cache_dir, shard["file"]), mmap_mode="r")
+        for shard in manifest["shards"]
+    ]
+    targets = np.load(path.join(cache_dir, "labels.npy")).tolist()
+
+    return ShardedArray(shards), targets
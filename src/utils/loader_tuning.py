@@ -0,0 +1,139 @@
+"""
+Picks DataLoader settings by measuring them on the current machine, and times
+how long training/attack loops wait for data
+"""
+
+import inspect
+import json
+import os
+import socket
+import time
+from os import path
+
+import torch
+
+DEFAULT_LOADER_CONFIG = {"num_workers": 2}
+
+
+def supported_loader_options():
+    return set(inspect.signature(torch.utils.data.DataLoader.__init__).parameters)
+
+
+def candidate_loader_configs(use_cuda):
+    options = supported_loader_options()
+    nb_cpus = os.cpu_count() or 1
+
+    candidates = []
+    for num_workers in sorted({0, 2, 4, 8, nb_cpus}):
+        if num_workers > nb_cpus:
+            continue
+        for pin_memory in ([False, True] if use_cuda else [False]):
+            config = {"num_workers": num_workers, "pin_memory": pin_memory}
+            if num_workers > 0 and "persistent_workers" in options:
+                config["persistent_workers"] = True
+            if num_workers > 0 and "prefetch_factor" in options:
+                for prefetch_factor in [2, 4]:
+                    candidates.append(
+                        dict(config, prefetch_factor=prefetch_factor))
+            else:
+                candidates.append(config)
+
+    return candidates
+
+
+def measure_loader_config(dataset, batch_size, config, nb_batches=30):
+    """ Images per second over nb_batches, after the first batch so that worker
+    startup is not counted """
+
+    shuffle = not isinstance(dataset, torch.utils.data.IterableDataset)
+    loader = torch.utils.data.DataLoader(
+        dataset, batch_size=batch_size, shuffle=shuffle, **config)
+    iterator = iter(loader)
+    next(iterator)
+
+    nb_images = 0
+    start = time.time()
+    for _ in range(nb_batches):
+        try:
+            images, _ = next(iterator)
+        except StopIteration:
+            break
+        nb_images += images.shape[0]
+
+    return nb_images / (time.time() - start)
+
+
+def loader_config_filepath(args, name):
+    return path.join(
+        args.directory, "data", "loader_configs", f"{socket.gethostname()}_{args.dataset}_{name}.json"
+    )
+
+
+def get_loader_config(args, name, dataset, batch_size):
+    """
+    DataLoader keyword arguments for the loader called name ("train"/"test").
+    With --data_autotune every candidate is measured and the fastest one is
+    cached per dataset and host; otherwise the cached choice is reused, or
+    DEFAULT_LOADER_CONFIG if there is none.
+    """
+
+    filepath = loader_config_filepath(args, name)
+
+    if not args.data_autotune:
+        if path.exists(filepath):
+            with open(filepath) as f:
+                return json.load(f)["config"]
+        return dict(DEFAULT_LOADER_CONFIG)
+
+    use_cuda = not args.no_cuda and torch.cuda.is_available()
+    results = []
+    for config in candidate_loader_configs(use_cuda):
+        images_per_sec = measure_loader_config(dataset, batch_size, config)
+        print(f"Loader {name} {config}: {images_per_sec:.0f} img/s")
+        results.append({"config": config, "images_per_sec": images_per_sec})
+
+    best = max(results, key=lambda result: result["images_per_sec"])
+    print(f"Loader {name}: using {best['config']}")
+
+    if not path.exists(path.dirname(filepath)):
+        os.makedirs(path.dirname(filepath))
+    with open(filepath, "w") as f:
+        json.dump(dict(best, batch_size=batch_size, results=results), f, indent=1)
+
+    return best["config"]
+
+
+class TimedLoader(object):
+    """
+    Wraps a loader and accumulates the time spent waiting for batches, so that
+    loops can report data-wait against total time. Everything else is passed
+    through to the wrapped loader.
+    """
+
+    def __init__(self, loader):
+        self.loader = loader
+        self.reset()
+
+    def __getattr__(self, key):
+        if key == "loader":
+            raise AttributeError(key)
+        return getattr(self.loader, key)
+
+    def __len__(self):
+        return len(self.loader)
+
+    def reset(self):
+        self.data_time = 0.0
+        self.nb_batches = 0
+
+    def __iter__(self):
+        iterator = iter(self.loader)
+        while True:
+            start = time.time()
+            try:
+                batch = next(iterator)
+            except StopIteration:
+                return
+            self.data_time += time.time() - start
+            self.nb_batches += 1
+            yield batch
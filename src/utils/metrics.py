@@ -0,0 +1,92 @@
+"""
+Epoch metrics that stay on the device until the epoch ends, and throughput
+telemetry (images/sec, step-time percentiles). Data-wait time is measured by
+TimedLoader (utils/loader_tuning.py), not here.
+"""
+
+import time
+from collections import defaultdict
+
+import numpy as np
+import torch
+
+
+class EpochMetrics(object):
+    """
+    Accumulates per-batch tensors on their device without synchronizing.
+    Iterating a loader through timed() records the epoch's duration and how
+    long the loop body took for each batch (step). values() transfers
+    everything at once, the only sync of the epoch.
+
+    Step times are host times: on GPU they measure launch cost unless the
+    queue is full, which it is in steady state.
+    """
+
+    def __init__(self):
+        self.sums = {}
+        self.nb_samples = 0
+        self.step_times = []
+        self.start = None
+        self.end = None
+
+    def add(self, **values):
+        for name, value in values.items():
+            value = value.detach()
+            if name in self.sums:
+                self.sums[name] += value
+            else:
+                self.sums[name] = value.clone()
+
+    def count(self, nb_samples):
+        self.nb_samples += nb_samples
+
+    def timed(self, loader):
+        self.start = time.time()
+        iterator = iter(loader)
+        while True:
+            try:
+                batch = next(iterator)
+            except StopIteration:
+                break
+            step_start = time.time()
+            yield batch
+            self.step_times.append(time.time() - step_start)
+        self.end = time.time()
+
+    def values(self):
+        """ Accumulated sums as floats (lists for vector sums), with one
+        device to host transfer. Names never added, e.g. after an empty
+        loader or shard, read as 0 """
+        if not self.sums:
+            return defaultdict(float)
+        flat = torch.cat([value.float().reshape(-1)
+                          for value in self.sums.values()]).tolist()
+
+        values = defaultdict(float)
+        start = 0
+        for name, value in self.sums.items():
+            if value.dim() == 0:
+                values[name] = flat[start]
+            else:
+                values[name] = flat[start: start + value.numel()]
+            start += value.numel()
+        return values
+
+    def telemetry(self):
+        end = self.end if self.end is not None else time.time()
+        elapsed = max(end - (self.start or end), 1e-12)
+        step_times = np.array(self.step_times or [0.0]) * 1000
+        return {
+            "images_per_sec": self.nb_samples / elapsed,
+            "step_ms_p50": float(np.percentile(step_times, 50)),
+            "step_ms_p90": float(np.percentile(step_times, 90)),
+            "step_ms_p99": float(np.percentile(step_times, 99)),
+        }
+
+    def report(self):
+        telemetry = self.telemetry()
+        return (
+            f"{telemetry['images_per_sec']:.0f} img/s, "
+            f"step p50/p90/p99 {telemetry['step_ms_p50']:.1f}/"
+            f"{telemetry['step_ms_p90']:.1f}/{telemetry['step_ms_p99']:.1f} ms"
+        )
@@ -17,6 +17,12 @@ def dict_params_string(args):
             "n": args.dict_nbatoms,
             "it": args.dict_iter,
         }
+        if args.dict_dedup_step > 0:
+            dictionary_parameters["dd"] = args.dict_dedup_step
+        if args.dict_coreset_size > 0:
+            dictionary_parameters["cs"] = args.dict_coreset_size
+        if args.dict_learner != "torch":
+            dictionary_parameters["lr"] = args.dict_learner
 
         dictionary_parameters_string = ""
         for key in dictionary_parameters:
@@ -31,6 +37,9 @@ def autoencoder_params_string(args):
 
     autoencoder_params_string = dict_params_string(args)
 
+    if args.dict_prune_nbatoms:
+        autoencoder_params_string += f"_pr_{args.dict_prune_nbatoms}"
+
     autoencoder_params_string += f"_{args.autoencoder_arch}"
 
     autoencoder_params_string += f"_{args.optimizer}"
@@ -85,6 +94,8 @@ def adv_training_params_string(args):
             adv_training_params_string += (
                 f"_a_{np.int(np.round(args.adv_training_alpha*255))}"
             )
+        if args.adv_training_attack == "free":
+            adv_training_params_string += f"_m_{args.adv_training_free_replays}"
 
     return adv_training_params_string
 
@@ -144,6 +155,12 @@ def attack_params_string(args):
     return attack_params_string
 
 
+def shard_string(args):
+    if args.num_shards > 1:
+        return f"_shard_{args.shard_index}_of_{args.num_shards}"
+    return ""
+
+
 def dict_file_namer(args):
 
     data_dir = args.directory + "data/"
@@ -155,6 +172,31 @@ def dict_file_namer(args):
     return dict_filepath
 
 
+def dict_snapshot_namer(args):
+
+    return dict_file_namer(args)[: -len(".npz")] + "_snapshot.pt"
+
+
+def code_cache_namer(args, train):
+
+    file_path = args.directory + f"data/code_cache/{args.dataset}/"
+
+    file_path += dict_params_string(args)
+    if args.dict_prune_nbatoms:
+        file_path += f"_pr_{args.dict_prune_nbatoms}"
+    file_path += f"_T_{args.top_T}"
+    if train and args.code_cache_augment:
+        file_path += "_aug"
+    file_path += "_train" if train else "_test"
+
+    return file_path
+
+
+def compiled_dir_namer(args):
+
+    return args.directory + f"checkpoints/compiled/{args.dataset}/"
+
+
 def autoencoder_ckpt_namer(args):
 
     file_path = args.directory + f"checkpoints/autoencoders/{args.dataset}/"
@@ -165,6 +207,17 @@ def autoencoder_ckpt_namer(args):
     return file_path
 
 
+def autoencoder_state_namer(args):
+
+    file_path = args.directory + f"checkpoints/training_state/autoencoders/{args.dataset}/"
+
+    file_path += autoencoder_params_string(args)
+
+    file_path += ".pt"
+
+    return file_path
+
+
 def autoencoder_log_namer(args):
 
     file_path = args.directory + f"logs/{args.dataset}/"
@@ -176,6 +229,19 @@ def autoencoder_log_namer(args):
     return file_path
 
 
+def autoencoder_sweep_log_namer(args, nb_variants):
+
+    file_path = args.directory + f"logs/{args.dataset}/"
+
+    file_path += "sweep_" + dict_params_string(args)
+
+    file_path += f"_{nb_variants}_variants_ep_{args.autoencoder_epochs}"
+
+    file_path += ".log"
+
+    return file_path
+
+
 def classifier_ckpt_namer(args):
 
     file_path = args.directory + f"checkpoints/classifiers/{args.dataset}/"
@@ -187,6 +253,17 @@ def classifier_ckpt_namer(args):
     return file_path
 
 
+def classifier_state_namer(args):
+
+    file_path = args.directory + f"checkpoints/training_state/classifiers/{args.dataset}/"
+
+    file_path += classifier_params_string(args)
+
+    file_path += ".pt"
+
+    return file_path
+
+
 def classifier_log_namer(args):
 
     file_path = args.directory + f"logs/{args.dataset}/"
@@ -205,8 +282,10 @@ def attack_file_namer(args):
     file_path += attack_params_string(args)
     file_path += "_"
     file_path += classifier_params_string(args)
+    file_path += shard_string(args)
 
-    file_path += ".npy"
+    # directory holding manifest.json and the chunks, see utils/attack_files.py
+    file_path += ".attack"
 
     return file_path
 
@@ -218,6 +297,7 @@ def attack_log_namer(args):
     file_path += attack_params_string(args)
     file_path += "_"
     file_path += classifier_params_string(args)
+    file_path += shard_string(args)
 
     file_path += ".log"
 
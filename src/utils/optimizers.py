@@ -0,0 +1,61 @@
+"""
+Optimizer and learning rate scheduler of autoencoder training, shared by
+train_autoencoder.py and train_autoencoder_sweep.py so that a swept variant
+trains exactly as the same autoencoder trained alone
+"""
+
+import torch
+import torch.optim as optim
+
+
+def get_optimizer(args, parameters):
+    if args.optimizer == "sgd":
+        return optim.SGD(
+            parameters,
+            lr=args.lr,
+            momentum=args.momentum,
+            weight_decay=args.weight_decay,
+        )
+    elif args.optimizer == "rms":
+        return optim.RMSprop(
+            parameters,
+            lr=args.lr,
+            weight_decay=args.weight_decay,
+            momentum=args.momentum)
+    elif args.optimizer == "adam":
+        return optim.Adam(
+            parameters,
+            lr=args.lr,
+            weight_decay=args.weight_decay,
+        )
+    else:
+        raise NotImplementedError
+
+
+def get_scheduler(args, optimizer, nb_batches):
+    """ The cyclic schedule spans args.autoencoder_epochs epochs of
+    nb_batches steps """
+    if args.lr_scheduler == "cyc":
+        lr_steps = args.autoencoder_epochs * nb_batches
+        return torch.optim.lr_scheduler.CyclicLR(
+            optimizer,
+            base_lr=args.lr_min,
+            max_lr=args.lr_max,
+            step_size_up=lr_steps / 2,
+            step_size_down=lr_steps / 2,
+        )
+    elif args.lr_scheduler == "step":
+        return torch.optim.lr_scheduler.MultiStepLR(
+            optimizer,
+            milestones=[35],
+            gamma=0.1)
+    elif args.lr_scheduler == "mult":
+        def lr_fun(epoch):
+            if epoch % 3 == 0:
+                return 0.962
+            else:
+                return 1.0
+
+        return torch.optim.lr_scheduler.MultiplicativeLR(optimizer, lr_fun)
+    else:
+        raise NotImplementedError
@@ -0,0 +1,78 @@
+"""
+Uniform sample of a stream of patches in bounded memory (reservoir sampling),
+so dictionaries are learned from a fixed budget whatever the dataset size.
+"""
+
+import numpy as np
+import torch
+
+
+def reservoir_capacity(memory_mb, nb_features, dtype="uint8"):
+    """ Number of patches of nb_features values that fit in memory_mb """
+    return int(memory_mb * 2 ** 20) // (nb_features * np.dtype(dtype).itemsize)
+
+
+class PatchReservoir(object):
+    """
+    Keeps a uniform random sample of at most capacity of the patches given to
+    add() (Algorithm R, vectorized per batch). Patches are rows of values in
+    [0, 1] (or uint8 in [0, 255]), stored as uint8 or float32. uint8 is exact
+    for patches of 8-bit images and takes a quarter of the memory.
+    """
+
+    def __init__(self, capacity, nb_features, dtype="uint8", seed=None):
+        if capacity < 1:
+            raise ValueError("The memory budget does not fit a single patch")
+        self.capacity = capacity
+        self.dtype = np.dtype(dtype)
+        self.storage = np.empty((capacity, nb_features), dtype=self.dtype)
+        self.nb_seen = 0
+        self.rng = np.random.RandomState(seed)
+
+    def __len__(self):
+        return min(self.nb_seen, self.capacity)
+
+    def _convert(self, patches):
+        if isinstance(patches, torch.Tensor):
+            patches = patches.cpu().numpy()
+        patches = patches.reshape(patches.shape[0], -1)
+        if patches.dtype == self.dtype:
+            return patches
+        if self.dtype == np.uint8:
+            return np.clip(np.rint(patches * 255.0), 0, 255).astype(np.uint8)
+        if patches.dtype == np.uint8:
+            return patches.astype(self.dtype) / 255.0
+        return patches.astype(self.dtype)
+
+    def add(self, patches):
+        patches = self._convert(patches)
+        nb_patches = patches.shape[0]
+
+        # fill the free slots first
+        nb_free = max(self.capacity - self.nb_seen, 0)
+        nb_fill = min(nb_free, nb_patches)
+        self.storage[self.nb_seen: self.nb_seen + nb_fill] = patches[:nb_fill]
+
+        # patch number t (0 based) replaces a random slot with probability
+        # capacity / (t + 1)
+        rest = patches[nb_fill:]
+        if len(rest):
+            positions = np.arange(
+                self.nb_seen + nb_fill, self.nb_seen + nb_patches)
+            slots = (self.rng.random_sample(len(rest))
+                     * (positions + 1)).astype(np.int64)
+            kept = slots < self.capacity
+            # numpy keeps the last of repeated indices, as a sequential pass would
+            self.storage[slots[kept]] = rest[kept]
+
+        self.nb_seen += nb_patches
+
+    def patches(self, raw=False):
+        """ The sample as float32 values in [0, 1], or as stored with raw
+        (uint8 in [0, 255]) to avoid a float copy """
+        sample = self.storage[: len(self)]
+        if raw:
+            return sample
+        if self.dtype == np.uint8:
+            return sample.astype(np.float32) / 255.0
+        return sample.astype(np.float32, copy=False)
@@ -0,0 +1,111 @@
+"""
+Reduces a sample of patches before dictionary learning: near-duplicates
+(flat sky, background) are dropped by quantized keys, then a diverse subset
+can be picked with k-means++ seeding in a few batched rounds. Patches are
+rows of values in [0, 1] or uint8 in [0, 255], as PatchReservoir stores them.
+"""
+
+import numpy as np
+import torch
+
+
+def as_float(patches):
+    if patches.dtype == np.uint8:
+        return patches.astype(np.float32) / 255.0
+    return patches.astype(np.float32, copy=False)
+
+
+def patch_keys(patches, step):
+    """
+    Patches with the same key are near-duplicates: same mean and contrast,
+    and same contrast-normalized shape, each up to step. Below a contrast of
+    step the shape is noise, it is left out so flat patches share one key
+    per mean.
+    """
+    patches = as_float(patches)
+    mean = patches.mean(axis=1, keepdims=True)
+    centered = patches - mean
+    contrast = np.linalg.norm(centered, axis=1, keepdims=True)
+    shape = np.where(contrast >= step, centered / np.maximum(contrast, 1e-6), 0.0)
+
+    features = np.concatenate([mean, contrast, shape], axis=1)
+    keys = np.ascontiguousarray(np.rint(features / step).astype(np.int32))
+    # one opaque value per row, hashed and sorted much faster than rows
+    return keys.view(np.dtype((np.void, keys.dtype.itemsize * keys.shape[1]))).ravel()
+
+
+def deduplicate_patches(patches, step, batch_size=1000000):
+    """ Indices of one patch per key, in the original order """
+    keys = np.concatenate([
+        patch_keys(patches[start: start + batch_size], step)
+        for start in range(0, len(patches), batch_size)
+    ])
+    _, first_indices = np.unique(keys, return_index=True)
+    return np.sort(first_indices)
+
+
+def kmeans_plus_plus_indices(patches, nb_selected, seed=None, device=None, nb_rounds=10, block_size=2 ** 24):
+    """
+    k-means++ seeding, picking centers in nb_rounds batches as k-means||
+    does: each round draws patches without replacement with probability
+    proportional to their squared distance to the closest patch selected so
+    far, so the selection covers the patch distribution instead of its dense
+    regions. Costs O(len(patches) * nb_selected * nb_features) flops, done as
+    matrix products of block_size distances, and nb_rounds host syncs
+    (sequential k-means++ needs nb_selected syncs and passes over patches).
+    Patches drawn in the same round can be close to each other, more rounds
+    get nearer to sequential seeding.
+    """
+    nb_patches = len(patches)
+    if nb_selected >= nb_patches:
+        return np.arange(nb_patches)
+
+    generator = torch.Generator()
+    if seed is not None:
+        generator.manual_seed(seed)
+
+    X = torch.from_numpy(as_float(patches)).to(device or "cpu")
+    squared_norms = (X ** 2).sum(dim=1)
+    min_distances = torch.full((nb_patches,), float("inf"), device=X.device)
+
+    def update_distances(centers):
+        rows = max(1, block_size // len(centers))
+        center_patches, center_norms = X[centers], squared_norms[centers]
+        for start in range(0, nb_patches, rows):
+            block = slice(start, start + rows)
+            distances = (squared_norms[block].unsqueeze(1) + center_norms
+                         - 2.0 * X[block] @ center_patches.t()).clamp(min=0.0)
+            torch.min(min_distances[block], distances.min(dim=1)[0],
+                      out=min_distances[block])
+
+    selected = torch.randint(nb_patches, (1,), generator=generator).to(X.device)
+    update_distances(selected)
+    for round_idx in range(nb_rounds):
+        nb_candidates = int((min_distances > 0).sum().item())
+        nb_drawn = min(
+            -(-(nb_selected - len(selected)) // (nb_rounds - round_idx)), nb_candidates)
+        if nb_drawn <= 0:
+            # done, or every patch is a copy of a selected one
+            break
+        # weighted sampling without replacement: the nb_drawn smallest
+        # Exp(1) / weight keys
+        keys = -torch.log(torch.rand(nb_patches, generator=generator)).to(X.device) / min_distances
+        drawn = torch.topk(keys, nb_drawn, largest=False)[1]
+        selected = torch.cat([selected, drawn])
+        update_distances(drawn)
+
+    return np.sort(selected.cpu().numpy())
+
+
+def reconstruction_error(patches, dictionary, alpha, nb_iter=100, device=None):
+    """ Mean squared error per value and mean number of nonzero codes of the
+    lasso codes of patches, dictionary in row notation (components_) """
+    from .sparse_coding import fista
+
+    X = torch.from_numpy(as_float(patches)).to(device or "cpu")
+    D = torch.from_numpy(np.asarray(dictionary, dtype=np.float32)).to(X.device)
+    with torch.no_grad():
+        codes = fista(X, D, alpha, nb_iter)
+        error = ((codes @ D - X) ** 2).mean().item()
+        nonzeros = (codes != 0).float().sum(dim=1).mean().item()
+    return error, nonzeros
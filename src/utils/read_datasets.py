@@ -4,7 +4,14 @@ from torchvision import datasets, transforms
 
 import numpy as np
 from os import path
-from .namers import attack_file_namer
+from .attack_files import (
+    attack_filepath,
+    attack_initialization_filepath,
+    attack_file_loader,
+)
+from .loader_tuning import get_loader_config
+from .dataset_session import CIFAR10Arrays
+from .samplers import train_sampler, test_sampler
 
 
 def tiny_imagenet(args):
@@ -15,8 +22,9 @@ def tiny_imagenet(args):
     test_dir = path.join(data_dir, "original_dataset",
                          "tiny-imagenet-200", "val")
 
-    use_cuda = not args.no_cuda and torch.cuda.is_available()
-    kwargs = {"num_workers": 4, "pin_memory": True} if use_cuda else {}
+    if args.data_backend == "tensor":
+        from .fast_loaders import image_folder_tensor
+        return image_folder_tensor(args, train_dir, test_dir)
 
     transform_train = transforms.Compose(
         [
@@ -28,83 +36,35 @@ def tiny_imagenet(args):
 
     transform_test = transforms.Compose([transforms.ToTensor(), ])
 
+    if args.data_backend == "tar":
+        from .tar_shards import tar_shard_loaders
+        return tar_shard_loaders(args, train_dir, test_dir, transform_train, transform_test)
+
     trainset = datasets.ImageFolder(train_dir, transform=transform_train)
     train_loader = torch.utils.data.DataLoader(
-        trainset, batch_size=args.train_batch_size, shuffle=True, num_workers=2
+        trainset,
+        batch_size=args.train_batch_size,
+        sampler=train_sampler(args, len(trainset)),
+        **get_loader_config(args, "train", trainset, args.train_batch_size),
     )
 
     testset = datasets.ImageFolder(test_dir, transform=transform_test)
     test_loader = torch.utils.data.DataLoader(
-        testset, batch_size=args.test_batch_size, shuffle=False, num_workers=2
+        testset,
+        batch_size=args.test_batch_size,
+        sampler=test_sampler(args, len(testset)),
+        **get_loader_config(args, "test", testset, args.test_batch_size),
     )
 
     return train_loader, test_loader
 
 
 def tiny_imagenet_from_file(args):
-    use_cuda = not args.no_cuda and torch.cuda.is_available()
-    kwargs = {"num_workers": 1, "pin_memory": True} if use_cuda else {}
-
-    # Read
-    if args.attack_box_type == "other" and args.attack_otherbox_type == "transfer":
-        filepath = args.directory + "data/attacked_dataset/" + \
-            args.dataset + "/" + args.attack_transfer_file
-
-    elif args.attack_box_type == "white":
-        filepath = attack_file_namer(args)
-    else:
-        raise AssertionError
-
-    test_images = np.load(filepath)
-
-    data_dir = args.directory + "data/"
-    test_dir = path.join(data_dir, "original_dataset",
-                         "tiny-imagenet-200", "val")
-    transform_test = transforms.Compose([transforms.ToTensor(), ])
-    testset = datasets.ImageFolder(test_dir, transform=transform_test)
-    test_loader = torch.utils.data.DataLoader(
-        testset, batch_size=args.test_batch_size, shuffle=False, num_workers=2
-    )
-
-    tensor_x = torch.Tensor(test_images / np.max(test_images))
-    tensor_y = torch.Tensor(test_loader.dataset.targets).long()
-
-    tensor_data = torch.utils.data.TensorDataset(tensor_x, tensor_y)
-    attack_loader = torch.utils.data.DataLoader(
-        tensor_data, batch_size=args.test_batch_size, shuffle=False, **kwargs
-    )
-
-    return attack_loader
+    return attack_file_loader(args, attack_filepath(args))
 
 
 def tiny_imagenet_initialization_from_file(args):
-    use_cuda = not args.no_cuda and torch.cuda.is_available()
-    kwargs = {"num_workers": 1, "pin_memory": True} if use_cuda else {}
-
-    # Read
-    filepath = args.directory + "data/attacked_dataset/" + \
-        args.dataset + "/" + args.attack_initialization_file
-
-    test_images = np.load(filepath)
-
-    data_dir = args.directory + "data/"
-    test_dir = path.join(data_dir, "original_dataset",
-                         "tiny-imagenet-200", "val")
-    transform_test = transforms.Compose([transforms.ToTensor(), ])
-    testset = datasets.ImageFolder(test_dir, transform=transform_test)
-    test_loader = torch.utils.data.DataLoader(
-        testset, batch_size=args.test_batch_size, shuffle=False, num_workers=2
-    )
-
-    tensor_x = torch.Tensor(test_images / np.max(test_images))
-    tensor_y = torch.Tensor(test_loader.dataset.targets).long()
-
-    tensor_data = torch.utils.data.TensorDataset(tensor_x, tensor_y)
-    attack_loader = torch.utils.data.DataLoader(
-        tensor_data, batch_size=args.test_batch_size, shuffle=False, **kwargs
-    )
-
-    return attack_loader
+    return attack_file_loader(args, attack_initialization_filepath(args))
 
 
 def imagenette(args):
@@ -115,8 +75,9 @@ def imagenette(args):
     test_dir = path.join(data_dir, "original_dataset",
                          "imagenette2-160", "val")
 
-    use_cuda = not args.no_cuda and torch.cuda.is_available()
-    kwargs = {"num_workers": 4, "pin_memory": True} if use_cuda else {}
+    if args.data_backend == "tensor":
+        from .fast_loaders import image_folder_tensor
+        return image_folder_tensor(args, train_dir, test_dir)
 
     transform_train = transforms.Compose(
         [
@@ -133,89 +94,42 @@ def imagenette(args):
         ]
     )
 
+    if args.data_backend == "tar":
+        from .tar_shards import tar_shard_loaders
+        return tar_shard_loaders(args, train_dir, test_dir, transform_train, transform_test)
+
     trainset = datasets.ImageFolder(train_dir, transform=transform_train)
     train_loader = torch.utils.data.DataLoader(
-        trainset, batch_size=args.train_batch_size, shuffle=True, num_workers=2
+        trainset,
+        batch_size=args.train_batch_size,
+        sampler=train_sampler(args, len(trainset)),
+        **get_loader_config(args, "train", trainset, args.train_batch_size),
     )
 
     testset = datasets.ImageFolder(test_dir, transform=transform_test)
     test_loader = torch.utils.data.DataLoader(
-        testset, batch_size=args.test_batch_size, shuffle=False, num_workers=2
+        testset,
+        batch_size=args.test_batch_size,
+        sampler=test_sampler(args, len(testset)),
+        **get_loader_config(args, "test", testset, args.test_batch_size),
     )
 
     return train_loader, test_loader
 
 
 def imagenette_from_file(args):
-    use_cuda = not args.no_cuda and torch.cuda.is_available()
-    kwargs = {"num_workers": 1, "pin_memory": True} if use_cuda else {}
-
-    # Read
-    if args.attack_box_type == "other" and args.attack_otherbox_type == "transfer":
-        filepath = args.directory + "data/attacked_dataset/" + \
-            args.dataset + "/" + args.attack_transfer_file
-
-    elif args.attack_box_type == "white":
-        filepath = attack_file_namer(args)
-    else:
-        raise AssertionError
-
-    test_images = np.load(filepath)
-
-    data_dir = args.directory + "data/"
-    test_dir = path.join(data_dir, "original_dataset",
-                         "imagenette2-160", "val")
-    transform_test = transforms.Compose([transforms.ToTensor(), ])
-    testset = datasets.ImageFolder(test_dir, transform=transform_test)
-    test_loader = torch.utils.data.DataLoader(
-        testset, batch_size=args.test_batch_size, shuffle=False, num_workers=2
-    )
-
-    tensor_x = torch.Tensor(test_images / np.max(test_images))
-    tensor_y = torch.Tensor(test_loader.dataset.targets).long()
-
-    tensor_data = torch.utils.data.TensorDataset(tensor_x, tensor_y)
-    attack_loader = torch.utils.data.DataLoader(
-        tensor_data, batch_size=args.test_batch_size, shuffle=False, **kwargs
-    )
-
-    return attack_loader
+    return attack_file_loader(args, attack_filepath(args))
 
 
 def imagenette_initialization_from_file(args):
-    use_cuda = not args.no_cuda and torch.cuda.is_available()
-    kwargs = {"num_workers": 1, "pin_memory": True} if use_cuda else {}
-
-    # Read
-    filepath = args.directory + "data/attacked_dataset/" + \
-        args.dataset + "/" + args.attack_initialization_file
-
-    test_images = np.load(filepath)
-
-    data_dir = args.directory + "data/"
-    test_dir = path.join(data_dir, "original_dataset",
-                         "imagenette2-160", "val")
-    transform_test = transforms.Compose([transforms.ToTensor(), ])
-    testset = datasets.ImageFolder(test_dir, transform=transform_test)
-    test_loader = torch.utils.data.DataLoader(
-        testset, batch_size=args.test_batch_size, shuffle=False, num_workers=2
-    )
-
-    tensor_x = torch.Tensor(test_images / np.max(test_images))
-    tensor_y = torch.Tensor(test_loader.dataset.targets).long()
-
-    tensor_data = torch.utils.data.TensorDataset(tensor_x, tensor_y)
-    attack_loader = torch.utils.data.DataLoader(
-        tensor_data, batch_size=args.test_batch_size, shuffle=False, **kwargs
-    )
-
-    return attack_loader
+    return attack_file_loader(args, attack_initialization_filepath(args))
 
 
 def cifar10(args):
 
-    use_cuda = not args.no_cuda and torch.cuda.is_available()
-    kwargs = {"num_workers": 4, "pin_memory": True} if use_cuda else {}
+    if args.data_backend == "tensor":
+        from .fast_loaders import cifar10_tensor
+        return cifar10_tensor(args)
 
     transform_train = transforms.Compose(
         [
@@ -227,90 +141,28 @@ def cifar10(args):
 
     transform_test = transforms.Compose([transforms.ToTensor(), ])
 
-    trainset = datasets.CIFAR10(
-        root=args.directory + "data/original_dataset",
-        train=True,
-        download=True,
-        transform=transform_train,
-    )
+    trainset = CIFAR10Arrays(args, train=True, transform=transform_train)
     train_loader = torch.utils.data.DataLoader(
-        trainset, batch_size=args.train_batch_size, shuffle=True, num_workers=2
+        trainset,
+        batch_size=args.train_batch_size,
+        sampler=train_sampler(args, len(trainset)),
+        **get_loader_config(args, "train", trainset, args.train_batch_size),
     )
 
-    testset = datasets.CIFAR10(
-        root=args.directory + "data/original_dataset",
-        train=False,
-        download=True,
-        transform=transform_test,
-    )
+    testset = CIFAR10Arrays(args, train=False, transform=transform_test)
     test_loader = torch.utils.data.DataLoader(
-        testset, batch_size=args.test_batch_size, shuffle=False, num_workers=2
+        testset,
+        batch_size=args.test_batch_size,
+        sampler=test_sampler(args, len(testset)),
+        **get_loader_config(args, "test", testset, args.test_batch_size),
     )
 
     return train_loader, test_loader
 
 
 def cifar10_from_file(args):
-
-    use_cuda = not args.no_cuda and torch.cuda.is_available()
-    kwargs = {"num_workers": 1, "pin_memory": True} if use_cuda else {}
-
-    # Read
-    if args.attack_box_type == "other" and args.attack_otherbox_type == "transfer":
-        filepath = args.directory + "data/attacked_dataset/" + \
-            args.dataset + "/" + args.attack_transfer_file
-
-    elif args.attack_box_type == "white":
-        filepath = attack_file_namer(args)
-    else:
-        raise AssertionError
-
-    test_images = np.load(filepath)
-
-    cifar10 = datasets.CIFAR10(
-        path.join(args.directory, "data/original_dataset"),
-        train=False,
-        transform=None,
-        target_transform=None,
-        download=False,
-    )
-
-    tensor_x = torch.Tensor(test_images / np.max(test_images))
-    tensor_y = torch.Tensor(cifar10.targets).long()
-
-    tensor_data = torch.utils.data.TensorDataset(tensor_x, tensor_y)
-    attack_loader = torch.utils.data.DataLoader(
-        tensor_data, batch_size=args.test_batch_size, shuffle=False, **kwargs
-    )
-
-    return attack_loader
+    return attack_file_loader(args, attack_filepath(args))
 
 
 def cifar10_initialization_from_file(args):
-
-    use_cuda = not args.no_cuda and torch.cuda.is_available()
-    kwargs = {"num_workers": 1, "pin_memory": True} if use_cuda else {}
-
-    # Read
-    filepath = args.directory + "data/attacked_dataset/" + \
-        args.dataset + "/" + args.attack_initialization_file
-
-    test_images = np.load(filepath)
-
-    cifar10 = datasets.CIFAR10(
-        path.join(args.directory, "data/original_dataset"),
-        train=False,
-        transform=None,
-        target_transform=None,
-        download=False,
-    )
-
-    tensor_x = torch.Tensor(test_images / np.max(test_images))
-    tensor_y = torch.Tensor(cifar10.targets).long()
-
-    tensor_data = torch.utils.data.TensorDataset(tensor_x, tensor_y)
-    attack_loader = torch.utils.data.DataLoader(
-        tensor_data, batch_size=args.test_batch_size, shuffle=False, **kwargs
-    )
-
-    return attack_loader
+    return attack_file_loader(args, attack_initialization_filepath(args))
@@ -0,0 +1,123 @@
+"""
+Deterministic samplers that can resume mid-epoch and split data between processes
+"""
+
+import math
+
+import torch
+
+
+class ResumableSampler(torch.utils.data.Sampler):
+    """
+    The global order of an epoch depends only on (seed, epoch): a random
+    permutation if shuffle, the identity otherwise. Shard k of N gets every
+    N-th position of that order starting at k, so the union of the shards is
+    the same global order whatever N is. set_epoch(epoch, start) skips the
+    first start samples of this shard, which is how a run resumes mid-epoch.
+
+    With pad=True the global order is extended by wrapping around until every
+    shard has the same length, which keeps processes that step together in
+    lockstep. Evaluation should use pad=False so no sample is counted twice.
+    """
+
+    def __init__(self, nb_samples, shuffle=True, seed=0, num_shards=1, shard_index=0, pad=False):
+        if not 0 <= shard_index < num_shards:
+            raise ValueError(
+                f"shard_index {shard_index} is not in [0, {num_shards})")
+
+        self.nb_samples = nb_samples
+        self.shuffle = shuffle
+        self.seed = seed
+        self.num_shards = num_shards
+        self.shard_index = shard_index
+        self.pad = pad
+        self.epoch = 0
+        self.start = 0
+
+    def global_order(self):
+        if self.shuffle:
+            generator = torch.Generator()
+            generator.manual_seed(self.seed * 100003 + self.epoch)
+            order = torch.randperm(self.nb_samples, generator=generator)
+        else:
+            order = torch.arange(self.nb_samples)
+
+        if self.pad:
+            total_size = math.ceil(
+                self.nb_samples / self.num_shards) * self.num_shards
+            repeats = math.ceil(total_size / self.nb_samples)
+            order = order.repeat(repeats)[:total_size]
+
+        return order
+
+    def indices(self):
+        """ Global indices this shard visits in the current epoch, from start on """
+        return self.global_order()[self.shard_index:: self.num_shards][self.start:]
+
+    def __iter__(self):
+        return iter(self.indices().tolist())
+
+    def __len__(self):
+        if self.pad:
+            shard_size = math.ceil(self.nb_samples / self.num_shards)
+        else:
+            shard_size = len(range(self.shard_index,
+                                   self.nb_samples, self.num_shards))
+        return max(shard_size - self.start, 0)
+
+    def set_epoch(self, epoch, start=0):
+        self.epoch = epoch
+        self.start = start
+
+    def state_dict(self):
+        return {"seed": self.seed, "epoch": self.epoch, "start": self.start}
+
+    def load_state_dict(self, state_dict):
+        self.seed = state_dict["seed"]
+        self.set_epoch(state_dict["epoch"], state_dict["start"])
+
+
+def train_sampler(args, nb_samples):
+    return ResumableSampler(
+        nb_samples,
+        shuffle=True,
+        seed=args.seed,
+        num_shards=args.num_shards,
+        shard_index=args.shard_index,
+        pad=args.num_shards > 1,
+    )
+
+
+def test_sampler(args, nb_samples):
+    return ResumableSampler(
+        nb_samples,
+        shuffle=False,
+        num_shards=args.num_shards,
+        shard_index=args.shard_index,
+    )
+
+
+def set_loader_epoch(loader, epoch, start_batch=0):
+    """ Reseeds the order of a loader for epoch, whether it samples a map-style
+    dataset or streams an iterable one. A sampled loader then starts at batch
+    start_batch without loading the ones before; a streamed one cannot seek
+    and starts at batch 0. Returns the index of the first batch it yields """
+    if isinstance(loader.dataset, torch.utils.data.IterableDataset):
+        loader.dataset.set_epoch(epoch)
+        return 0
+    loader.sampler.set_epoch(epoch, start_batch * loader.batch_size)
+    return start_batch
+
+
+def loader_size(loader):
+    """ Number of samples one pass over loader yields in this process """
+    if isinstance(loader.dataset, torch.utils.data.IterableDataset):
+        return len(loader.dataset)
+    return len(loader.sampler)
+
+
+def loader_indices(loader):
+    """ Global dataset indices of the samples loader yields, in order """
+    if isinstance(loader.dataset, torch.utils.data.IterableDataset):
+        return loader.dataset.indices(loader.batch_size or 1)
+    return loader.sampler.indices()
@@ -0,0 +1,107 @@
+"""
+Batched sparse coding in matrix form: every sample of a batch is solved at
+once with matrix products, so a batch costs a few GEMMs per iteration and
+runs on all cores (or the GPU) through torch's intra-op parallelism.
+
+Row notation as in sklearn: X is (n_samples, n_features), the dictionary D is
+(n_atoms, n_features) with one atom per row, codes Z are (n_samples, n_atoms).
+"""
+
+import torch
+
+
+def soft_threshold(x, threshold):
+    return torch.sign(x) * torch.clamp(x.abs() - threshold, min=0.0)
+
+
+def lipschitz_constant(gram, nb_iter=50):
+    """ Largest eigenvalue of the (symmetric PSD) Gram matrix by power iteration """
+    vector = torch.ones(gram.shape[0], 1, dtype=gram.dtype, device=gram.device)
+    for _ in range(nb_iter):
+        vector = gram @ vector
+        vector = vector / vector.norm().clamp(min=1e-12)
+    return (vector.t() @ gram @ vector).item()
+
+
+def fista(X, D, alpha, nb_iter=100, Z0=None, tol=1e-6):
+    """
+    Solves min_Z 0.5 * ||X - Z D||^2 + alpha * ||Z||_1 row by row, the same
+    problem sklearn's sparse_encode solves for a regularization of alpha.
+    Z0 warm-starts the iterations.
+    """
+
+    gram = D @ D.t()
+    correlation = X @ D.t()
+    step = 1.0 / max(lipschitz_constant(gram), 1e-12)
+
+    Z = torch.zeros_like(correlation) if Z0 is None else Z0.clone()
+    Y = Z
+    t = 1.0
+    for _ in range(nb_iter):
+        Z_next = soft_threshold(Y - step * (Y @ gram - correlation), step * alpha)
+        t_next = (1.0 + (1.0 + 4.0 * t * t) ** 0.5) / 2.0
+        Y = Z_next + ((t - 1.0) / t_next) * (Z_next - Z)
+
+        change = (Z_next - Z).norm() / Z.norm().clamp(min=1e-12)
+        Z, t = Z_next, t_next
+        if change.item() < tol:
+            break
+
+    return Z
+
+
+def ista(X, D, alpha, nb_iter=100, Z0=None):
+    """ Unaccelerated version of fista, kept for comparisons """
+
+    gram = D @ D.t()
+    correlation = X @ D.t()
+    step = 1.0 / max(lipschitz_constant(gram), 1e-12)
+
+    Z = torch.zeros_like(correlation) if Z0 is None else Z0.clone()
+    for _ in range(nb_iter):
+        Z = soft_threshold(Z - step * (Z @ gram - correlation), step * alpha)
+
+    return Z
+
+
+def batched_solve(A, b):
+    """ Solves A x = b for batches of square A (..., t, t) and b (..., t) """
+    if hasattr(torch, "linalg") and hasattr(torch.linalg, "solve"):
+        return torch.linalg.solve(A, b.unsqueeze(-1)).squeeze(-1)
+    return torch.solve(b.unsqueeze(-1), A)[0].squeeze(-1)
+
+
+def omp(X, D, T, ridge=1e-10):
+    """
+    Orthogonal matching pursuit with exactly T atoms per sample, all samples
+    at once: each step adds the atom most correlated with the residual and
+    refits the coefficients of the support by least squares (batched normal
+    equations). D rows are expected to have unit norm.
+    """
+
+    gram = D @ D.t()
+    correlation = X @ D.t()
+    nb_samples, nb_atoms = correlation.shape
+    rows = torch.arange(nb_samples, device=X.device)
+
+    support = torch.zeros(nb_samples, 0, dtype=torch.long, device=X.device)
+    selected = torch.zeros(nb_samples, nb_atoms, dtype=torch.bool, device=X.device)
+    residual_correlation = correlation
+    coefficients = correlation.new_zeros(nb_samples, 0)
+    for _ in range(T):
+        scores = residual_correlation.abs().masked_fill(selected, -1.0)
+        atoms = scores.argmax(dim=1)
+        selected[rows, atoms] = True
+        support = torch.cat([support, atoms.unsqueeze(1)], dim=1)
+
+        support_gram = gram[support.unsqueeze(2), support.unsqueeze(1)]
+        support_gram = support_gram + ridge * torch.eye(
+            support.shape[1], dtype=X.dtype, device=X.device)
+        coefficients = batched_solve(
+            support_gram, correlation.gather(1, support))
+        residual = X - (coefficients.unsqueeze(1) @ D[support]).squeeze(1)
+        residual_correlation = residual @ D.t()
+
+    Z = torch.zeros_like(correlation)
+    Z.scatter_(1, support, coefficients)
+    return Z
@@ -0,0 +1,250 @@
+"""
+Sequential-read format for ImageFolder datasets: each split is packed into a
+few tar shards that are streamed and decoded by an IterableDataset, so reading
+an epoch opens a handful of files instead of tens of thousands.
+"""
+
+import io
+import json
+import math
+import os
+import random
+import shutil
+import tarfile
+from os import path
+
+import torch
+from PIL import Image
+
+from .image_cache import folder_fingerprint
+
+
+def pack_image_folder(folder, out_dir, nb_shards=16, shuffle=True, seed=0):
+    """ Writes the files of an ImageFolder into nb_shards tar files. Member
+    names are the sample's position in the packed order, labels go to index.json.
+    Training splits are shuffled before packing so that each shard mixes all
+    classes; evaluation splits keep the ImageFolder order. """
+
+    from torchvision import datasets
+
+    if path.exists(out_dir):
+        shutil.rmtree(out_dir)
+    os.makedirs(out_dir)
+
+    fingerprint = folder_fingerprint(folder)
+    dataset = datasets.ImageFolder(folder)
+    samples = list(dataset.samples)
+    if shuffle:
+        random.Random(seed).shuffle(samples)
+
+    shard_size = math.ceil(len(samples) / nb_shards)
+    shards = []
+    for shard_start in range(0, len(samples), shard_size):
+        shard_file = f"shard_{len(shards):05d}.tar"
+        shard_samples = samples[shard_start: shard_start + shard_size]
+        with tarfile.open(path.join(out_dir, shard_file), "w") as tar:
+            for position, (filepath, _) in enumerate(shard_samples, shard_start):
+                extension = path.splitext(filepath)[1]
+                tar.add(filepath, arcname=f"{position:08d}{extension}")
+        shards.append(
+            {"file": shard_file, "start": shard_start, "count": len(shard_samples)})
+
+    index = {
+        "source": path.abspath(folder),
+        "fingerprint": fingerprint,
+        "classes": dataset.classes,
+        "targets": [target for _, target in samples],
+        "shards": shards,
+    }
+    with open(path.join(out_dir, "index.json"), "w") as f:
+        json.dump(index, f)
+
+    return index
+
+
+def load_tar_index(folder, out_dir, shuffle):
+    """ index.json of the packed split, repacking if the source folder changed """
+
+    index_path = path.join(out_dir, "index.json")
+    if path.exists(index_path):
+        with open(index_path) as f:
+            index = json.load(f)
+        if index["fingerprint"] == folder_fingerprint(folder):
+            return index
+
+    print(f"Packing {folder} into tar shards in {out_dir}")
+    return pack_image_folder(folder, out_dir, shuffle=shuffle)
+
+
+class TarShardDataset(torch.utils.data.IterableDataset):
+    """
+    Streams (image, target) pairs out of tar shards. Every (process shard,
+    DataLoader worker) pair is one consumer: with at least as many tar shards
+    as consumers each consumer reads whole tar shards, otherwise every consumer
+    reads all shards and keeps every C-th sample. With shuffle_buffer > 0 the
+    shard order is shuffled per epoch and samples pass through a shuffle buffer.
+    num_workers must be the one of the DataLoader, len() and indices() depend
+    on it.
+    """
+
+    def __init__(
+        self,
+        shard_dir,
+        index,
+        transform=None,
+        shuffle_buffer=0,
+        seed=0,
+        num_shards=1,
+        shard_index=0,
+        num_workers=0,
+    ):
+        super(TarShardDataset, self).__init__()
+        self.shard_dir = shard_dir
+        self.shards = index["shards"]
+        self.targets = index["targets"]
+        self.classes = index["classes"]
+        self.transform = transform
+        self.shuffle_buffer = shuffle_buffer
+        self.seed = seed
+        self.num_shards = num_shards
+        self.shard_index = shard_index
+        self.num_workers = num_workers
+        self.epoch = 0
+
+    def __len__(self):
+        return sum(len(self.positions(*assignment))
+                   for assignment in self.worker_assignments())
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def consumer(self):
+        worker_info = torch.utils.data.get_worker_info()
+        num_workers = worker_info.num_workers if worker_info is not None else 1
+        worker_id = worker_info.id if worker_info is not None else 0
+
+        nb_consumers = self.num_shards * num_workers
+        consumer_id = self.shard_index * num_workers + worker_id
+        return consumer_id, nb_consumers
+
+    def assignment(self, consumer_id, nb_consumers):
+        """ (tar shards to read, sample stride, sample offset) of a consumer """
+        if len(self.shards) >= nb_consumers:
+            return self.shards[consumer_id::nb_consumers], 1, 0
+        return self.shards, nb_consumers, consumer_id
+
+    def worker_assignments(self):
+        """ Assignment of every DataLoader worker of this process """
+        num_workers = max(self.num_workers, 1)
+        return [
+            self.assignment(self.shard_index * num_workers + worker_id,
+                            self.num_shards * num_workers)
+            for worker_id in range(num_workers)
+        ]
+
+    @staticmethod
+    def positions(shards, stride, offset):
+        """ Positions a consumer streams without shuffling, in order """
+        positions = torch.cat([torch.zeros(0, dtype=torch.long)] + [
+            torch.arange(shard["start"], shard["start"] + shard["count"])
+            for shard in shards
+        ])
+        return positions[positions % stride == offset]
+
+    def indices(self, batch_size=1):
+        """ Positions streamed by this process without shuffling, in the
+        order a DataLoader of batch_size yields them """
+        worker_positions = [self.positions(*assignment)
+                            for assignment in self.worker_assignments()]
+        # the DataLoader takes one batch from each worker in turn
+        batches = []
+        for start in range(0, max(len(positions) for positions in worker_positions), batch_size):
+            batches.extend(positions[start: start + batch_size]
+                           for positions in worker_positions)
+        return torch.cat([torch.zeros(0, dtype=torch.long)] + batches)
+
+    def samples(self, shards, stride, offset):
+        for shard in shards:
+            with tarfile.open(path.join(self.shard_dir, shard["file"]), "r|") as tar:
+                for member in tar:
+                    if not member.isfile():
+                        continue
+                    position = int(path.splitext(member.name)[0])
+                    if position % stride != offset:
+                        continue
+
+                    image = Image.open(
+                        io.BytesIO(tar.extractfile(member).read())).convert("RGB")
+                    if self.transform is not None:
+                        image = self.transform(image)
+
+                    yield image, self.targets[position]
+
+    def __iter__(self):
+        consumer_id, nb_consumers = self.consumer()
+        shards, stride, offset = self.assignment(consumer_id, nb_consumers)
+
+        if self.shuffle_buffer <= 0:
+            yield from self.samples(shards, stride, offset)
+            return
+
+        rng = random.Random((self.seed * 100003 + self.epoch)
+                            * 1009 + consumer_id)
+        shards = list(shards)
+        rng.shuffle(shards)
+
+        buffer = []
+        for sample in self.samples(shards, stride, offset):
+            if len(buffer) < self.shuffle_buffer:
+                buffer.append(sample)
+                continue
+            position = rng.randrange(self.shuffle_buffer)
+            yield buffer[position]
+            buffer[position] = sample
+
+        rng.shuffle(buffer)
+        yield from buffer
+
+
+def tar_shard_loaders(args, train_dir, test_dir, transform_train, transform_test):
+    """ Train/test loaders streaming from tar shards under data/tar_shards/ """
+
+    from .loader_tuning import get_loader_config
+
+    shard_root = path.join(args.directory, "data", "tar_shards", args.dataset)
+
+    train_index = load_tar_index(
+        train_dir, path.join(shard_root, "train"), shuffle=True)
+    trainset = TarShardDataset(
+        path.join(shard_root, "train"),
+        train_index,
+        transform=transform_train,
+        shuffle_buffer=2000,
+        seed=args.seed,
+        num_shards=args.num_shards,
+        shard_index=args.shard_index,
+    )
+    loader_config = get_loader_config(
+        args, "train_tar", trainset, args.train_batch_size)
+    # persistent workers would keep the dataset copy of the first epoch
+    loader_config.pop("persistent_workers", None)
+    trainset.num_workers = loader_config.get("num_workers", 0)
+    train_loader = torch.utils.data.DataLoader(
+        trainset, batch_size=args.train_batch_size, **loader_config,
+    )
+
+    test_index = load_tar_index(
+        test_dir, path.join(shard_root, "val"), shuffle=False)
+    testset = TarShardDataset(
+        path.join(shard_root, "val"),
+        test_index,
+        transform=transform_test,
+        num_shards=args.num_shards,
+        shard_index=args.shard_index,
+        num_workers=1,
+    )
+    test_loader = torch.utils.data.DataLoader(
+        testset, batch_size=args.test_batch_size, num_workers=testset.num_workers,
+    )
+
+    return train_loader, test_loader